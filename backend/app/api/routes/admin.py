@@ -3,58 +3,91 @@ from typing import Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import structlog
 
-from app.core.security import require_admin
+from app.core.responses import ORJSONResponse
+from app.core import query_metrics
+from app.core.config import get_settings
+from app.core.pagination import keyset, split_page, count_mode
+from app.core.security import require_admin, invalidate_profile
 from app.core.supabase import get_supabase_admin
-from app.services.cleanup import cleanup_expired_files
+from app.services.cleanup import cleanup_expired_files, release_files_storage
 from app.services.storage import get_r2_storage
+from app.services import blob_store, reference_cache
+from app.services.admin_stats import get_snapshot
 
 logger = structlog.get_logger()
 router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
 
+# Columns returned by the admin lists (plus the embedded names)
+ADMIN_USER_COLUMNS = (
+    "id, full_name, avatar_url, role, status, plan_id, storage_used_bytes, daily_jobs_used, "
+    "lines_used_this_month, created_at, updated_at, subscription_plans(name)"
+)
+ADMIN_TRANSLATION_JOB_COLUMNS = (
+    "id, project_id, user_id, engine, source_lang, target_lang, status, progress, total_lines, "
+    "translated_lines, error_message, created_at, started_at, completed_at"
+)
+ADMIN_EXPORT_JOB_COLUMNS = (
+    "id, project_id, user_id, mode, resolution, video_codec, status, progress, "
+    "output_file_size_bytes, error_message, created_at, started_at, completed_at"
+)
+ADMIN_STORED_FILE_COLUMNS = (
+    "id, user_id, project_id, file_type, storage_path, file_size_bytes, "
+    "uploaded_to_user_storage, expires_at, created_at"
+)
+
+
+def _count_mode(count: Optional[str]) -> Optional[str]:
+    return count_mode(count or get_settings().admin_list_count)
+
+
+def _page(query, limit: int, offset: int, cursor: Optional[str]) -> tuple[list, Optional[int], Optional[str]]:
+    """Run an admin list query newest first. Returns (rows, total, next_cursor).
+
+    Pass `cursor` (the previous page's next_cursor) for keyset pagination; `offset` is
+    still accepted without a cursor but costs O(offset). `total` follows the `count`
+    mode (ADMIN_LIST_COUNT by default): "exact", "planned", "estimated" or "none" (null).
+    """
+    if cursor is None and offset:
+        query = query.order("created_at", desc=True).order("id", desc=True).range(offset, offset + limit)
+    else:
+        query = keyset(query, cursor, limit)
+    result = query.execute()
+    rows, next_cursor = split_page(result.data, limit)
+    return rows, result.count, next_cursor
+
 
 # --- Dashboard Stats ---
 @router.get("/stats")
-def get_admin_stats():
-    """Get system-wide statistics for admin dashboard."""
-    sb = get_supabase_admin()
-
-    users = sb.table("profiles").select("id", count="exact").execute()
-    projects = sb.table("projects").select("id", count="exact").execute()
-    t_jobs = sb.table("translation_jobs").select("id", count="exact").execute()
-    e_jobs = sb.table("export_jobs").select("id", count="exact").execute()
-
-    active_jobs = sb.table("translation_jobs").select("id", count="exact").in_("status", ["queued", "processing"]).execute()
-    failed_jobs = sb.table("translation_jobs").select("id", count="exact").eq("status", "failed").execute()
-
-    # Storage stats
-    stored = sb.table("stored_files").select("file_size_bytes").eq("uploaded_to_user_storage", False).execute()
-    total_storage_bytes = sum(f.get("file_size_bytes", 0) for f in (stored.data or []))
-    total_files = len(stored.data or [])
-
+def get_admin_stats(refresh: bool = False):
+    """Get system-wide statistics for admin dashboard (pre-aggregated snapshot; `refresh` recomputes it)."""
+    stats = get_snapshot(refresh)
     return {
-        "total_users": users.count or 0,
-        "total_projects": projects.count or 0,
-        "total_translation_jobs": t_jobs.count or 0,
-        "total_export_jobs": e_jobs.count or 0,
-        "active_jobs": active_jobs.count or 0,
-        "failed_jobs": failed_jobs.count or 0,
-        "total_storage_bytes": total_storage_bytes,
-        "total_stored_files": total_files,
+        "total_users": stats["total_users"],
+        "total_projects": stats["total_projects"],
+        "total_translation_jobs": stats["total_translation_jobs"],
+        "total_export_jobs": stats["total_export_jobs"],
+        "active_jobs": stats["active_jobs"],
+        "failed_jobs": stats["failed_jobs"],
+        "total_storage_bytes": stats["total_storage_bytes"],
+        "total_stored_files": stats["total_stored_files"],
+        "computed_at": stats["computed_at"],
     }
 
 
 # --- User Management ---
-@router.get("/users")
+@router.get("/users", response_class=ORJSONResponse)
 def list_users(
     search: Optional[str] = None,
     plan: Optional[str] = None,
     status: Optional[str] = None,
-    limit: int = Query(50, le=100),
+    limit: int = Query(50, ge=1, le=100),
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
 ):
-    """List all users with filters."""
+    """List all users with filters (see _page for cursor/offset and count)."""
     sb = get_supabase_admin()
-    query = sb.table("profiles").select("*, subscription_plans(name)", count="exact")
+    query = sb.table("profiles").select(ADMIN_USER_COLUMNS, count=_count_mode(count))
 
     if plan:
         query = query.eq("plan_id", plan)
@@ -63,10 +96,9 @@ def list_users(
     if search:
         query = query.or_(f"full_name.ilike.*{search}*,id.eq.{search}")
 
-    result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
+    profiles, total, next_cursor = _page(query, limit, offset, cursor)
 
     # Get emails from auth in parallel (avoid N+1 sequential HTTP calls)
-    profiles = result.data or []
     auth_admin = sb.auth.admin
     email_map: dict[str, str] = {}
 
@@ -84,7 +116,7 @@ def list_users(
             email_map[uid] = email
 
     users_with_email = [{**p, "email": email_map.get(p["id"], "")} for p in profiles]
-    return {"data": users_with_email, "total": result.count or 0}
+    return {"data": users_with_email, "total": total, "next_cursor": next_cursor}
 
 
 @router.patch("/users/{user_id}")
@@ -97,6 +129,7 @@ def update_user(user_id: str, update: dict):
         raise HTTPException(status_code=400, detail="No valid fields to update")
 
     result = sb.table("profiles").update(filtered).eq("id", user_id).execute()
+    invalidate_profile(user_id)
     return result.data
 
 
@@ -108,10 +141,15 @@ def delete_user(user_id: str):
 
     # 1. Delete all local storage files for this user
     try:
-        stored = sb.table("stored_files").select("storage_path").eq("user_id", user_id).execute()
+        stored = (
+            sb.table("stored_files")
+            .select(blob_store.file_columns("storage_path, uploaded_to_user_storage"))
+            .eq("user_id", user_id)
+            .execute()
+        )
         for f in (stored.data or []):
             try:
-                r2.delete(f["storage_path"])
+                blob_store.delete_stored_file(sb, r2, f)
             except Exception:
                 pass
     except Exception:
@@ -122,6 +160,7 @@ def delete_user(user_id: str):
         sb.table("stored_files").delete().eq("user_id", user_id).execute()
         sb.table("glossary_terms").delete().eq("user_id", user_id).execute()
         sb.table("user_api_keys").delete().eq("user_id", user_id).execute()
+        reference_cache.invalidate("api_keys", user_id)
         sb.table("user_storage_configs").delete().eq("user_id", user_id).execute()
 
         # Delete projects (CASCADE deletes subtitle_files, jobs, stored_files)
@@ -137,27 +176,33 @@ def delete_user(user_id: str):
         sb.auth.admin.delete_user(user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete user: {str(e)}")
+    invalidate_profile(user_id)
     return {"deleted": True}
 
 
 # --- Job Management ---
-@router.get("/jobs")
+@router.get("/jobs", response_class=ORJSONResponse)
 def list_all_jobs(
     job_type: str = Query("translation", pattern="^(translation|export)$"),
     status: Optional[str] = None,
-    limit: int = Query(50, le=100),
+    limit: int = Query(50, ge=1, le=100),
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
 ):
-    """List all jobs across all users."""
+    """List all jobs across all users (see _page for cursor/offset and count)."""
     sb = get_supabase_admin()
-    table = "translation_jobs" if job_type == "translation" else "export_jobs"
-    query = sb.table(table).select("*, profiles(full_name), projects(name, file_name)", count="exact")
+    if job_type == "translation":
+        table, columns = "translation_jobs", ADMIN_TRANSLATION_JOB_COLUMNS
+    else:
+        table, columns = "export_jobs", ADMIN_EXPORT_JOB_COLUMNS
+    query = sb.table(table).select(f"{columns}, profiles(full_name), projects(name, file_name)", count=_count_mode(count))
 
     if status:
         query = query.eq("status", status)
 
-    result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-    return {"data": result.data or [], "total": result.count or 0}
+    rows, total, next_cursor = _page(query, limit, offset, cursor)
+    return {"data": rows, "total": total, "next_cursor": next_cursor}
 
 
 @router.post("/jobs/{job_id}/cancel")
@@ -242,6 +287,23 @@ def admin_retry_job(job_id: str, job_type: str = Query("translation")):
     return {"status": "queued", "message": "Job re-launched"}
 
 
+# --- Query Metrics ---
+@router.get("/queries")
+def get_query_metrics(
+    by: str = Query("table", pattern="^(table|route)$"),
+    limit: int = Query(20, ge=1, le=200),
+):
+    """Top PostgREST tables or routes/tasks by total query time (this API process, since start or reset)."""
+    return query_metrics.top(by, limit)
+
+
+@router.delete("/queries")
+def reset_query_metrics():
+    """Reset the query metrics of this API process."""
+    query_metrics.reset()
+    return {"ok": True}
+
+
 # --- Engine Management ---
 @router.get("/engines")
 def list_engines():
@@ -258,6 +320,7 @@ def update_engine(engine_id: str, update: dict):
     allowed = {"name", "model", "cost_per_line", "status", "is_enabled", "api_key_encrypted", "rate_limit_per_minute", "docs_url"}
     filtered = {k: v for k, v in update.items() if k in allowed}
     result = sb.table("translation_engines").update(filtered).eq("id", engine_id).execute()
+    reference_cache.invalidate("engine", engine_id)
     return result.data
 
 
@@ -280,6 +343,7 @@ def update_settings(updates: dict, user: dict = Depends(require_admin)):
             "value": value,
             "updated_by": user["id"],
         }).execute()
+    reference_cache.invalidate()
     return {"updated": list(updates.keys())}
 
 
@@ -325,27 +389,15 @@ def delete_announcement(announcement_id: str):
 
 # --- Storage Management ---
 @router.get("/storage")
-def get_storage_stats():
-    """Get detailed storage statistics."""
-    sb = get_supabase_admin()
-
-    # Per-user storage usage
-    users = sb.table("profiles").select("id, full_name, plan_id, storage_used_bytes, daily_jobs_used").order("storage_used_bytes", desc=True).limit(20).execute()
-
-    # File type breakdown
-    files = sb.table("stored_files").select("file_type, file_size_bytes").eq("uploaded_to_user_storage", False).execute()
-    type_breakdown = {}
-    for f in (files.data or []):
-        ft = f["file_type"]
-        type_breakdown[ft] = type_breakdown.get(ft, {"count": 0, "bytes": 0})
-        type_breakdown[ft]["count"] += 1
-        type_breakdown[ft]["bytes"] += f.get("file_size_bytes", 0)
-
+def get_storage_stats(refresh: bool = False):
+    """Get detailed storage statistics (pre-aggregated snapshot; `refresh` recomputes it)."""
+    stats = get_snapshot(refresh)
     return {
-        "top_users": users.data or [],
-        "file_type_breakdown": type_breakdown,
-        "total_files": len(files.data or []),
-        "total_bytes": sum(f.get("file_size_bytes", 0) for f in (files.data or [])),
+        "top_users": stats["top_users"],
+        "file_type_breakdown": stats["file_type_breakdown"],
+        "total_files": stats["total_stored_files"],
+        "total_bytes": stats["total_storage_bytes"],
+        "computed_at": stats["computed_at"],
     }
 
 
@@ -356,24 +408,28 @@ def admin_cleanup():
     return {"deleted_count": deleted, "message": f"{deleted} süresi dolmuş dosya silindi."}
 
 
-@router.get("/storage/files")
+@router.get("/storage/files", response_class=ORJSONResponse)
 def list_stored_files(
     user_id: Optional[str] = None,
     file_type: Optional[str] = None,
-    limit: int = Query(50, le=200),
+    limit: int = Query(50, ge=1, le=200),
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
 ):
-    """List stored files with filters."""
+    """List stored files with filters (see _page for cursor/offset and count)."""
     sb = get_supabase_admin()
-    query = sb.table("stored_files").select("*, profiles(full_name, plan_id)", count="exact")
+    query = sb.table("stored_files").select(
+        f"{ADMIN_STORED_FILE_COLUMNS}, profiles(full_name, plan_id)", count=_count_mode(count)
+    )
 
     if user_id:
         query = query.eq("user_id", user_id)
     if file_type:
         query = query.eq("file_type", file_type)
 
-    result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-    return {"data": result.data or [], "total": result.count or 0}
+    rows, total, next_cursor = _page(query, limit, offset, cursor)
+    return {"data": rows, "total": total, "next_cursor": next_cursor}
 
 
 @router.delete("/storage/files/{file_id}")
@@ -386,13 +442,8 @@ def admin_delete_file(file_id: str):
     if not file.data:
         raise HTTPException(status_code=404, detail="File not found")
 
-    r2.delete(file.data["storage_path"])
+    blob_store.delete_stored_file(sb, r2, file.data)
     sb.table("stored_files").delete().eq("id", file_id).execute()
-
-    # Recalculate user storage
-    user_id = file.data["user_id"]
-    stored = sb.table("stored_files").select("file_size_bytes").eq("user_id", user_id).eq("uploaded_to_user_storage", False).execute()
-    total = sum(f.get("file_size_bytes", 0) for f in (stored.data or []))
-    sb.table("profiles").update({"storage_used_bytes": total}).eq("id", user_id).execute()
+    release_files_storage(sb, [file.data])
 
     return {"deleted": True}
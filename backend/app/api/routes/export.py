@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException
 import shutil
 import uuid
 from pathlib import Path
@@ -6,12 +6,15 @@ from datetime import datetime, timezone, timedelta
 import structlog
 
 from app.core.security import get_current_user
-from app.core.supabase import get_supabase_admin
-from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin, get_supabase_async
 from app.models.schemas import ExportJobCreate
 from app.utils.ffmpeg import burn_subtitles, mux_subtitles, CODEC_MAP
 from app.services.storage import get_r2_storage
-from app.services.cleanup import mark_uploaded_to_user_storage, recalculate_user_storage
+from app.services.cleanup import mark_uploaded_to_user_storage, adjust_user_storage, release_files_storage
+from app.services.subtitle_edits import compact_edits
+from app.services.job_progress import JobProgressWriter
+from app.services import export_push, reference_cache
+from app.services.user_storage import get_active_config
 
 logger = structlog.get_logger()
 router = APIRouter(prefix="/export", tags=["Export"])
@@ -33,18 +36,18 @@ def create_export_job(
     # Check plan limits for resolution
     profile = user["profile"]
     try:
-        plan = sb.table("subscription_plans").select("*").eq("id", profile.get("plan_id", "free")).single().execute()
+        plan = reference_cache.get_plan(profile.get("plan_id", "free"))
     except Exception:
         plan = None
-    if plan and plan.data:
-        allowed_res = plan.data.get("max_export_resolution", "720p")
+    if plan:
+        allowed_res = plan.get("max_export_resolution", "720p")
         res_order = ["480p", "720p", "1080p", "1440p", "4k"]
         req_res = body.resolution if body.resolution and body.resolution != "original" else None
         if req_res and req_res in res_order and allowed_res in res_order:
             if res_order.index(req_res) > res_order.index(allowed_res):
                 raise HTTPException(status_code=403, detail=f"Your plan allows max {allowed_res} export")
 
-        if plan.data.get("watermark_required") and not body.include_watermark:
+        if plan.get("watermark_required") and not body.include_watermark:
             body.include_watermark = True
             body.watermark_text = body.watermark_text or "SubTranslate"
 
@@ -106,10 +109,10 @@ def create_export_job(
 
 
 @router.get("/active/{project_id}")
-def get_active_export_job(project_id: str, user: dict = Depends(get_current_user)):
+async def get_active_export_job(project_id: str, user: dict = Depends(get_current_user)):
     """Get the active (queued/processing) export job for a project, if any."""
-    sb = get_supabase_admin()
-    result = (
+    sb = get_supabase_async()
+    result = await (
         sb.table("export_jobs")
         .select("*")
         .eq("project_id", project_id)
@@ -125,20 +128,20 @@ def get_active_export_job(project_id: str, user: dict = Depends(get_current_user
 
 
 @router.get("/{job_id}")
-def get_export_job(job_id: str, user: dict = Depends(get_current_user)):
+async def get_export_job(job_id: str, user: dict = Depends(get_current_user)):
     """Get export job status."""
-    sb = get_supabase_admin()
-    result = sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
+    sb = get_supabase_async()
+    result = await sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
     if not result.data:
         raise HTTPException(status_code=404, detail="Job not found")
     return result.data
 
 
 @router.get("/{job_id}/download")
-def download_export(job_id: str, user: dict = Depends(get_current_user)):
+async def download_export(job_id: str, user: dict = Depends(get_current_user)):
     """Download the exported file."""
-    sb = get_supabase_admin()
-    job = sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
+    sb = get_supabase_async()
+    job = await sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
     if not job.data:
         raise HTTPException(status_code=404, detail="Job not found")
     if job.data["status"] != "completed":
@@ -153,17 +156,17 @@ def download_export(job_id: str, user: dict = Depends(get_current_user)):
 
 
 @router.post("/{job_id}/cancel")
-def cancel_export_job(job_id: str, user: dict = Depends(get_current_user)):
+async def cancel_export_job(job_id: str, user: dict = Depends(get_current_user)):
     """Cancel a running export job."""
-    sb = get_supabase_admin()
-    job = sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
+    sb = get_supabase_async()
+    job = await sb.table("export_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
     if not job.data:
         raise HTTPException(status_code=404, detail="Job not found")
     if job.data["status"] not in ("queued", "processing"):
         raise HTTPException(status_code=400, detail="Job cannot be cancelled")
 
-    sb.table("export_jobs").update({"status": "cancelled"}).eq("id", job_id).execute()
-    sb.table("projects").update({"status": "translated"}).eq("id", job.data["project_id"]).execute()
+    await sb.table("export_jobs").update({"status": "cancelled"}).eq("id", job_id).execute()
+    await sb.table("projects").update({"status": "translated"}).eq("id", job.data["project_id"]).execute()
     return {"status": "cancelled"}
 
 
@@ -189,6 +192,7 @@ def delete_previous_export(project_id: str, user: dict = Depends(get_current_use
     )
 
     deleted_files = 0
+    uow = sb.unit_of_work()
     for job in (jobs.data or []):
         # Delete from R2 storage
         if job.get("output_file_url"):
@@ -199,17 +203,23 @@ def delete_previous_export(project_id: str, user: dict = Depends(get_current_use
                 logger.warning("export_file_delete_failed", key=job["output_file_url"], error=str(e))
 
         # Delete the old export job record
-        sb.table("export_jobs").delete().eq("id", job["id"]).execute()
+        uow.delete("export_jobs", job["id"])
+    uow.commit()
 
-    # Delete stored_files records for export_video type
-    sb.table("stored_files").delete().eq("project_id", project_id).eq("user_id", user["id"]).eq("file_type", "export_video").execute()
+    # Delete stored_files records for export_video type (deleted rows are returned)
+    removed = (
+        sb.table("stored_files").delete()
+        .eq("project_id", project_id)
+        .eq("user_id", user["id"])
+        .eq("file_type", "export_video")
+        .execute()
+    )
 
     # Reset project status back to translated
     if project.data.get("status") == "exported":
         sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
 
-    # Recalculate storage
-    _recalculate_user_storage(sb, user["id"])
+    release_files_storage(sb, removed.data or [])
 
     return {"deleted_files": deleted_files, "message": "Önceki dışa aktarma dosyaları silindi."}
 
@@ -226,6 +236,83 @@ def notify_uploaded_to_own_storage(project_id: str, user: dict = Depends(get_cur
     return {"deleted_files": deleted, "message": "Dosyalar kendi depolamanıza yüklendiği için sunucumuzdan silindi."}
 
 
+@router.post("/{job_id}/push-to-own-storage")
+def push_to_own_storage(
+    job_id: str,
+    key: str | None = Body(None, embed=True),
+    user: dict = Depends(get_current_user),
+):
+    """Upload a completed export to the user's own R2/B2 bucket from the server (no
+    download/upload through the browser). Runs in the background; poll the GET route.
+    On success the project's files are deleted here, as with uploaded-to-own-storage.
+    Calling it again after a failure resumes the upload."""
+    sb = get_supabase_admin()
+    job = (
+        sb.table("export_jobs")
+        .select("id, project_id, status, output_file_url")
+        .eq("id", job_id)
+        .eq("user_id", user["id"])
+        .maybeSingle()
+        .execute()
+    )
+    if not job.data:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.data["status"] != "completed" or not job.data.get("output_file_url"):
+        raise HTTPException(status_code=400, detail="Export not completed yet")
+    if not get_active_config(user["id"]):
+        raise HTTPException(status_code=404, detail="Aktif depolama yapılandırması bulunamadı. Ayarlar sayfasından yapılandırın.")
+    if not export_push.claim(job_id):
+        raise HTTPException(status_code=409, detail="Yükleme zaten devam ediyor")
+
+    dest_key = (key or "").strip().lstrip("/") or export_push.default_key(job.data)
+    export_push.queue_state(job_id, dest_key)
+    try:
+        from app.workers.tasks import push_export_task
+        push_export_task.delay(job_id=job_id, user_id=user["id"], dest_key=dest_key)
+    except Exception as e:
+        logger.warning("celery_unavailable_push_fallback_thread", job_id=job_id, error=str(e))
+        import threading
+        threading.Thread(target=_run_push, args=(job_id, user["id"], dest_key), daemon=True).start()
+
+    return {"status": "queued", "key": dest_key}
+
+
+@router.get("/{job_id}/push-to-own-storage")
+def get_push_status(job_id: str, user: dict = Depends(get_current_user)):
+    """Progress of the server-side push of an export ({"status": "none"} if never pushed)."""
+    sb = get_supabase_admin()
+    job = sb.table("export_jobs").select("id").eq("id", job_id).eq("user_id", user["id"]).maybeSingle().execute()
+    if not job.data:
+        raise HTTPException(status_code=404, detail="Job not found")
+    state = export_push.get_state(job_id)
+    if not state:
+        return {"status": "none"}
+    return {k: v for k, v in state.items() if k not in ("upload_id", "part_size")}
+
+
+# As push_export_task: first attempt + max_retries
+PUSH_ATTEMPTS = 4
+
+
+def _run_push(job_id: str, user_id: str, dest_key: str):
+    """Thread fallback for push_export_task: the same attempts (each resuming the last),
+    then the push is failed and its multipart upload aborted."""
+    import time
+    for attempt in range(1, PUSH_ATTEMPTS + 1):
+        try:
+            export_push.push_export(job_id, user_id, dest_key)
+            return
+        except export_push.PushError as e:
+            export_push.fail(job_id, user_id, str(e))
+            return
+        except Exception as e:
+            logger.error("export_push_failed", job_id=job_id, error=str(e), attempt=attempt)
+            if attempt == PUSH_ATTEMPTS:
+                export_push.fail(job_id, user_id, str(e))
+                return
+            time.sleep(10 * attempt)
+
+
 def _run_export(
     job_id: str,
     project_id: str,
@@ -242,48 +329,44 @@ def _run_export(
     import time
     sb = get_supabase_admin()
     r2 = get_r2_storage()
-    settings = get_settings()
-    work_dir = settings.temp_path / f"export_{job_id}"
-    work_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = r2.ingest_dir(f"export_{job_id}")
+    job = JobProgressWriter(sb, "export_jobs", job_id)
 
-    # Track last progress to avoid spamming DB with identical updates
+    # Track last progress to avoid queueing identical updates
     _last_progress = [0]
 
     def _update_progress(pct: int):
-        """Write ffmpeg progress to DB (throttled: only when changed by >=2%)."""
+        """Queue ffmpeg progress (written by the job's write-behind buffer)."""
         # Map ffmpeg 0-100 to overall 30-90 range (30% = download done, 90% = encode done)
         overall = 30 + int(pct * 0.6)
         if overall <= _last_progress[0]:
             return
-        if overall - _last_progress[0] < 2 and overall < 90:
-            return
         _last_progress[0] = overall
-        try:
-            sb.table("export_jobs").update({"progress": overall}).eq("id", job_id).execute()
-        except Exception:
-            pass
+        job.update({"progress": overall})
 
     try:
-        sb.table("export_jobs").update({
+        job.update({
             "status": "processing",
             "progress": 5,
-        }).eq("id", job_id).execute()
+        }, flush=True)
 
         # Get project info
         project = sb.table("projects").select("*").eq("id", project_id).single().execute()
         if not project.data or not project.data.get("file_url"):
             raise RuntimeError("Project source file not found")
 
-        sb.table("export_jobs").update({"progress": 10}).eq("id", job_id).execute()
+        job.update({"progress": 10})
 
-        # Copy source video to work dir (no RAM load for large files)
+        # Source video: hardlinked / reflinked into the work dir, or read in place (no copy)
         source_ext = Path(project.data["file_name"]).suffix or ".mkv"
-        source_path = work_dir / f"source{source_ext}"
-        r2.copy_to(project.data["file_url"], str(source_path))
+        source_path = Path(r2.local_input(project.data["file_url"], str(work_dir / f"source{source_ext}")))
 
-        sb.table("export_jobs").update({"progress": 20}).eq("id", job_id).execute()
+        job.update({"progress": 20})
 
-        # Get translated subtitle file from storage
+        # Get translated subtitle file from storage (with pending editor edits folded in)
+        sub_files = sb.table("subtitle_files").select("id").eq("project_id", project_id).execute()
+        for sf in (sub_files.data or []):
+            compact_edits(sf["id"])
         sub_files = sb.table("subtitle_files").select("*").eq("project_id", project_id).execute()
         translated_url = None
         for sf in (sub_files.data or []):
@@ -293,17 +376,15 @@ def _run_export(
         if not translated_url:
             raise RuntimeError("No translated subtitle file found")
 
-        sub_data = r2.download(translated_url)
         # Preserve original subtitle format extension (could be .ass, .ssa, .srt, .vtt)
         sub_ext = Path(translated_url).suffix or ".srt"
         sub_path = work_dir / f"translated{sub_ext}"
-        sub_path.write_bytes(sub_data)
+        r2.copy_to(translated_url, str(sub_path))
 
-        sb.table("export_jobs").update({"progress": 30}).eq("id", job_id).execute()
+        job.update({"progress": 30})
 
         # Check if cancelled before starting expensive FFmpeg encode
-        job_check = sb.table("export_jobs").select("status").eq("id", job_id).single().execute()
-        if job_check.data and job_check.data["status"] == "cancelled":
+        if job.is_cancelled(fresh=True):
             logger.info("export_cancelled_before_encode", job_id=job_id)
             sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
             return
@@ -338,29 +419,28 @@ def _run_export(
         elapsed_ms = int((time.time() - start_time) * 1000)
         output_size = output_path.stat().st_size
 
-        job_check = sb.table("export_jobs").select("status").eq("id", job_id).single().execute()
-        if job_check.data and job_check.data["status"] == "cancelled":
+        if job.is_cancelled(fresh=True):
             logger.info("export_cancelled_after_encode", job_id=job_id)
             sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
             return
 
-        sb.table("export_jobs").update({"progress": 90}).eq("id", job_id).execute()
+        job.update({"progress": 90})
 
         # Get retention days for user's plan
         try:
             profile = sb.table("profiles").select("plan_id").eq("id", user_id).single().execute()
             plan_id = profile.data.get("plan_id", "free") if profile.data else "free"
-            plan = sb.table("subscription_plans").select("retention_days").eq("id", plan_id).single().execute()
-            retention_days = plan.data.get("retention_days", 1) if plan.data else 1
+            plan = reference_cache.get_plan(plan_id)
+            retention_days = plan.get("retention_days", 1) if plan else 1
         except Exception:
             retention_days = 1
         expires_at = (datetime.now(timezone.utc) + timedelta(days=retention_days)).isoformat()
 
-        # Upload export to R2 (file copy, no RAM load)
+        # Move export into storage (rename when the work dir is on the storage filesystem)
         storage_key = r2.get_storage_key(user_id, project_id, "export", f"{job_id}{output_ext}")
-        r2.upload_file(storage_key, str(output_path), content_type=f"video/{output_ext.lstrip('.')}")
+        r2.move_file(storage_key, str(output_path), content_type=f"video/{output_ext.lstrip('.')}")
 
-        sb.table("export_jobs").update({"progress": 95}).eq("id", job_id).execute()
+        job.update({"progress": 95})
 
         # Track in stored_files
         sb.table("stored_files").insert({
@@ -372,35 +452,30 @@ def _run_export(
             "cdn_url": r2.get_cdn_url(storage_key),
             "expires_at": expires_at,
         }).execute()
+        adjust_user_storage(sb, user_id, output_size)
 
         # Update job
-        sb.table("export_jobs").update({
+        job.update({
             "status": "completed",
             "progress": 100,
             "output_file_url": storage_key,
             "output_file_size_bytes": output_size,
             "duration_ms": elapsed_ms,
             "completed_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        })
 
         sb.table("projects").update({"status": "exported"}).eq("id", project_id).execute()
 
-        # Recalculate storage
-        _recalculate_user_storage(sb, user_id)
-
         logger.info("export_completed", job_id=job_id, size=output_size, elapsed_ms=elapsed_ms)
 
     except Exception as e:
         logger.error("export_failed", job_id=job_id, error=str(e))
-        sb.table("export_jobs").update({
+        job.update({
             "status": "failed",
             "error_message": str(e)[:500],
-        }).eq("id", job_id).execute()
+        })
         sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
     finally:
+        job.close()
         shutil.rmtree(work_dir, ignore_errors=True)
 
-
-def _recalculate_user_storage(sb, user_id: str):
-    """Delegate to shared helper in cleanup module."""
-    recalculate_user_storage(sb, user_id)
@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional
 import structlog
 
+from app.core.config import get_settings
+from app.core.pagination import MAX_PAGE_SIZE, keyset, split_page
 from app.core.security import get_current_user
 from app.core.supabase import get_supabase_admin
 from app.models.schemas import GlossaryTermCreate
@@ -14,17 +16,30 @@ router = APIRouter(prefix="/glossary", tags=["Glossary"])
 def list_glossary_terms(
     source_lang: Optional[str] = None,
     target_lang: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     user: dict = Depends(get_current_user),
 ):
-    """List user's glossary terms with optional language filter."""
+    """List user's glossary terms with optional language filter.
+    With `limit`/`cursor`, returns {"data": [...], "next_cursor": str | None}."""
     sb = get_supabase_admin()
-    query = sb.table("glossary_terms").select("*").eq("user_id", user["id"])
+    query = (
+        sb.table("glossary_terms")
+        .select("id, user_id, source_term, target_term, source_lang, target_lang, created_at")
+        .eq("user_id", user["id"])
+    )
     if source_lang:
         query = query.eq("source_lang", source_lang)
     if target_lang:
         query = query.eq("target_lang", target_lang)
-    result = query.order("created_at", desc=True).execute()
-    return result.data
+    if cursor is None and limit is None:
+        result = query.order("created_at", desc=True).order("id", desc=True).execute()
+        return result.data
+
+    limit = limit or get_settings().list_page_size
+    result = keyset(query, cursor, limit).execute()
+    rows, next_cursor = split_page(result.data, limit)
+    return {"data": rows, "next_cursor": next_cursor}
 
 
 @router.post("")
@@ -3,7 +3,7 @@ import structlog
 
 from app.core.config import get_settings
 from app.core.supabase import get_supabase_admin
-from app.services.storage import STORAGE_DIR
+from app.services.storage import get_r2_storage
 
 logger = structlog.get_logger()
 router = APIRouter(tags=["Health"])
@@ -40,8 +40,11 @@ def health_check():
     except Exception:
         checks["supabase"] = False
 
-    # Local Storage check
-    checks["storage"] = STORAGE_DIR.exists() and STORAGE_DIR.is_dir()
+    # Storage check (local directory or bucket)
+    try:
+        checks["storage"] = get_r2_storage().check()
+    except Exception:
+        checks["storage"] = False
 
     if not all([checks["ffmpeg"], checks["supabase"], checks["storage"]]):
         checks["status"] = "degraded"
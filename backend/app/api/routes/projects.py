@@ -1,29 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response, status, Body
 from typing import Optional
+from urllib.parse import quote
+import hashlib
 import shutil
 import uuid
-import tempfile
 import threading
+import asyncio
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 import structlog
 
-from app.core.security import get_current_user
-from app.core.supabase import get_supabase_admin
+from app.core.security import get_current_user, invalidate_profile
+from app.core.supabase import get_supabase_admin, get_supabase_async
 from app.core.config import get_settings
+from app.core.responses import ORJSONResponse, json_response, ndjson_response
+from app.core.pagination import MAX_PAGE_SIZE, keyset, split_page
 from app.models.schemas import ProjectCreate, ProjectResponse, UrlDownloadRequest
 from app.utils.ffmpeg import get_media_info, extract_all_subtitles, create_web_preview, needs_web_transcode
-from app.services.subtitle_parser import parse_subtitle_file, write_srt
+from app.utils.http_cache import make_etag, etag_matches, not_modified, require_match
+from app.services.subtitle_parser import parse_subtitle_file
 from app.services.storage import get_r2_storage
-from app.services.cleanup import ensure_storage_for_upload, check_storage_limit, recalculate_user_storage
+from app.services.subtitle_cache import get_parsed_track, track_version, encode_cursor, decode_cursor
+from app.services.subtitle_edits import (
+    normalize_edit, append_edits, schedule_compaction, compact_edits, has_pending_edits, edit_lock,
+)
+from app.services.cleanup import ensure_storage_for_upload, check_storage_limit, adjust_user_storage, release_files_storage
+from app.services import blob_store, reference_cache
 
 logger = structlog.get_logger()
 router = APIRouter(prefix="/projects", tags=["Projects"])
 
 
-def _save_upload_file(upload: UploadFile, dest: Path, max_bytes: int) -> int:
-    """Stream an UploadFile to disk with a hard size limit. Returns written bytes."""
+def _save_upload_file(upload: UploadFile, dest: Path, max_bytes: int, hash_content: bool = False) -> tuple[int, Optional[str]]:
+    """Stream an UploadFile to disk with a hard size limit, optionally hashing it on the way.
+    Returns (written bytes, SHA-256 hex digest or None)."""
     written = 0
+    digest = hashlib.sha256() if hash_content else None
     chunk_size = 1024 * 1024  # 1MB
     try:
         with open(dest, "wb") as out:
@@ -37,21 +51,49 @@ def _save_upload_file(upload: UploadFile, dest: Path, max_bytes: int) -> int:
                         status_code=413,
                         detail=f"Dosya çok büyük. Maksimum {max_bytes // (1024 * 1024)}MB",
                     )
+                if digest:
+                    digest.update(chunk)
                 out.write(chunk)
     finally:
         try:
             upload.file.close()
         except Exception:
             pass
-    return written
+    return written, digest.hexdigest() if digest else None
 
 
-@router.get("")
-def list_projects(user: dict = Depends(get_current_user)):
-    """List all projects for the current user."""
-    sb = get_supabase_admin()
-    result = sb.table("projects").select("*").eq("user_id", user["id"]).order("created_at", desc=True).execute()
-    return result.data
+# Columns shown in project lists (the detail route returns the full row)
+PROJECT_LIST_COLUMNS = (
+    "id, user_id, name, file_name, file_size_bytes, duration_seconds, video_codec, width, height, "
+    "status, source_lang, target_lang, total_lines, translated_lines, created_at, updated_at"
+)
+STORED_FILE_LIST_COLUMNS = (
+    "id, user_id, project_id, file_type, storage_path, display_name, file_size_bytes, cdn_url, "
+    "uploaded_to_user_storage, expires_at, created_at, projects(name)"
+)
+
+
+@router.get("", response_class=ORJSONResponse)
+async def list_projects(
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    user: dict = Depends(get_current_user),
+):
+    """List projects for the current user, newest first.
+
+    Without `limit`/`cursor` the full list is returned as before.
+    With them, returns {"data": [...], "next_cursor": str | None}; pass next_cursor back to continue.
+    """
+    sb = get_supabase_async()
+    query = sb.table("projects").select(PROJECT_LIST_COLUMNS).eq("user_id", user["id"])
+    if cursor is None and limit is None:
+        result = await query.order("created_at", desc=True).order("id", desc=True).execute()
+        return result.data
+
+    limit = limit or get_settings().list_page_size
+    result = await keyset(query, cursor, limit).execute()
+    rows, next_cursor = split_page(result.data, limit)
+    return {"data": rows, "next_cursor": next_cursor}
 
 
 @router.get("/storage/info")
@@ -60,20 +102,23 @@ def get_storage_info(user: dict = Depends(get_current_user)):
     return check_storage_limit(user["id"])
 
 
-@router.get("/storage/files")
+@router.get("/storage/files", response_class=ORJSONResponse)
 def list_stored_files(
     location: str = "all",
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
     user: dict = Depends(get_current_user),
 ):
     """List stored files for the current user with project names.
 
     Query params:
       location: 'system' (on server), 'external' (uploaded to user storage), 'all' (default)
+      limit/cursor: keyset pagination; with them, returns {"data": [...], "next_cursor": str | None}
     """
     sb = get_supabase_admin()
     query = (
         sb.table("stored_files")
-        .select("*, projects(name)")
+        .select(STORED_FILE_LIST_COLUMNS)
         .eq("user_id", user["id"])
     )
     if location == "system":
@@ -82,13 +127,22 @@ def list_stored_files(
         query = query.eq("uploaded_to_user_storage", True)
     # 'all' → no filter
 
-    result = query.order("created_at", desc=True).execute()
+    paginate = cursor is not None or limit is not None
+    next_cursor = None
+    if paginate:
+        limit = limit or get_settings().list_page_size
+        result = keyset(query, cursor, limit).execute()
+        rows, next_cursor = split_page(result.data, limit)
+    else:
+        rows = query.order("created_at", desc=True).order("id", desc=True).execute().data or []
 
     files = []
-    for f in (result.data or []):
+    for f in rows:
         project_info = f.pop("projects", None)
         f["project_name"] = project_info.get("name", "—") if project_info else "—"
         files.append(f)
+    if paginate:
+        return {"data": files, "next_cursor": next_cursor}
     return files
 
 
@@ -118,17 +172,16 @@ def delete_stored_file(file_id: str, user: dict = Depends(get_current_user)):
     if not file_record.data:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Delete from storage
+    # Delete from storage (or drop its blob reference)
     try:
-        r2.delete(file_record.data["storage_path"])
+        blob_store.delete_stored_file(sb, r2, file_record.data)
     except Exception as e:
         logger.warning("storage_file_delete_failed", key=file_record.data["storage_path"], error=str(e))
 
     # Delete DB record
     sb.table("stored_files").delete().eq("id", file_id).execute()
 
-    # Recalculate storage
-    _recalculate_user_storage(sb, user["id"])
+    release_files_storage(sb, [file_record.data])
     return {"ok": True}
 
 
@@ -145,8 +198,8 @@ def get_stored_file_url(file_id: str, user: dict = Depends(get_current_user)):
 
 
 @router.get("/{project_id}")
-def get_project(project_id: str, user: dict = Depends(get_current_user)):
-    """Get a single project with details."""
+def get_project(project_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
+    """Get a single project with details (ETag over the row and its media files; 304 on If-None-Match)."""
     sb = get_supabase_admin()
     r2 = get_r2_storage()
     result = sb.table("projects").select("*").eq("id", project_id).eq("user_id", user["id"]).single().execute()
@@ -164,31 +217,26 @@ def get_project(project_id: str, user: dict = Depends(get_current_user)):
                 "project_id", project_id
             ).eq("file_type", "preview").maybeSingle().execute()
             if preview.data and preview.data.get("storage_path"):
-                preview_path = r2._resolve(preview.data["storage_path"])
-                if preview_path.exists():
+                if r2.exists(preview.data["storage_path"]):
                     file_url = preview.data["storage_path"]
                     has_preview = True
         except Exception:
             pass
-        # 2) Fallback: check if preview.mp4 exists on disk next to source file
-        if not has_preview:
+        # 2) Fallback: check if preview.mp4 exists in storage next to source file
+        # (deduplicated sources have no project folder to look in)
+        if not has_preview and not blob_store.is_blob_key(data["file_url"]):
             try:
-                source_path = r2._resolve(data["file_url"])
-                preview_sibling = source_path.parent / "preview.mp4"
-                if preview_sibling.exists():
-                    # Compute the storage key for this preview
-                    source_key = data["file_url"]
-                    preview_key = str(Path(source_key).parent / "preview.mp4").replace("\\", "/")
+                source_key = data["file_url"]
+                preview_key = str(Path(source_key).parent / "preview.mp4").replace("\\", "/")
+                preview_size = r2.get_size(preview_key)
+                if preview_size is not None:
                     file_url = preview_key
                     has_preview = True
                     # Register in DB so cleanup/retention can manage it
                     try:
-                        preview_size = preview_sibling.stat().st_size
                         profile = user.get("profile", {})
-                        plan_q = sb.table("subscription_plans").select("retention_days").eq(
-                            "id", profile.get("plan_id", "free")
-                        ).maybeSingle().execute()
-                        ret_days = plan_q.data.get("retention_days", 1) if plan_q.data else 1
+                        plan = reference_cache.get_plan(profile.get("plan_id", "free"))
+                        ret_days = plan.get("retention_days", 1) if plan else 1
                         exp = (datetime.now(timezone.utc) + timedelta(days=ret_days)).isoformat()
                         sb.table("stored_files").insert({
                             "user_id": user["id"],
@@ -199,20 +247,29 @@ def get_project(project_id: str, user: dict = Depends(get_current_user)):
                             "cdn_url": r2.get_cdn_url(preview_key),
                             "expires_at": exp,
                         }).execute()
+                        adjust_user_storage(sb, user["id"], preview_size)
                         logger.info("preview_registered_in_db", project_id=project_id, key=preview_key)
                     except Exception:
                         pass
             except Exception:
                 pass
         data["video_url"] = f"/files/{file_url}"
+        # Validators are known before the (ffprobe-backed) transcode check below
+        cached = not_modified(request, response, make_etag(
+            data, r2.get_version(data["file_url"]), r2.get_version(file_url) if has_preview else None,
+        ))
+        if cached:
+            return cached
         # 3) If still no preview, check if source needs transcoding
         if not has_preview:
             try:
-                source_path = r2._resolve(data["file_url"])
-                if source_path.exists():
-                    data["needs_transcode"] = needs_web_transcode(str(source_path))
+                data["needs_transcode"] = needs_web_transcode(r2.media_input(data["file_url"]))
             except Exception:
                 pass
+    else:
+        cached = not_modified(request, response, make_etag(data))
+        if cached:
+            return cached
     return data
 
 
@@ -239,45 +296,39 @@ def create_on_demand_web_preview(project_id: str, user: dict = Depends(get_curre
             "project_id", project_id
         ).eq("file_type", "preview").maybeSingle().execute()
         if existing.data and existing.data.get("storage_path"):
-            preview_path = r2._resolve(existing.data["storage_path"])
-            if preview_path.exists():
+            if r2.exists(existing.data["storage_path"]):
                 return {"video_url": f"/files/{existing.data['storage_path']}", "cached": True}
     except Exception:
         pass
 
-    # Resolve source file
+    # Resolve source file (local path, or presigned URL on object storage)
     try:
-        source_path = r2._resolve(file_url)
-        if not source_path.exists():
-            raise HTTPException(status_code=404, detail="Source file not found on disk")
+        source_input = r2.media_input(file_url)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid file path")
+    except RuntimeError:
+        raise HTTPException(status_code=404, detail="Source file not found on disk")
 
     # Check if transcoding is needed
-    if not needs_web_transcode(str(source_path)):
+    if not needs_web_transcode(source_input):
         # File is already browser-compatible, just return it
         return {"video_url": f"/files/{file_url}", "cached": True}
 
     # Create web preview
-    settings = get_settings()
-    work_dir = settings.temp_path / f"preview_{project_id}"
-    work_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = r2.ingest_dir(f"preview_{project_id}")
 
     try:
         preview_out = work_dir / "preview.mp4"
-        create_web_preview(str(source_path), str(preview_out))
+        create_web_preview(source_input, str(preview_out))
 
         preview_key = r2.get_storage_key(user["id"], project_id, "source", "preview.mp4")
-        r2.upload_file(preview_key, str(preview_out), content_type="video/mp4")
-        preview_size = preview_out.stat().st_size
+        preview_size = r2.move_file(preview_key, str(preview_out), content_type="video/mp4")["size"]
 
         # Get retention from plan
         try:
             profile = user.get("profile", {})
-            plan = sb.table("subscription_plans").select("retention_days").eq(
-                "id", profile.get("plan_id", "free")
-            ).single().execute()
-            retention_days = plan.data.get("retention_days", 1) if plan.data else 1
+            plan = reference_cache.get_plan(profile.get("plan_id", "free"))
+            retention_days = plan.get("retention_days", 1) if plan else 1
         except Exception:
             retention_days = 1
         expires_at = (datetime.now(timezone.utc) + timedelta(days=retention_days)).isoformat()
@@ -291,6 +342,7 @@ def create_on_demand_web_preview(project_id: str, user: dict = Depends(get_curre
             "cdn_url": r2.get_cdn_url(preview_key),
             "expires_at": expires_at,
         }).execute()
+        adjust_user_storage(sb, user["id"], preview_size)
 
         logger.info("on_demand_web_preview_created", project_id=project_id, size=preview_size)
         return {"video_url": f"/files/{preview_key}", "cached": False}
@@ -317,11 +369,10 @@ def create_project(
 
     # --- 1. Check daily job limit ---
     profile = user["profile"]
-    plan = sb.table("subscription_plans").select("*").eq("id", profile.get("plan_id", "free")).single().execute()
-    if not plan.data:
+    plan_data = reference_cache.get_plan(profile.get("plan_id", "free"))
+    if not plan_data:
         raise HTTPException(status_code=500, detail="Plan not found")
 
-    plan_data = plan.data
     daily_limit = plan_data.get("daily_job_limit", 3)
 
     daily_used = sb.rpc("check_and_reset_daily_jobs", {"user_id_param": user["id"]}).data
@@ -338,13 +389,13 @@ def create_project(
         raise HTTPException(status_code=400, detail=f"Desteklenmeyen dosya türü: {ext}")
 
     # --- 3. Save file locally (stream + size limit) ---
+    # On the storage filesystem, so processing moves it into storage with a rename
     project_id = str(uuid.uuid4())
-    work_dir = settings.temp_path / project_id
-    work_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = get_r2_storage().ingest_dir(project_id)
 
     local_path = work_dir / f"source{ext}"
     try:
-        _save_upload_file(file, local_path, settings.max_upload_bytes)
+        _, content_hash = _save_upload_file(file, local_path, settings.max_upload_bytes, hash_content=blob_store.enabled())
     except HTTPException:
         shutil.rmtree(work_dir, ignore_errors=True)
         raise
@@ -393,6 +444,7 @@ def create_project(
             work_dir=str(work_dir),
             ext=ext,
             plan_data=plan_data,
+            content_hash=content_hash,
         )
         celery_ok = True
     except Exception as e:
@@ -407,6 +459,7 @@ def create_project(
                 "work_dir": str(work_dir),
                 "ext": ext,
                 "plan_data": plan_data,
+                "content_hash": content_hash,
             },
             daemon=True,
         )
@@ -415,6 +468,7 @@ def create_project(
 
     # --- 7. Increment daily job counter (only after successful enqueue) ---
     sb.rpc("increment_daily_jobs", {"user_id_param": user["id"]})
+    invalidate_profile(user["id"])
 
     logger.info("project_upload_accepted", project_id=project_id, size=actual_size)
 
@@ -432,11 +486,22 @@ def _process_video_project(
     work_dir: str,
     ext: str,
     plan_data: dict,
+    content_hash: Optional[str] = None,
 ):
-    """Background task: probe media, extract subtitles, upload to R2."""
+    """Background task: probe media, extract subtitles, upload to R2.
+    `content_hash` (SHA-256 computed during upload) lets STORAGE_DEDUP reuse an
+    identical source video and its preview."""
     sb = get_supabase_admin()
     r2 = get_r2_storage()
     work_dir_path = Path(work_dir)
+    # stored_files / subtitle_files rows are written in bulk at the end
+    uow = sb.unit_of_work()
+    stored_bytes = [0]
+
+    def _commit_stored_rows():
+        uow.commit()
+        adjust_user_storage(sb, user_id, stored_bytes[0])
+        stored_bytes[0] = 0
 
     try:
         # --- Probe media info ---
@@ -466,52 +531,65 @@ def _process_video_project(
             project_update["source_lang"] = detected_source
         sb.table("projects").update(project_update).eq("id", project_id).execute()
 
-        # --- Upload source video to R2 (file copy, no RAM load) ---
-        storage_key = r2.get_storage_key(user_id, project_id, "source", f"video{ext}")
-        r2.upload_file(storage_key, local_path, content_type=f"video/{ext.lstrip('.')}")
-
-        sb.table("stored_files").insert({
-            "user_id": user_id,
-            "project_id": project_id,
-            "file_type": "source_video",
-            "storage_path": storage_key,
-            "file_size_bytes": actual_size,
-            "cdn_url": r2.get_cdn_url(storage_key),
-            "expires_at": expires_at,
-        }).execute()
-
         # --- Create browser-compatible preview if needed (MKV/AVI audio fix) ---
-        preview_key = storage_key  # default: use source
+        # (reads the uploaded file locally; it is moved into storage once nothing else reads it)
+        storage_key = r2.get_storage_key(user_id, project_id, "source", f"video{ext}")
         if needs_web_transcode(local_path):
             try:
-                preview_path = work_dir_path / "preview.mp4"
-                create_web_preview(local_path, str(preview_path))
-                preview_key = r2.get_storage_key(user_id, project_id, "source", "preview.mp4")
-                r2.upload_file(preview_key, str(preview_path), content_type="video/mp4")
-                preview_size = preview_path.stat().st_size
-                sb.table("stored_files").insert({
+                # Same source already ingested: reuse its preview instead of transcoding
+                preview = blob_store.reuse(sb, r2, content_hash and blob_store.preview_hash(content_hash))
+                if not preview:
+                    preview_path = work_dir_path / "preview.mp4"
+                    create_web_preview(local_path, str(preview_path))
+                    preview = blob_store.store_file(
+                        sb, r2, str(preview_path),
+                        r2.get_storage_key(user_id, project_id, "source", "preview.mp4"),
+                        content_type="video/mp4",
+                        content_hash=content_hash and blob_store.preview_hash(content_hash),
+                    )
+                uow.insert("stored_files", {
                     "user_id": user_id,
                     "project_id": project_id,
                     "file_type": "preview",
-                    "storage_path": preview_key,
-                    "file_size_bytes": preview_size,
-                    "cdn_url": r2.get_cdn_url(preview_key),
+                    "storage_path": preview["key"],
+                    "file_size_bytes": preview["size"],
+                    "cdn_url": r2.get_cdn_url(preview["key"]),
+                    **blob_store.hash_fields(preview["content_hash"]),
                     "expires_at": expires_at,
-                }).execute()
-                logger.info("web_preview_created", project_id=project_id, size=preview_size)
+                })
+                stored_bytes[0] += preview["size"]
+                logger.info("web_preview_created", project_id=project_id, size=preview["size"])
             except Exception as e:
                 logger.warning("web_preview_failed", project_id=project_id, error=str(e))
-                preview_key = storage_key  # fallback to original
+
+        # --- Extract subtitles ---
+        sub_dir = work_dir_path / "subtitles"
+        extracted = extract_all_subtitles(local_path, str(sub_dir))
+
+        # --- Move source video into storage (rename on local storage, multipart upload on S3;
+        # dropped on a STORAGE_DEDUP hit) ---
+        source = blob_store.store_file(
+            sb, r2, local_path, storage_key,
+            content_type=f"video/{ext.lstrip('.')}", content_hash=content_hash,
+        )
+        storage_key = source["key"]
+        uow.insert("stored_files", {
+            "user_id": user_id,
+            "project_id": project_id,
+            "file_type": "source_video",
+            "storage_path": storage_key,
+            "file_size_bytes": actual_size,
+            "cdn_url": r2.get_cdn_url(storage_key),
+            **blob_store.hash_fields(source["content_hash"]),
+            "expires_at": expires_at,
+        })
+        stored_bytes[0] += actual_size
 
         # IMPORTANT: file_url must ALWAYS point to original source (not preview)
         # Preview is served via stored_files lookup in get_project endpoint
         # Export task uses file_url as source — must be original quality
         sb.table("projects").update({"file_url": storage_key}).eq("id", project_id).execute()
 
-        # --- Extract subtitles ---
-        sub_dir = work_dir_path / "subtitles"
-        extracted = extract_all_subtitles(local_path, str(sub_dir))
-
         total_lines = 0
         for sub_info in extracted:
             if not sub_info.get("extracted"):
@@ -520,38 +598,36 @@ def _process_video_project(
             lines = parse_subtitle_file(sub_info["file_path"])
             total_lines += len(lines)
 
-            sub_file_id = str(uuid.uuid4())
-            sb.table("subtitle_files").insert({
-                "id": sub_file_id,
-                "project_id": project_id,
-                "format": sub_info["format"],
-                "language": sub_info["language"],
-                "track_index": sub_info["stream_index"],
-                "total_lines": len(lines),
-            }).execute()
-
             sub_storage_key = r2.get_storage_key(
                 user_id, project_id, "subtitle",
                 f"sub_{sub_info['stream_index']}_{sub_info['language']}.{sub_info['format']}"
             )
-            with open(sub_info["file_path"], "rb") as sf:
-                sub_data = sf.read()
-                r2.upload(sub_storage_key, sub_data, content_type="text/plain")
+            stored_sub = blob_store.store_file(sb, r2, sub_info["file_path"], sub_storage_key, content_type="text/plain")
+            sub_storage_key = stored_sub["key"]
 
-            sub_size = len(sub_data)
-            sb.table("stored_files").insert({
+            # Uploaded first, so the row is inserted with its file_url in one go
+            uow.insert("subtitle_files", {
+                "id": str(uuid.uuid4()),
+                "project_id": project_id,
+                "format": sub_info["format"],
+                "language": sub_info["language"],
+                "track_index": sub_info["stream_index"],
+                "total_lines": len(lines),
+                "file_url": sub_storage_key,
+            })
+            uow.insert("stored_files", {
                 "user_id": user_id,
                 "project_id": project_id,
                 "file_type": f"subtitle_{sub_info['format']}",
                 "storage_path": sub_storage_key,
-                "file_size_bytes": sub_size,
+                "file_size_bytes": stored_sub["size"],
                 "cdn_url": r2.get_cdn_url(sub_storage_key),
+                **blob_store.hash_fields(stored_sub["content_hash"]),
                 "expires_at": expires_at,
-            }).execute()
+            })
+            stored_bytes[0] += stored_sub["size"]
 
-            sb.table("subtitle_files").update({
-                "file_url": sub_storage_key,
-            }).eq("id", sub_file_id).execute()
+        _commit_stored_rows()
 
         # --- Mark project as ready ---
         sb.table("projects").update({
@@ -559,12 +635,15 @@ def _process_video_project(
             "status": "ready",
         }).eq("id", project_id).execute()
 
-        _recalculate_user_storage(sb, user_id)
-
         logger.info("project_processing_done", project_id=project_id, lines=total_lines, subs=len(extracted))
 
     except Exception as e:
         logger.error("project_processing_failed", error=str(e), project_id=project_id)
+        try:
+            # Still record what was uploaded, so storage accounting and cleanup see it
+            _commit_stored_rows()
+        except Exception as commit_error:
+            logger.warning("project_processing_records_failed", project_id=project_id, error=str(commit_error))
         try:
             sb.table("projects").update({"status": "failed"}).eq("id", project_id).execute()
         except Exception:
@@ -584,109 +663,234 @@ def delete_project(project_id: str, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Project not found")
 
     # Delete all local storage files for this project
-    stored = sb.table("stored_files").select("storage_path").eq("project_id", project_id).execute()
+    stored = (
+        sb.table("stored_files")
+        .select(blob_store.file_columns("storage_path, user_id, file_size_bytes, uploaded_to_user_storage"))
+        .eq("project_id", project_id)
+        .execute()
+    )
     for f in (stored.data or []):
         try:
-            r2.delete(f["storage_path"])
+            blob_store.delete_stored_file(sb, r2, f)
         except Exception:
             pass
 
     # CASCADE handles subtitle_files, translation_jobs, export_jobs, stored_files
     sb.table("projects").delete().eq("id", project_id).execute()
 
-    # Recalculate storage
-    _recalculate_user_storage(sb, user["id"])
+    release_files_storage(sb, stored.data or [])
 
 
-@router.get("/{project_id}/tracks")
-def get_project_tracks(project_id: str, user: dict = Depends(get_current_user)):
-    """Get all subtitle file tracks (languages) for a project."""
-    sb = get_supabase_admin()
-    project = sb.table("projects").select("id").eq("id", project_id).eq("user_id", user["id"]).single().execute()
+def _subtitles_etag(sub_files: list[dict]) -> str:
+    """ETag of the subtitle lines served for these subtitle_files rows (files + pending edits)."""
+    return make_etag([track_version(sf) for sf in sub_files])
+
+
+async def _subtitles_etag_async(sub_files: list[dict]) -> str:
+    """_subtitles_etag off the event loop (version lookups are HEAD requests on the S3 backend)."""
+    return await run_in_threadpool(_subtitles_etag, sub_files)
+
+
+async def _owned_sub_files(project_id: str, user: dict, subtitle_file_id: str | None = None, columns: str = "*") -> list[dict]:
+    """subtitle_files rows of a project owned by `user`, in track order (404 if not owned).
+    The ownership check and the track query run concurrently."""
+    sb = get_supabase_async()
+    query = sb.table("subtitle_files").select(columns).eq("project_id", project_id)
+    if subtitle_file_id:
+        query = query.eq("id", subtitle_file_id)
+    project, sub_files = await asyncio.gather(
+        sb.table("projects").select("id").eq("id", project_id).eq("user_id", user["id"]).maybeSingle().execute(),
+        query.order("track_index").execute(),
+    )
     if not project.data:
         raise HTTPException(status_code=404, detail="Project not found")
+    return sub_files.data or []
 
-    tracks = sb.table("subtitle_files").select("id, language, format, track_index, total_lines").eq("project_id", project_id).order("track_index").execute()
-    return tracks.data or []
+
+async def _load_track(sub_file: dict):
+    """Parsed track off the event loop (file reads + parsing), or None if it can't be parsed."""
+    try:
+        return await run_in_threadpool(get_parsed_track, sub_file)
+    except Exception as e:
+        logger.warning("subtitle_parse_failed", file_id=sub_file["id"], error=str(e))
+        return None
+
+
+@router.get("/{project_id}/tracks")
+async def get_project_tracks(project_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
+    """Get all subtitle file tracks (languages) for a project."""
+    tracks = await _owned_sub_files(project_id, user, columns="id, language, format, track_index, total_lines")
+    cached = not_modified(request, response, make_etag(tracks))
+    if cached:
+        return cached
+    return tracks
+
+
+@router.get("/{project_id}/tracks/summary")
+async def get_project_track_summaries(project_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
+    """Lightweight per-track summary (line counts, translated count, time span) without the lines."""
+    sub_files = [sf for sf in await _owned_sub_files(project_id, user) if sf.get("file_url")]
+    cached = not_modified(request, response, await _subtitles_etag_async(sub_files))
+    if cached:
+        return cached
+    summaries = []
+    for sf in sub_files:
+        track = await _load_track(sf)
+        if track is not None:
+            summaries.append(track.summary())
+    return json_response(summaries, response)
+
+
+def _select_lines(track, t0: float | None, t1: float | None, line_from: int | None, line_to: int | None) -> list[dict]:
+    """Lines of one track in a time window (seconds, [t0, t1)) and/or line-number range."""
+    if t0 is None and t1 is None:
+        return track.line_range(line_from, line_to)
+    lines = track.overlapping(
+        int((t0 or 0) * 1000),
+        int(t1 * 1000) if t1 is not None else 2**62,
+    )
+    if line_from is not None or line_to is not None:
+        lines = [
+            l for l in lines
+            if (line_from is None or l["line_number"] >= line_from)
+            and (line_to is None or l["line_number"] <= line_to)
+        ]
+    return lines
 
 
 @router.get("/{project_id}/subtitles")
-def get_project_subtitles(
+async def get_project_subtitles(
     project_id: str,
+    request: Request,
+    response: Response,
     subtitle_file_id: str | None = None,
+    t0: float | None = Query(None, ge=0, description="Window start (seconds)"),
+    t1: float | None = Query(None, ge=0, description="Window end (seconds); lines on screen in [t0, t1) are returned"),
+    line_from: int | None = Query(None, ge=1),
+    line_to: int | None = Query(None, ge=1),
+    cursor: str | None = None,
+    limit: int | None = Query(None, ge=1, le=5000),
     user: dict = Depends(get_current_user),
 ):
-    """Get subtitle lines by parsing the file from local storage."""
-    sb = get_supabase_admin()
-    r2 = get_r2_storage()
+    """Get subtitle lines from the parsed-track cache.
 
-    project = sb.table("projects").select("id").eq("id", project_id).eq("user_id", user["id"]).single().execute()
-    if not project.data:
-        raise HTTPException(status_code=404, detail="Project not found")
+    Without `limit`/`cursor` the full (optionally filtered) list is returned as before.
+    With them, returns {"data": [...], "next_cursor": str | None}; pass next_cursor back to continue.
+    The ETag covers the selected tracks' files and edit logs; send it back as If-None-Match
+    (304 when unchanged) or as If-Match on the batch update.
+    """
+    after: tuple[str, int] | None = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    paginate = cursor is not None or limit is not None
+    page_size = limit or 500
 
     # Get subtitle files for this project
-    query = sb.table("subtitle_files").select("*").eq("project_id", project_id)
-    if subtitle_file_id:
-        query = query.eq("id", subtitle_file_id)
-    sub_files = query.order("track_index").execute()
+    sub_files = [sf for sf in await _owned_sub_files(project_id, user, subtitle_file_id) if sf.get("file_url")]
+
+    cached = not_modified(request, response, await _subtitles_etag_async(sub_files))
+    if cached:
+        return cached
+
+    # Resume after the cursor's track
+    if after:
+        ids = [sf["id"] for sf in sub_files]
+        if after[0] not in ids:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        sub_files = sub_files[ids.index(after[0]):]
 
     all_lines = []
-    for sf in (sub_files.data or []):
-        file_url = sf.get("file_url")
-        if not file_url:
+    next_cursor = None
+    for sf in sub_files:
+        track = await _load_track(sf)
+        if track is None:
             continue
 
-        # Read file from local storage and parse
-        try:
-            file_data = r2.download(file_url)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sf['format']}") as tf:
-                tmp = Path(tf.name)
-                tf.write(file_data)
+        lines = _select_lines(track, t0, t1, line_from, line_to)
+
+        if after and after[0] == sf["id"]:
+            lines = [l for l in lines if l["line_number"] > after[1]]
+
+        if paginate and len(all_lines) + len(lines) > page_size:
+            take = page_size - len(all_lines)
+            all_lines.extend(lines[:take])
+            last = all_lines[-1]
+            next_cursor = encode_cursor(last["subtitle_file_id"], last["line_number"])
+            break
+        all_lines.extend(lines)
+
+    if paginate:
+        return json_response({"data": all_lines, "next_cursor": next_cursor}, response)
+    return json_response(all_lines, response)
+
+
+@router.get("/{project_id}/subtitles/stream")
+async def stream_project_subtitles(
+    project_id: str,
+    request: Request,
+    response: Response,
+    subtitle_file_id: str | None = None,
+    t0: float | None = Query(None, ge=0, description="Window start (seconds)"),
+    t1: float | None = Query(None, ge=0, description="Window end (seconds)"),
+    line_from: int | None = Query(None, ge=1),
+    line_to: int | None = Query(None, ge=1),
+    user: dict = Depends(get_current_user),
+):
+    """Same lines as GET /subtitles, streamed as NDJSON (one line object per row, track by track)
+    so the client can render progressively. Shares the ETag of GET /subtitles."""
+    sub_files = [sf for sf in await _owned_sub_files(project_id, user, subtitle_file_id) if sf.get("file_url")]
+
+    cached = not_modified(request, response, await _subtitles_etag_async(sub_files))
+    if cached:
+        return cached
+
+    def iter_lines():
+        for sf in sub_files:
             try:
-                lines = parse_subtitle_file(str(tmp))
-            finally:
-                tmp.unlink(missing_ok=True)
-
-            # Check if translated version exists
-            translated_url = sf.get("translated_file_url")
-            translated_lines = {}
-            if translated_url:
-                try:
-                    tr_data = r2.download(translated_url)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sf['format']}") as tf:
-                        tr_tmp = Path(tf.name)
-                        tf.write(tr_data)
-                    try:
-                        tr_parsed = parse_subtitle_file(str(tr_tmp))
-                    finally:
-                        tr_tmp.unlink(missing_ok=True)
-                    translated_lines = {l["line_number"]: l["original_text"] for l in tr_parsed}
-                except Exception:
-                    pass
-
-            for line in lines:
-                tr_text = translated_lines.get(line["line_number"])
-                all_lines.append({
-                    "id": f"{sf['id']}_{line['line_number']}",
-                    "subtitle_file_id": sf["id"],
-                    "project_id": project_id,
-                    "line_number": line["line_number"],
-                    "start_time": line["start_time"],
-                    "end_time": line["end_time"],
-                    "original_text": line["original_text"],
-                    "translated_text": tr_text,
-                    "style": line.get("style"),
-                    "is_translated": bool(tr_text),
-                })
-        except Exception as e:
-            logger.warning("subtitle_parse_failed", file_id=sf["id"], error=str(e))
+                track = get_parsed_track(sf)
+            except Exception as e:
+                logger.warning("subtitle_parse_failed", file_id=sf["id"], error=str(e))
+                continue
+            yield from _select_lines(track, t0, t1, line_from, line_to)
+
+    return ndjson_response(iter_lines(), response)
 
-    return all_lines
+
+@router.get("/{project_id}/subtitles/at")
+async def get_active_subtitles(
+    project_id: str,
+    t: float = Query(..., ge=0, description="Playback position (seconds)"),
+    t_end: float | None = Query(None, ge=0, description="Optional range end (seconds); returns lines overlapping [t, t_end)"),
+    subtitle_file_id: str | None = None,
+    user: dict = Depends(get_current_user),
+):
+    """Get the cues on screen at a timestamp (or overlapping a range) via the track interval index."""
+    sub_files = await _owned_sub_files(project_id, user, subtitle_file_id)
+
+    start_ms = int(t * 1000)
+    end_ms = int(t_end * 1000) if t_end is not None else None
+    active = []
+    for sf in sub_files:
+        if not sf.get("file_url"):
+            continue
+        track = await _load_track(sf)
+        if track is None:
+            continue
+        if end_ms is not None:
+            active.extend(track.overlapping(start_ms, end_ms))
+        else:
+            active.extend(track.active_at(start_ms))
+    return json_response(active)
 
 
 @router.patch("/{project_id}/subtitles/batch")
 def batch_update_subtitles(
     project_id: str,
+    request: Request,
+    response: Response,
     updates: dict = Body(...),
     user: dict = Depends(get_current_user),
 ):
@@ -702,9 +906,16 @@ def batch_update_subtitles(
         OR "<subtitle_file_id>_<line_number>": "new text"  // legacy string format
       }
     }
+    Edits are appended to the subtitle file's edit log and folded into the stored
+    files by a background compaction (after N batches or T seconds).
+
+    If-Match (optional): the ETag of GET /subtitles, either for the whole project or for
+    the single track being edited. 412 if those subtitles changed since; the new ETag is
+    returned on success. The check and the append run under a per-project lock (409 if
+    another save holds it for more than 10 s).
     """
     sb = get_supabase_admin()
-    r2 = get_r2_storage()
+    settings = get_settings()
 
     try:
         project = sb.table("projects").select("id").eq("id", project_id).eq("user_id", user["id"]).single().execute()
@@ -729,138 +940,56 @@ def batch_update_subtitles(
             line_num = int(line_num_str)
         except ValueError:
             continue
-        if isinstance(value, str):
-            # Legacy format: just translated text
-            edit_data = {"translated_text": value}
-        elif isinstance(value, dict):
-            edit_data = value
-        else:
+        try:
+            edit_data = normalize_edit(value)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not edit_data:
             continue
         grouped.setdefault(sf_id, {})[line_num] = edit_data
 
     updated_count = 0
+    with edit_lock(project_id) as acquired:
+        if not acquired:
+            raise HTTPException(status_code=409, detail="Another save is in progress, please retry")
+
+        # Loaded under the lock: the ETag check and the appends see no concurrent save
+        project_files = [
+            sf for sf in (sb.table("subtitle_files").select("*").eq("project_id", project_id).order("track_index").execute().data or [])
+            if sf.get("file_url")
+        ]
+        files_by_id = {sf["id"]: sf for sf in project_files}
+        touched = [files_by_id[sf_id] for sf_id in grouped if sf_id in files_by_id]
+
+        # Optimistic concurrency: the client's copy must still be current
+        project_etag = _subtitles_etag(project_files)
+        track_etag = _subtitles_etag(touched) if len(touched) == 1 else None
+        require_match(
+            request, project_etag, *([track_etag] if track_etag else []),
+            detail="Subtitles changed since they were loaded",
+        )
+        per_track = track_etag is not None and etag_matches(request.headers.get("if-match"), track_etag, weak=False)
 
-    for sf_id, line_edits in grouped.items():
-        try:
-            sub_file = sb.table("subtitle_files").select("*").eq("id", sf_id).eq("project_id", project_id).maybeSingle().execute()
-        except Exception as e:
-            logger.warning("batch_update_sf_lookup_failed", sf_id=sf_id, error=str(e))
-            continue
-        if not sub_file.data:
-            logger.warning("batch_update_sf_not_found", sf_id=sf_id)
-            continue
-
-        original_format = sub_file.data.get("format", "srt").lower()
-
-        # Read original file to get timing info
-        file_url = sub_file.data.get("file_url")
-        if not file_url:
-            logger.warning("batch_update_no_file_url", sf_id=sf_id)
-            continue
-
-        try:
-            file_data = r2.download(file_url)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sub_file.data['format']}") as tf:
-                tmp = Path(tf.name)
-                tf.write(file_data)
-            try:
-                original_lines = parse_subtitle_file(str(tmp))
-            finally:
-                tmp.unlink(missing_ok=True)
-        except Exception as e:
-            logger.error("batch_update_read_original_failed", sf_id=sf_id, file_url=file_url, error=str(e))
-            continue
+        for sf_id, line_edits in grouped.items():
+            if sf_id not in files_by_id:
+                logger.warning("batch_update_sf_not_found", sf_id=sf_id)
+                continue
 
-        # Read existing translated file if it exists
-        translated_url = sub_file.data.get("translated_file_url")
-        existing_translations: dict[int, str] = {}
-        if translated_url:
             try:
-                tr_data = r2.download(translated_url)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{original_format}") as tf:
-                    tr_tmp = Path(tf.name)
-                    tf.write(tr_data)
-                try:
-                    tr_parsed = parse_subtitle_file(str(tr_tmp))
-                finally:
-                    tr_tmp.unlink(missing_ok=True)
-                existing_translations = {l["line_number"]: l["original_text"] for l in tr_parsed}
+                batches = append_edits(sf_id, line_edits)
             except Exception as e:
-                logger.warning("batch_update_read_translated_failed", sf_id=sf_id, error=str(e))
-
-        # Apply edits on top of existing translations
-        for ln, edit_data in line_edits.items():
-            if "translated_text" in edit_data:
-                existing_translations[ln] = edit_data["translated_text"]
-
-        # Build output lines (apply timing edits from original)
-        out_lines = []
-        has_timing_edits = False
-        for line in original_lines:
-            ln = line["line_number"]
-            edit = line_edits.get(ln, {})
-            start = edit.get("start_time", line["start_time"])
-            end = edit.get("end_time", line["end_time"])
-            if start != line["start_time"] or end != line["end_time"]:
-                has_timing_edits = True
-            out_lines.append({
-                "line_number": ln,
-                "start_time": start,
-                "end_time": end,
-                "original_text": existing_translations.get(ln, line["original_text"]),
-            })
-
-        # Write translated file
-        out_ext = f".{original_format}" if original_format in ("ass", "ssa") else ".srt"
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=out_ext) as tf:
-                tmp_out = Path(tf.name)
-
-            if original_format in ("ass", "ssa"):
-                from app.services.subtitle_parser import write_ass
-                write_ass(out_lines, str(tmp_out))
-            else:
-                write_srt(out_lines, str(tmp_out), use_translated=False)
-
-            translated_key = r2.get_storage_key(
-                user["id"], project_id, "subtitle",
-                f"translated_{sf_id}{out_ext}"
-            )
-            with open(tmp_out, "rb") as f:
-                r2.upload(translated_key, f.read(), content_type="text/plain")
-            tmp_out.unlink(missing_ok=True)
-
-            sb.table("subtitle_files").update({
-                "translated_file_url": translated_key,
-            }).eq("id", sf_id).execute()
-
-            # If timing was edited, also update the original source file
-            if has_timing_edits:
-                orig_out_lines = []
-                for line in original_lines:
-                    ln = line["line_number"]
-                    edit = line_edits.get(ln, {})
-                    orig_out_lines.append({
-                        "line_number": ln,
-                        "start_time": edit.get("start_time", line["start_time"]),
-                        "end_time": edit.get("end_time", line["end_time"]),
-                        "original_text": line["original_text"],
-                    })
-                with tempfile.NamedTemporaryFile(delete=False, suffix=out_ext) as tf:
-                    tmp_orig = Path(tf.name)
-                if original_format in ("ass", "ssa"):
-                    write_ass(orig_out_lines, str(tmp_orig))
-                else:
-                    write_srt(orig_out_lines, str(tmp_orig), use_translated=False)
-                with open(tmp_orig, "rb") as f:
-                    r2.upload(file_url, f.read(), content_type="text/plain")
-                tmp_orig.unlink(missing_ok=True)
-
+                logger.error("batch_update_write_failed", sf_id=sf_id, error=str(e))
+                continue
             updated_count += len(line_edits)
-        except Exception as e:
-            logger.error("batch_update_write_failed", sf_id=sf_id, error=str(e))
-            continue
 
+            if batches >= settings.subtitle_edit_compact_after:
+                schedule_compaction(sf_id)
+            elif batches == 1:
+                # First edit since the last compaction: fold it in after T seconds
+                schedule_compaction(sf_id, countdown=settings.subtitle_edit_compact_seconds)
+
+        # New validator, in the scope the client sent (project-wide unless it matched the single track)
+        response.headers["ETag"] = _subtitles_etag(touched if per_track else project_files)
     return {"updated": updated_count}
 
 
@@ -879,11 +1008,10 @@ def create_subtitle_project(
 
     # --- 1. Check daily job limit ---
     profile = user["profile"]
-    plan = sb.table("subscription_plans").select("*").eq("id", profile.get("plan_id", "free")).single().execute()
-    if not plan.data:
+    plan_data = reference_cache.get_plan(profile.get("plan_id", "free"))
+    if not plan_data:
         raise HTTPException(status_code=500, detail="Plan not found")
 
-    plan_data = plan.data
     daily_limit = plan_data.get("daily_job_limit", 3)
 
     daily_used = sb.rpc("check_and_reset_daily_jobs", {"user_id_param": user["id"]}).data
@@ -906,7 +1034,7 @@ def create_subtitle_project(
 
     local_path = work_dir / f"subtitle{ext}"
     try:
-        _save_upload_file(file, local_path, settings.max_upload_bytes)
+        _, content_hash = _save_upload_file(file, local_path, settings.max_upload_bytes, hash_content=blob_store.enabled())
     except HTTPException:
         shutil.rmtree(work_dir, ignore_errors=True)
         raise
@@ -947,9 +1075,12 @@ def create_subtitle_project(
         sb.table("projects").insert(project_data).execute()
 
         # --- 7. Upload subtitle to R2 ---
-        storage_key = r2.get_storage_key(user["id"], project_id, "subtitle", f"original{ext}")
-        with open(local_path, "rb") as f:
-            r2.upload(storage_key, f.read(), content_type="text/plain")
+        stored = blob_store.store_file(
+            sb, r2, str(local_path),
+            r2.get_storage_key(user["id"], project_id, "subtitle", f"original{ext}"),
+            content_type="text/plain", content_hash=content_hash,
+        )
+        storage_key = stored["key"]
 
         sb.table("stored_files").insert({
             "user_id": user["id"],
@@ -958,6 +1089,7 @@ def create_subtitle_project(
             "storage_path": storage_key,
             "file_size_bytes": actual_size,
             "cdn_url": r2.get_cdn_url(storage_key),
+            **blob_store.hash_fields(stored["content_hash"]),
             "expires_at": expires_at,
         }).execute()
 
@@ -975,8 +1107,9 @@ def create_subtitle_project(
 
         # --- 9. Increment daily job counter ---
         sb.rpc("increment_daily_jobs", {"user_id_param": user["id"]})
+        invalidate_profile(user["id"])
 
-        _recalculate_user_storage(sb, user["id"])
+        adjust_user_storage(sb, user["id"], actual_size)
 
         logger.info("subtitle_project_created", project_id=project_id, lines=len(lines), format=sub_format)
 
@@ -1005,9 +1138,11 @@ def export_srt(
     project_id: str,
     subtitle_file_id: str | None = None,
     translated: bool = True,
+    download: bool = False,
     user: dict = Depends(get_current_user),
 ):
-    """Export subtitle lines as SRT file content (from local files)."""
+    """Export subtitle lines as SRT file content (from local files).
+    With `download`, the stored file is streamed as an attachment instead of a JSON body."""
     sb = get_supabase_admin()
     r2 = get_r2_storage()
 
@@ -1025,23 +1160,26 @@ def export_srt(
 
     sf = sub_files.data[0]
 
-    # If translated requested and translated file exists, serve that
-    if translated and sf.get("translated_file_url"):
-        try:
-            tr_data = r2.download(sf["translated_file_url"])
-            return {"filename": f"{project.data['name']}_translated.srt", "content": tr_data.decode("utf-8")}
-        except Exception:
-            pass
-
-    # Otherwise serve original
-    file_url = sf.get("file_url")
-    if not file_url:
-        raise HTTPException(status_code=404, detail="Subtitle file not found")
-
-    file_data = r2.download(file_url)
-    return {"filename": f"{project.data['name']}.srt", "content": file_data.decode("utf-8")}
+    # Fold pending editor edits into the stored files before serving them (a compaction
+    # running elsewhere is waited for, and may have changed the row too)
+    if has_pending_edits(sf["id"]):
+        compact_edits(sf["id"])
+        sf = sb.table("subtitle_files").select("*").eq("id", sf["id"]).single().execute().data
+
+    # If translated requested and translated file exists, serve that; otherwise the original
+    if translated and sf.get("translated_file_url") and r2.exists(sf["translated_file_url"]):
+        file_url, filename = sf["translated_file_url"], f"{project.data['name']}_translated.srt"
+    else:
+        file_url, filename = sf.get("file_url"), f"{project.data['name']}.srt"
+        if not file_url:
+            raise HTTPException(status_code=404, detail="Subtitle file not found")
 
+    if download:
+        return StreamingResponse(
+            r2.iter_chunks(file_url),
+            media_type="application/x-subrip",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+        )
+    with r2.open_read(file_url) as f:
+        return {"filename": filename, "content": f.read().decode("utf-8")}
 
-def _recalculate_user_storage(sb, user_id: str):
-    """Delegate to shared helper in cleanup module."""
-    recalculate_user_storage(sb, user_id)
@@ -1,17 +1,23 @@
 """User external storage configuration & file management routes."""
 
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 import structlog
 
+from app.core.responses import ndjson_response
 from app.core.security import get_current_user
 from app.core.supabase import get_supabase_admin
 from app.services.user_storage import (
     test_connection,
     list_bucket_files,
+    iter_bucket_files,
     delete_bucket_file,
     rename_bucket_file,
     get_presigned_url,
     get_file_info,
+    invalidate_s3_client,
+    get_active_config,
 )
 
 logger = structlog.get_logger()
@@ -20,18 +26,10 @@ router = APIRouter(prefix="/storage-config", tags=["StorageConfig"])
 
 def _get_user_storage_config(user_id: str) -> dict:
     """Fetch the user's active storage config from Supabase."""
-    sb = get_supabase_admin()
-    result = (
-        sb.table("user_storage_configs")
-        .select("*")
-        .eq("user_id", user_id)
-        .eq("is_active", True)
-        .maybeSingle()
-        .execute()
-    )
-    if not result.data:
+    config = get_active_config(user_id)
+    if not config:
         raise HTTPException(status_code=404, detail="Aktif depolama yapılandırması bulunamadı. Ayarlar sayfasından yapılandırın.")
-    return result.data
+    return config
 
 
 # --- Test Connection ---
@@ -40,6 +38,9 @@ def test_storage_connection(user: dict = Depends(get_current_user)):
     """Test the user's external storage connection (R2 or B2)."""
     config = _get_user_storage_config(user["id"])
     result = test_connection(config)
+    if not result["ok"]:
+        # Retry with a fresh client (new connection pool) once the problem is fixed
+        invalidate_s3_client(config)
 
     # Update last_test_result in DB
     sb = get_supabase_admin()
@@ -95,6 +96,8 @@ def test_custom_storage_connection(
                 config["b2_app_key_encrypted"] = sd.get("b2_app_key_encrypted") or ""
 
     result = test_connection(config)
+    if not result["ok"]:
+        invalidate_s3_client(config)
     return result
 
 
@@ -102,21 +105,38 @@ def test_custom_storage_connection(
 @router.get("/files")
 def list_external_files(
     prefix: str = "",
-    max_keys: int = Query(200, le=1000),
+    max_keys: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    delimiter: str = Query("", max_length=1),
     user: dict = Depends(get_current_user),
 ):
-    """List files in the user's external storage bucket."""
+    """List one page of files in the user's external storage bucket.
+    Pass `next_cursor` as `cursor` for the next page; `delimiter=/` lists one folder level."""
     try:
         config = _get_user_storage_config(user["id"])
     except HTTPException:
         # No active config — return empty list instead of error
-        return {"ok": True, "files": [], "truncated": False, "count": 0}
-    result = list_bucket_files(config, prefix=prefix, max_keys=max_keys)
+        return {"ok": True, "files": [], "folders": [], "truncated": False, "next_cursor": None, "count": 0}
+    result = list_bucket_files(config, prefix=prefix, max_keys=max_keys, cursor=cursor, delimiter=delimiter)
     if not result["ok"]:
         raise HTTPException(status_code=400, detail=result.get("message", "Dosyalar listelenemedi"))
     return result
 
 
+@router.get("/files/stream")
+def stream_external_files(
+    prefix: str = "",
+    delimiter: str = Query("", max_length=1),
+    user: dict = Depends(get_current_user),
+):
+    """Every file (and folder, with a delimiter) under `prefix` as NDJSON, fetched page
+    by page while streaming. A failure mid-listing ends with a {"type": "error"} line."""
+    config = get_active_config(user["id"])
+    if not config:
+        return ndjson_response([])
+    return ndjson_response(iter_bucket_files(config, prefix=prefix, delimiter=delimiter))
+
+
 # --- Get File Info ---
 @router.get("/files/info")
 def get_external_file_info(
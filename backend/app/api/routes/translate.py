@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 import structlog
 import uuid
 import time
@@ -7,13 +7,17 @@ import tempfile
 from pathlib import Path
 from datetime import datetime, timezone
 
-from app.core.security import get_current_user
-from app.core.supabase import get_supabase_admin
+from app.core.security import get_current_user, invalidate_profile
+from app.core.supabase import get_supabase_admin, get_supabase_async
 from app.core.config import get_settings
+from app.core.pagination import MAX_PAGE_SIZE, keyset, split_page
 from app.models.schemas import TranslationJobCreate
 from app.services.translation import get_engine
-from app.services.subtitle_parser import parse_subtitle_file, write_srt, write_ass
+from app.services.subtitle_parser import parse_stored_subtitle, write_srt, write_ass
 from app.services.storage import get_r2_storage
+from app.services.subtitle_edits import compact_edits
+from app.services.job_progress import JobProgressWriter
+from app.services import reference_cache
 from app.utils.chunking import build_chunks, apply_glossary_pre, apply_glossary_post, OVERLAP_LINES
 
 logger = structlog.get_logger()
@@ -44,14 +48,7 @@ def create_translation_job(
         raise HTTPException(status_code=404, detail="Subtitle file not found")
 
     # Read and parse the subtitle file to get line count
-    file_data = storage.download(sub_file.data["file_url"])
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sub_file.data['format']}") as tf:
-        tmp = Path(tf.name)
-        tf.write(file_data)
-    try:
-        lines = parse_subtitle_file(str(tmp))
-    finally:
-        tmp.unlink(missing_ok=True)
+    lines = parse_stored_subtitle(storage, sub_file.data["file_url"], sub_file.data["format"])
     total_lines = len(lines)
 
     if total_lines == 0:
@@ -59,9 +56,9 @@ def create_translation_job(
 
     # Check plan limits
     profile = user["profile"]
-    plan = sb.table("subscription_plans").select("*").eq("id", profile.get("plan_id", "free")).single().execute()
-    if plan.data:
-        limit = plan.data.get("lines_per_month", 1000)
+    plan = reference_cache.get_plan(profile.get("plan_id", "free"))
+    if plan:
+        limit = plan.get("lines_per_month", 1000)
         used = profile.get("lines_used_this_month", 0)
         if limit != -1 and used + total_lines > limit:
             raise HTTPException(status_code=429, detail=f"Aylık satır limitiniz aşıldı. Kullanılan: {used}, Limit: {limit}")
@@ -137,36 +134,66 @@ def create_translation_job(
 
 
 @router.get("/{job_id}")
-def get_translation_job(job_id: str, user: dict = Depends(get_current_user)):
+async def get_translation_job(job_id: str, user: dict = Depends(get_current_user)):
     """Get translation job status and progress."""
-    sb = get_supabase_admin()
-    result = sb.table("translation_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
+    sb = get_supabase_async()
+    result = await sb.table("translation_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
     if not result.data:
         raise HTTPException(status_code=404, detail="Job not found")
     return result.data
 
 
 @router.post("/{job_id}/cancel")
-def cancel_translation_job(job_id: str, user: dict = Depends(get_current_user)):
+async def cancel_translation_job(job_id: str, user: dict = Depends(get_current_user)):
     """Cancel a running translation job."""
-    sb = get_supabase_admin()
-    job = sb.table("translation_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
+    sb = get_supabase_async()
+    job = await sb.table("translation_jobs").select("*").eq("id", job_id).eq("user_id", user["id"]).single().execute()
     if not job.data:
         raise HTTPException(status_code=404, detail="Job not found")
     if job.data["status"] not in ("queued", "processing"):
         raise HTTPException(status_code=400, detail="Job cannot be cancelled")
 
-    sb.table("translation_jobs").update({"status": "cancelled"}).eq("id", job_id).execute()
-    sb.table("projects").update({"status": "ready"}).eq("id", job.data["project_id"]).execute()
+    await sb.table("translation_jobs").update({"status": "cancelled"}).eq("id", job_id).execute()
+    await sb.table("projects").update({"status": "ready"}).eq("id", job.data["project_id"]).execute()
     return {"status": "cancelled"}
 
 
+TRANSLATION_JOB_LIST_COLUMNS = (
+    "id, project_id, engine, source_lang, target_lang, status, progress, total_lines, "
+    "translated_lines, error_message, created_at, started_at, completed_at"
+)
+
+
 @router.get("/history/{project_id}")
-def get_translation_history(project_id: str, user: dict = Depends(get_current_user)):
-    """Get all translation jobs for a project."""
-    sb = get_supabase_admin()
-    result = sb.table("translation_jobs").select("*").eq("project_id", project_id).eq("user_id", user["id"]).order("created_at", desc=True).execute()
-    return result.data
+async def get_translation_history(
+    project_id: str,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    user: dict = Depends(get_current_user),
+):
+    """Get translation jobs for a project, newest first.
+    With `limit`/`cursor`, returns {"data": [...], "next_cursor": str | None}."""
+    sb = get_supabase_async()
+    query = (
+        sb.table("translation_jobs")
+        .select(TRANSLATION_JOB_LIST_COLUMNS)
+        .eq("project_id", project_id)
+        .eq("user_id", user["id"])
+    )
+    if cursor is None and limit is None:
+        result = await query.order("created_at", desc=True).order("id", desc=True).execute()
+        return result.data
+
+    limit = limit or get_settings().list_page_size
+    result = await keyset(query, cursor, limit).execute()
+    rows, next_cursor = split_page(result.data, limit)
+    return {"data": rows, "next_cursor": next_cursor}
+
+
+@router.post("/keys/invalidate", status_code=204)
+def invalidate_api_keys(user: dict = Depends(get_current_user)):
+    """Drop the cached API keys of the current user (call after editing user_api_keys)."""
+    reference_cache.invalidate("api_keys", user["id"])
 
 
 # ---------------------------------------------------------------------------
@@ -182,16 +209,16 @@ def _get_api_key(sb, user_id: str, engine: str, plan_id: str = "free", model_id:
     # IMPORTANT: Always honour the caller's model_id selection.
     # The user_api_keys.model_id is only a *default* when the caller didn't specify one.
     try:
-        user_keys = sb.table("user_api_keys").select("api_key_encrypted, model_id, is_default").eq("user_id", user_id).eq("engine", engine).execute()
-        if user_keys.data:
+        user_keys = reference_cache.get_user_api_keys(user_id, engine)
+        if user_keys:
             # Use default key or first available key
             chosen_key = None
-            for k in user_keys.data:
+            for k in user_keys:
                 if k.get("is_default") and k.get("api_key_encrypted"):
                     chosen_key = k
                     break
             if not chosen_key:
-                for k in user_keys.data:
+                for k in user_keys:
                     if k.get("api_key_encrypted"):
                         chosen_key = k
                         break
@@ -203,15 +230,15 @@ def _get_api_key(sb, user_id: str, engine: str, plan_id: str = "free", model_id:
         pass
 
     # 2. Check plan allows system keys
-    plan = sb.table("subscription_plans").select("can_use_system_keys").eq("id", plan_id).single().execute()
-    if plan.data and not plan.data.get("can_use_system_keys", False):
+    plan = reference_cache.get_plan(plan_id)
+    if plan and not plan.get("can_use_system_keys", False):
         return None, resolved_model
 
     # 3. System engine key from DB
     try:
-        engine_config = sb.table("translation_engines").select("api_key_encrypted").eq("id", engine).single().execute()
-        if engine_config.data and engine_config.data.get("api_key_encrypted"):
-            return engine_config.data["api_key_encrypted"], resolved_model
+        engine_config = reference_cache.get_engine_config(engine)
+        if engine_config and engine_config.get("api_key_encrypted"):
+            return engine_config["api_key_encrypted"], resolved_model
     except Exception:
         pass
 
@@ -245,29 +272,24 @@ def _run_translation(
     storage = get_r2_storage()
     # Create a new event loop for this thread (needed for async engine.translate_batch)
     loop = asyncio.new_event_loop()
+    job = JobProgressWriter(sb, "translation_jobs", job_id)
 
     try:
-        sb.table("translation_jobs").update({
+        job.update({
             "status": "processing",
             "started_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        }, flush=True)
 
-        # --- 1. Read subtitle file from local storage ---
+        # --- 1. Read subtitle file from local storage (pending editor edits folded in first) ---
+        compact_edits(subtitle_file_id)
         sub_file = sb.table("subtitle_files").select("*").eq("id", subtitle_file_id).single().execute()
         if not sub_file.data or not sub_file.data.get("file_url"):
             raise RuntimeError("Subtitle file not found in storage")
 
-        file_data = storage.download(sub_file.data["file_url"])
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sub_file.data['format']}") as tf:
-            tmp_src = Path(tf.name)
-            tf.write(file_data)
-        try:
-            all_lines = parse_subtitle_file(str(tmp_src))
-        finally:
-            tmp_src.unlink(missing_ok=True)
+        all_lines = parse_stored_subtitle(storage, sub_file.data["file_url"], sub_file.data["format"])
 
         if not all_lines:
-            sb.table("translation_jobs").update({"status": "completed", "progress": 100}).eq("id", job_id).execute()
+            job.update({"status": "completed", "progress": 100})
             return
 
         total_lines = len(all_lines)
@@ -290,8 +312,7 @@ def _run_translation(
         context_lines: list[str] = []
 
         for chunk_idx, chunk in enumerate(chunks):
-            job_check = sb.table("translation_jobs").select("status").eq("id", job_id).single().execute()
-            if job_check.data and job_check.data["status"] == "cancelled":
+            if job.is_cancelled():
                 logger.info("translation_cancelled", job_id=job_id)
                 sb.table("projects").update({"status": "ready"}).eq("id", project_id).execute()
                 return
@@ -319,10 +340,10 @@ def _run_translation(
                     context_lines.append(translated[j])
 
             progress = min(int((len(translated_map) / total_lines) * 100), 99)
-            sb.table("translation_jobs").update({
+            job.update({
                 "progress": progress,
                 "translated_lines": len(translated_map),
-            }).eq("id", job_id).execute()
+            })
 
         # --- 5. Build translated subtitle file (preserve original format) ---
         original_format = sub_file.data.get("format", "srt").lower()
@@ -346,9 +367,7 @@ def _run_translation(
             user_id, project_id, "subtitle",
             f"translated_{subtitle_file_id}{out_ext}"
         )
-        with open(tmp_out, "rb") as f:
-            storage.upload(translated_key, f.read(), content_type="text/plain")
-        tmp_out.unlink(missing_ok=True)
+        storage.move_file(translated_key, str(tmp_out), content_type="text/plain")
 
         # Update subtitle_files with translated file URL
         sb.table("subtitle_files").update({
@@ -358,19 +377,19 @@ def _run_translation(
         elapsed_ms = int((time.time() - start_time) * 1000)
 
         # Calculate cost
-        engine_config = sb.table("translation_engines").select("cost_per_line").eq("id", engine_id).single().execute()
-        cost_per_line = float(engine_config.data.get("cost_per_line", 0)) if engine_config.data else 0
+        engine_config = reference_cache.get_engine_config(engine_id)
+        cost_per_line = float(engine_config.get("cost_per_line") or 0) if engine_config else 0
         total_cost = cost_per_line * total_lines
 
         # Update job as completed
-        sb.table("translation_jobs").update({
+        job.update({
             "status": "completed",
             "progress": 100,
             "translated_lines": total_lines,
             "duration_ms": elapsed_ms,
             "cost_usd": total_cost,
             "completed_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        })
 
         # Update project
         sb.table("projects").update({
@@ -380,18 +399,20 @@ def _run_translation(
 
         # Update user's monthly usage
         sb.rpc("increment_lines_used", {"user_id_param": user_id, "lines_count": total_lines})
+        invalidate_profile(user_id)
 
         logger.info("translation_completed", job_id=job_id, lines=total_lines,
                     chunks=len(chunks), elapsed_ms=elapsed_ms)
 
     except Exception as e:
         logger.error("translation_failed", job_id=job_id, error=str(e))
-        sb.table("translation_jobs").update({
+        job.update({
             "status": "failed",
             "error_message": str(e)[:500],
-        }).eq("id", job_id).execute()
+        })
         sb.table("projects").update({"status": "ready"}).eq("id", project_id).execute()
     finally:
+        job.close()
         loop.close()
 
 
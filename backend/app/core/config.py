@@ -8,18 +8,36 @@ class Settings(BaseSettings):
     supabase_url: str = ""
     supabase_service_role_key: str = ""
     supabase_anon_key: str = ""
+    supabase_jwt_secret: str = ""  # legacy HS256 secret; asymmetric keys are read from the project's JWKS
+
+    # Auth (local JWT verification, revocation re-check interval, profile cache TTL)
+    auth_jwks_cache_seconds: int = 600
+    auth_session_check_seconds: int = 300
+    auth_profile_cache_seconds: int = 30
 
     # Redis
     redis_url: str = "redis://localhost:6379/0"
     redis_username: str = ""
     redis_password: str = ""
 
-    # Cloudflare R2 Storage
+    # Cloudflare R2 Storage (any S3-compatible endpoint: R2, MinIO, AWS S3)
     r2_access_key_id: str = ""
     r2_secret_access_key: str = ""
     r2_endpoint: str = ""
     r2_bucket_name: str = "subtranslate"
     r2_cdn_domain: str = "cdn.syrins.tech"
+    r2_region: str = "auto"
+
+    # Primary storage backend: "local" (STORAGE_DIR volume) or "s3" (the R2_* bucket).
+    # S3 transfers use multipart parts of STORAGE_PART_SIZE_MB with STORAGE_MAX_CONCURRENCY
+    # parallel parts; /files redirects to presigned URLs valid for STORAGE_PRESIGN_SECONDS
+    storage_backend: str = "local"
+    storage_part_size_mb: int = 16
+    storage_max_concurrency: int = 8
+    storage_presign_seconds: int = 3600
+    # Content-addressed storage: identical uploads/tracks are stored once and
+    # reference-counted (requires migration_content_dedup.sql)
+    storage_dedup: bool = False
 
     # AI Keys (system-level)
     openai_api_key: str = ""
@@ -31,11 +49,63 @@ class Settings(BaseSettings):
     port: int = 8000
     debug: bool = False
     cors_origins: str = "http://localhost:3000"
+    # Response compression (brotli if installed, else gzip) for bodies >= this many bytes
+    compression_min_size: int = 1024
+    compression_brotli_quality: int = 4
 
     # Upload & Storage
     max_upload_size_mb: int = 2048
     temp_dir: str = "./tmp"
     storage_dir: str = ""
+    # /files offload to the reverse proxy: "" (served by the app), "x-accel" (nginx
+    # X-Accel-Redirect to FILES_ACCEL_PREFIX + path) or "x-sendfile" (absolute path)
+    files_accel_mode: str = ""
+    files_accel_prefix: str = "/protected-files/"
+    # /files responses marked public (+ CDN-Cache-Control) so a CDN in front of the API caches them
+    files_cdn_cache: bool = False
+
+    # Supabase HTTP transport: HTTP/2 (needs httpx[http2]), pool sizes, timeouts,
+    # retries with jittered back-off, circuit breaker (opens after N consecutive failures)
+    supabase_http2: bool = False
+    supabase_max_connections: int = 20
+    supabase_async_max_connections: int = 50
+    supabase_timeout_seconds: float = 30.0
+    supabase_connect_timeout_seconds: float = 5.0
+    supabase_retries: int = 2
+    supabase_retry_backoff_seconds: float = 0.2
+    supabase_breaker_failures: int = 5
+    supabase_breaker_reset_seconds: float = 30.0
+
+    # Admin dashboard statistics snapshot (Celery beat refresh interval)
+    admin_stats_refresh_seconds: int = 60
+
+    # List endpoints: default page size (keyset pagination) and admin list count mode
+    # ("exact", "planned", "estimated" or "none")
+    list_page_size: int = 100
+    admin_list_count: str = "exact"
+
+    # PostgREST calls slower than this are logged as slow_query
+    slow_query_ms: int = 500
+
+    # Reference rows cache (plans, engines) and per-user API key cache, in seconds
+    reference_cache_seconds: int = 300
+    api_key_cache_seconds: int = 60
+    # boto3 clients for users' own buckets, reused per credential set for this long
+    user_storage_client_ttl_seconds: int = 900
+    # Listing pages of users' buckets are cached this long (0 disables)
+    user_storage_list_cache_seconds: int = 30
+    # Server-side push of exports to the user's bucket (multipart part size, parallel parts)
+    user_push_part_size_mb: int = 16
+    user_push_concurrency: int = 4
+
+    # Job progress write-behind (flush every N seconds / M merged updates; status re-read interval)
+    job_progress_flush_seconds: float = 2.0
+    job_progress_max_pending: int = 10
+    job_status_check_seconds: float = 5.0
+
+    # Subtitle editor edit log (compacted after N logged batches or T seconds)
+    subtitle_edit_compact_after: int = 50
+    subtitle_edit_compact_seconds: int = 30
 
     @property
     def redis_broker_url(self) -> str:
@@ -0,0 +1,59 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+Lists are ordered by (created_at, id) descending. A page is fetched with one extra
+row; if it is present, the last returned row's (created_at, id) becomes an opaque
+cursor and the next page is selected with a row-comparison filter instead of an
+OFFSET, so every page costs one index range scan however deep it is.
+"""
+
+import base64
+import json
+from typing import Optional
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 500
+COUNT_MODES = ("exact", "planned", "estimated", "none")
+
+
+def encode_keyset_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_keyset_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        if not isinstance(created_at, str) or not isinstance(row_id, str):
+            raise ValueError(cursor)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+def keyset(query, cursor: Optional[str], limit: int):
+    """Apply (created_at, id) DESC ordering, the cursor position and limit + 1 to `query`."""
+    query = query.order("created_at", desc=True).order("id", desc=True)
+    if cursor:
+        created_at, row_id = decode_keyset_cursor(cursor)
+        query = query.and_(
+            f'or(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{row_id}"))'
+        )
+    return query.limit(limit + 1)
+
+
+def split_page(rows: Optional[list], limit: int) -> tuple[list, Optional[str]]:
+    """(rows of this page, cursor of the next page or None) from a keyset() result."""
+    rows = rows or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_keyset_cursor(rows[-1])
+
+
+def count_mode(count: Optional[str]) -> Optional[str]:
+    """PostgREST count preference for a `count` query value ("none" -> no count)."""
+    if count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count must be one of {', '.join(COUNT_MODES)}")
+    return None if count == "none" else count
@@ -0,0 +1,162 @@
+"""PostgREST query instrumentation.
+
+Every SupabaseTable.execute / rpc call is recorded with its duration, table, method,
+status, row count and response size, aggregated per table and per calling route or
+Celery task (latency histogram + totals), and logged as `slow_query` above
+SLOW_QUERY_MS. Aggregates are per process; GET /api/admin/queries shows the API
+process's, workers report through the slow-query log.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from typing import Any, Optional, Union
+import structlog
+
+from app.core.config import get_settings
+
+logger = structlog.get_logger()
+
+# Histogram bucket upper bounds in milliseconds (last bucket is open-ended)
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# ASGI scope of the current request, or a label such as "task:app.workers.tasks.run_export_task"
+_source: contextvars.ContextVar[Union[dict, str, None]] = contextvars.ContextVar("query_source", default=None)
+
+
+class _Aggregate:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "rows", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms: float, rows: int, size: int, error: bool):
+        self.count += 1
+        self.errors += error
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.rows += rows
+        self.bytes += size
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th percentile (None if above the last bound)."""
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return None
+
+    def as_dict(self, key: str) -> dict:
+        return {
+            "key": key,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "histogram": {
+                **{f"le_{b}": n for b, n in zip(BUCKETS_MS, self.buckets)},
+                "inf": self.buckets[-1],
+            },
+        }
+
+
+_by_table: dict[str, _Aggregate] = {}
+_by_source: dict[str, _Aggregate] = {}
+_lock = threading.Lock()
+_since = time.time()
+
+
+def set_source(source: Union[dict, str, None]) -> contextvars.Token:
+    """Attribute subsequent queries in this context to `source` (ASGI scope or label)."""
+    return _source.set(source)
+
+
+def current_source() -> str:
+    source = _source.get()
+    if isinstance(source, dict):
+        # Route template (e.g. /api/projects/{project_id}) once routing has happened
+        route = source.get("route")
+        path = getattr(route, "path", None) or source.get("path", "")
+        return f"{source.get('method', '')} {path}".strip()
+    return source or "background"
+
+
+def record(table: str, method: str, started: float, resp: Any = None, result: Any = None):
+    """Record one PostgREST call. `resp` is the httpx response (None if the request
+    raised), `result` the SupabaseResponse (None on error)."""
+    ms = (time.perf_counter() - started) * 1000
+    status = resp.status_code if resp is not None else 0
+    data = getattr(result, "data", None)
+    rows = len(data) if isinstance(data, list) else (1 if data else 0)
+    size = len(resp.content) if resp is not None else 0
+    error = resp is None or status >= 400
+    source = current_source()
+
+    with _lock:
+        for aggregates, key in ((_by_table, table), (_by_source, source)):
+            agg = aggregates.get(key)
+            if agg is None:
+                agg = aggregates[key] = _Aggregate()
+            agg.add(ms, rows, size, error)
+
+    if ms >= get_settings().slow_query_ms:
+        logger.warning(
+            "slow_query",
+            table=table, method=method, status=status, duration_ms=round(ms, 1),
+            rows=rows, bytes=size, source=source,
+        )
+
+
+def top(by: str = "table", limit: int = 20) -> dict:
+    """Aggregates ordered by total time, for `by` in ("table", "route")."""
+    with _lock:
+        aggregates = _by_table if by == "table" else _by_source
+        items = [agg.as_dict(key) for key, agg in aggregates.items()]
+    items.sort(key=lambda i: i["total_ms"], reverse=True)
+    return {
+        "by": by,
+        "since": _since,
+        "total_queries": sum(i["count"] for i in items),
+        "total_ms": round(sum(i["total_ms"] for i in items), 1),
+        "items": items[:limit],
+    }
+
+
+def reset():
+    global _since
+    with _lock:
+        _by_table.clear()
+        _by_source.clear()
+        _since = time.time()
+
+
+class QuerySourceMiddleware:
+    """ASGI middleware attributing queries made while handling a request to its route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _source.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _source.reset(token)
@@ -1,39 +1,226 @@
+import asyncio
+import threading
+import time
+from typing import Any, Optional
+
+import jwt
+import structlog
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.core.supabase import get_supabase_admin
+from app.core.config import get_settings
+from app.core.supabase import SupabaseUnavailable, get_supabase_async
+from app.services import reference_cache
+
+logger = structlog.get_logger()
 
 security = HTTPBearer()
 
+_ASYMMETRIC_ALGS = ("RS256", "ES256", "EdDSA")
+_MAX_CACHED_ENTRIES = 4096
+
+# kid -> signing key from the project JWKS
+_jwks_keys: dict[str, Any] = {}
+_jwks_fetched_at = float("-inf")
+_jwks_lock = asyncio.Lock()
+_JWKS_MIN_REFETCH_SECONDS = 30
+
+# user_id -> (expires_at, profile row)
+_profile_cache: dict[str, tuple[float, dict]] = {}
+# session id -> monotonic time of the last successful Auth API check
+_session_checks: dict[str, float] = {}
+_cache_lock = threading.Lock()
+
+
+class _LocalVerifyUnavailable(Exception):
+    """Local verification is not configured (no secret) or the JWKS is unreachable."""
+
+
+async def _refresh_jwks():
+    global _jwks_keys, _jwks_fetched_at
+    settings = get_settings()
+    sb = get_supabase_async()
+    _jwks_fetched_at = time.monotonic()
+    try:
+        resp = await sb.http.get(
+            f"{sb.auth_url}/.well-known/jwks.json",
+            headers={"apikey": settings.supabase_anon_key or settings.supabase_service_role_key},
+            timeout=5,
+        )
+        resp.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(resp.json())
+    except jwt.PyJWKSetError:
+        # Project without asymmetric signing keys (legacy HS256 only)
+        _jwks_keys = {}
+        return
+    except Exception as e:
+        logger.warning("auth_jwks_fetch_failed", error=str(e))
+        return
+    _jwks_keys = {k.key_id: k.key for k in jwk_set.keys if k.key_id}
+    logger.info("auth_jwks_refreshed", keys=len(_jwks_keys))
+
+
+async def _signing_key(kid: Optional[str]):
+    """Signing key for `kid`. Keys are cached for auth_jwks_cache_seconds; an unknown kid
+    triggers a refetch (rate limited), which picks up rotated keys."""
+    now = time.monotonic()
+    async with _jwks_lock:
+        stale = now - _jwks_fetched_at > get_settings().auth_jwks_cache_seconds
+        if stale or (kid not in _jwks_keys and now - _jwks_fetched_at > _JWKS_MIN_REFETCH_SECONDS):
+            await _refresh_jwks()
+    key = _jwks_keys.get(kid)
+    if key is None:
+        raise _LocalVerifyUnavailable(f"No JWKS key for kid {kid!r}")
+    return key
+
+
+async def _decode_locally(token: str) -> dict:
+    """Verify signature, expiry and audience of a Supabase access token without a network call
+    (besides the occasional JWKS refresh). Raises jwt.InvalidTokenError for bad tokens."""
+    settings = get_settings()
+    header = jwt.get_unverified_header(token)
+    alg = header.get("alg")
+    if alg == "HS256":
+        if not settings.supabase_jwt_secret:
+            raise _LocalVerifyUnavailable("SUPABASE_JWT_SECRET not set")
+        key = settings.supabase_jwt_secret
+    elif alg in _ASYMMETRIC_ALGS:
+        key = await _signing_key(header.get("kid"))
+    else:
+        raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {alg}")
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[alg],
+        audience="authenticated",
+        leeway=10,
+        options={"require": ["exp", "sub"]},
+    )
+
+
+async def _remote_user(token: str) -> tuple[str, Optional[str]]:
+    """Validate a token via the Supabase Auth API. Returns (user_id, email)."""
+    user_response = await get_supabase_async().auth.admin.get_user(token)
+    if not user_response or not user_response.user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return str(user_response.user.id), user_response.user.email
+
 
-def get_current_user(
+async def _check_session(token: str, claims: dict):
+    """Re-check a locally verified session with the Auth API at most every
+    auth_session_check_seconds, so signed-out / revoked sessions stop working."""
+    interval = get_settings().auth_session_check_seconds
+    session_key = claims.get("session_id") or f"{claims['sub']}:{claims.get('iat')}"
+    now = time.monotonic()
+    with _cache_lock:
+        last = _session_checks.get(session_key)
+    if last is not None and now - last < interval:
+        return
+
+    try:
+        user_response = await get_supabase_async().auth.admin.get_user(token)
+    except Exception as e:
+        # Auth API unreachable: the signature and expiry were verified, so keep serving
+        logger.warning("auth_session_check_failed", error=str(e))
+        return
+    if not user_response or not user_response.user:
+        with _cache_lock:
+            _session_checks.pop(session_key, None)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session revoked")
+
+    with _cache_lock:
+        if len(_session_checks) >= _MAX_CACHED_ENTRIES:
+            cutoff = now - interval
+            for key in [k for k, t in _session_checks.items() if t < cutoff]:
+                del _session_checks[key]
+        _session_checks[session_key] = now
+
+
+def _cached_profile(user_id: str) -> Optional[dict]:
+    with _cache_lock:
+        cached = _profile_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])
+    return None
+
+
+def _drop_profiles(user_id: Optional[str]):
+    with _cache_lock:
+        if user_id is None:
+            _profile_cache.clear()
+        else:
+            _profile_cache.pop(user_id, None)
+
+
+def _remember_profile(user_id: str, data: dict):
+    # Evict when any process invalidates the profile (reference_cache's Redis channel)
+    reference_cache.on_invalidate("profile", _drop_profiles)
+    now = time.monotonic()
+    with _cache_lock:
+        if len(_profile_cache) >= _MAX_CACHED_ENTRIES:
+            for key in [k for k, (exp, _) in _profile_cache.items() if exp <= now]:
+                del _profile_cache[key]
+        _profile_cache[user_id] = (now + get_settings().auth_profile_cache_seconds, data)
+
+
+async def get_profile_async(user_id: str) -> dict:
+    """Profile row for a user, cached for auth_profile_cache_seconds."""
+    cached = _cached_profile(user_id)
+    if cached is not None:
+        return cached
+    profile = await get_supabase_async().table("profiles").select("*").eq("id", user_id).maybeSingle().execute()
+    data = profile.data or {}
+    _remember_profile(user_id, data)
+    return dict(data)
+
+
+def invalidate_profile(user_id: str):
+    """Drop a cached profile in this and every other process (call after changing plan,
+    role, status or usage counters)."""
+    _drop_profiles(user_id)
+    reference_cache.invalidate("profile", user_id)
+
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
 ) -> dict:
-    """Validate JWT via Supabase Auth API and return user data.
-    Sync function — FastAPI runs it in a thread pool so it won't block the event loop."""
+    """Validate the JWT locally (HS256 secret or JWKS) and return user data.
+    Falls back to the Supabase Auth API when local verification isn't available.
+    Async, so authentication doesn't take a thread-pool slot."""
     token = credentials.credentials
 
     try:
-        sb = get_supabase_admin()
-        user_response = sb.auth.admin.get_user(token)
-        if not user_response or not user_response.user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-
-        user = user_response.user
-        profile = sb.table("profiles").select("*").eq("id", str(user.id)).single().execute()
+        try:
+            claims = await _decode_locally(token)
+        except _LocalVerifyUnavailable as e:
+            logger.debug("auth_local_verify_unavailable", reason=str(e))
+            user_id, email = await _remote_user(token)
+        else:
+            await _check_session(token, claims)
+            user_id, email = str(claims["sub"]), claims.get("email")
 
         return {
-            "id": str(user.id),
-            "email": user.email,
-            "profile": profile.data if profile.data else {},
+            "id": user_id,
+            "email": email,
+            "profile": await get_profile_async(user_id),
             "token": token,
         }
-    except HTTPException:
+    except (HTTPException, SupabaseUnavailable):
+        # SupabaseUnavailable becomes a 503 + Retry-After in the app's exception handler
         raise
-    except Exception:
+    except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+    except Exception as e:
+        # Supabase unreachable or failing (transport / PostgREST errors): not the token's fault,
+        # so don't answer 401 and log clients out
+        logger.warning("auth_backend_failed", error=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(int(get_settings().supabase_breaker_reset_seconds))},
+        )
 
 
-def require_admin(user: dict = Depends(get_current_user)) -> dict:
+async def require_admin(user: dict = Depends(get_current_user)) -> dict:
     """Require admin role."""
     if user.get("profile", {}).get("role") != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
@@ -1,15 +1,156 @@
 """Lightweight Supabase client using httpx (no heavy SDK dependency)."""
 
+import json
+import threading
+import time
 import httpx
+import structlog
 from functools import lru_cache
-from typing import Any, Optional
+from typing import Any, Iterable, Optional
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 from app.core.config import get_settings
+from app.core import query_metrics
+
+logger = structlog.get_logger()
+
+
+class SupabaseUnavailable(RuntimeError):
+    """Supabase is failing and the circuit breaker is open: fail fast instead of waiting on timeouts."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Supabase unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive transport errors / 502-504 responses.
+    While open every call fails fast; after `reset_seconds` one probe request is let
+    through, and its outcome closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+    def before_request(self) -> bool:
+        """Raise SupabaseUnavailable while open. Returns True if this call is the
+        half-open probe; the caller must then call end_probe() however it exits."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._probing:
+                raise SupabaseUnavailable(max(remaining, 1))
+            self._probing = True
+            return True
+
+    def end_probe(self):
+        """Let the next request probe if this one ended without an outcome (cancelled,
+        or failed with something other than a transport error)."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            was_open = self._opened_at is not None
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+        if was_open:
+            logger.info("supabase_circuit_closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            newly_open = self._opened_at is None
+            self._opened_at = time.monotonic()
+        if newly_open:
+            logger.warning("supabase_circuit_open", failures=self._failures, reset_seconds=self.reset_seconds)
+
+
+_breaker: Optional[CircuitBreaker] = None
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Process-wide breaker shared by the sync and async clients (same upstream)."""
+    global _breaker
+    if _breaker is None:
+        settings = get_settings()
+        _breaker = CircuitBreaker(settings.supabase_breaker_failures, settings.supabase_breaker_reset_seconds)
+    return _breaker
+
+
+# Gateway errors worth retrying; other 5xx are PostgREST/database errors
+_RETRY_STATUSES = (502, 503, 504)
+# Raised before the request was sent, so retrying is safe for any method
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class _RetryableResponse(Exception):
+    def __init__(self, resp: httpx.Response):
+        self.resp = resp
+
+
+def _retry_policy(idempotent: bool) -> dict:
+    """tenacity arguments: jittered exponential back-off; non-idempotent requests
+    (inserts, RPC) are only retried when the connection was never established."""
+    settings = get_settings()
+
+    def should_retry(exc: BaseException) -> bool:
+        if isinstance(exc, _CONNECT_ERRORS):
+            return True
+        return idempotent and isinstance(exc, (httpx.TransportError, _RetryableResponse))
+
+    return {
+        "stop": stop_after_attempt(settings.supabase_retries + 1),
+        "wait": wait_random_exponential(multiplier=settings.supabase_retry_backoff_seconds, max=5),
+        "retry": retry_if_exception(should_retry),
+        "reraise": True,
+    }
+
+
+def _check_response(breaker: CircuitBreaker, resp: httpx.Response, idempotent: bool) -> httpx.Response:
+    if resp.status_code in _RETRY_STATUSES:
+        breaker.record_failure()
+        if idempotent:
+            raise _RetryableResponse(resp)
+    else:
+        breaker.record_success()
+    return resp
+
+
+def _client_options(http2: bool, max_connections: int) -> dict:
+    settings = get_settings()
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx[http2])
+        except ImportError:
+            logger.warning("supabase_http2_unavailable", reason="h2 not installed")
+            http2 = False
+    return {
+        "http2": http2,
+        "timeout": httpx.Timeout(settings.supabase_timeout_seconds, connect=settings.supabase_connect_timeout_seconds),
+        "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max(1, max_connections // 2)),
+    }
+
 
 
 class SupabaseTable:
     """Chainable query builder for a single table."""
 
-    def __init__(self, client: "SupabaseClient", table: str):
+    def __init__(self, client: "SupabaseClient | AsyncSupabaseClient", table: str):
         self._client = client
         self._table = table
         self._params: dict[str, str] = {}
@@ -90,9 +231,16 @@ class SupabaseTable:
         self._params["or"] = f"({filters})"
         return self
 
+    def and_(self, filters: str) -> "SupabaseTable":
+        """Grouped filter expression, e.g. "or(a.lt.1,and(a.eq.1,b.lt.2))" (combines with or_)."""
+        self._params["and"] = f"({filters})"
+        return self
+
     def order(self, column: str, desc: bool = False) -> "SupabaseTable":
+        """Order by `column`; successive calls add tie-breaker columns."""
         direction = "desc" if desc else "asc"
-        self._params["order"] = f"{column}.{direction}"
+        previous = self._params.get("order")
+        self._params["order"] = f"{previous},{column}.{direction}" if previous else f"{column}.{direction}"
         return self
 
     def limit(self, count: int) -> "SupabaseTable":
@@ -128,24 +276,25 @@ class SupabaseTable:
         self._maybe_single = True
         return self
 
-    def execute(self) -> "SupabaseResponse":
-        url = f"{self._client.rest_url}/{self._table}"
-        headers = {**self._client.headers, **self._headers}
+    @property
+    def _idempotent(self) -> bool:
+        method = getattr(self, "_method", "GET")
+        return method != "POST" or "resolution=merge-duplicates" in self._headers.get("Prefer", "")
+
+    def _request(self) -> tuple[str, str, dict]:
+        """(method, url, httpx request kwargs) for the built query."""
         method = getattr(self, "_method", "GET")
-        body = getattr(self, "_body", None)
-        http = self._client.http
-
-        if method == "GET":
-            resp = http.get(url, params=self._params, headers=headers)
-        elif method == "POST":
-            resp = http.post(url, params=self._params, headers=headers, json=body)
-        elif method == "PATCH":
-            resp = http.patch(url, params=self._params, headers=headers, json=body)
-        elif method == "DELETE":
-            resp = http.delete(url, params=self._params, headers=headers)
-        else:
+        if method not in ("GET", "POST", "PATCH", "DELETE"):
             raise ValueError(f"Unknown method: {method}")
+        kwargs: dict[str, Any] = {
+            "params": self._params,
+            "headers": {**self._client.headers, **self._headers},
+        }
+        if method in ("POST", "PATCH"):
+            kwargs["json"] = getattr(self, "_body", None)
+        return method, f"{self._client.rest_url}/{self._table}", kwargs
 
+    def _to_response(self, resp: httpx.Response) -> "SupabaseResponse":
         # single/maybeSingle: allow "not found" but do not hide multi-row data anomalies
         if resp.status_code == 406 and (getattr(self, "_maybe_single", False) or getattr(self, "_single", False)):
             body_lower = (resp.text or "").lower()
@@ -166,6 +315,32 @@ class SupabaseTable:
 
         return SupabaseResponse(data=data, count=count)
 
+    def execute(self) -> "SupabaseResponse":
+        method, url, kwargs = self._request()
+        started = time.perf_counter()
+        resp = result = None
+        try:
+            resp = self._client.send(method, url, idempotent=self._idempotent, **kwargs)
+            result = self._to_response(resp)
+            return result
+        finally:
+            query_metrics.record(self._table, method, started, resp, result)
+
+
+class AsyncSupabaseTable(SupabaseTable):
+    """Same chainable builder; `await table.execute()` runs on the async client."""
+
+    async def execute(self) -> "SupabaseResponse":
+        method, url, kwargs = self._request()
+        started = time.perf_counter()
+        resp = result = None
+        try:
+            resp = await self._client.send(method, url, idempotent=self._idempotent, **kwargs)
+            result = self._to_response(resp)
+            return result
+        finally:
+            query_metrics.record(self._table, method, started, resp, result)
+
 
 class SupabaseResponse:
     def __init__(self, data: Any = None, count: Optional[int] = None):
@@ -205,14 +380,14 @@ class SupabaseBucket:
 
     def remove(self, paths: list[str]) -> dict:
         url = f"{self._client.storage_url}/object/{self._bucket}"
-        resp = self._client.http.delete(url, headers=self._client.headers, json={"prefixes": paths})
+        resp = self._client.send("DELETE", url, headers=self._client.headers, json={"prefixes": paths})
         if resp.status_code >= 400:
             raise RuntimeError(f"Storage remove error: {resp.text[:300]}")
         return resp.json() if resp.text else {}
 
     def create_signed_url(self, path: str, expires_in: int = 3600) -> dict:
         url = f"{self._client.storage_url}/object/sign/{self._bucket}/{path}"
-        resp = self._client.http.post(url, headers=self._client.headers, json={"expiresIn": expires_in})
+        resp = self._client.send("POST", url, headers=self._client.headers, json={"expiresIn": expires_in})
         if resp.status_code >= 400:
             raise RuntimeError(f"Signed URL error: {resp.text[:300]}")
         return resp.json() if resp.text else {}
@@ -244,6 +419,16 @@ class _AuthUserResp:
         self.user = _AuthUserObj(d)
 
 
+def _auth_user_or_none(resp: httpx.Response) -> Optional[_AuthUserResp]:
+    """User of a GET /user response; None if the token was rejected. Auth API failures
+    (5xx after retries) raise instead, so callers don't treat an outage as a bad token."""
+    if resp.status_code in (401, 403, 404):
+        return None
+    if resp.status_code >= 400:
+        raise RuntimeError(f"Auth API error {resp.status_code}: {resp.text[:300]}")
+    return _AuthUserResp(resp.json())
+
+
 class SupabaseAuthAdmin:
     def __init__(self, client: "SupabaseClient"):
         self._client = client
@@ -252,27 +437,120 @@ class SupabaseAuthAdmin:
         """Verify a JWT and get user info."""
         url = f"{self._client.auth_url}/user"
         headers = {**self._client.headers, "Authorization": f"Bearer {token}"}
-        resp = self._client.http.get(url, headers=headers)
-        if resp.status_code >= 400:
-            return None
-        return _AuthUserResp(resp.json())
+        resp = self._client.send("GET", url, headers=headers)
+        return _auth_user_or_none(resp)
 
     def get_user_by_id(self, user_id: str) -> Optional[_AuthUserResp]:
         """Admin: get user by ID."""
         url = f"{self._client.auth_url}/admin/users/{user_id}"
-        resp = self._client.http.get(url, headers=self._client.headers)
+        resp = self._client.send("GET", url, headers=self._client.headers)
         if resp.status_code >= 400:
             return None
         return _AuthUserResp(resp.json())
 
     def delete_user(self, user_id: str) -> bool:
         url = f"{self._client.auth_url}/admin/users/{user_id}"
-        resp = self._client.http.delete(url, headers=self._client.headers)
+        resp = self._client.send("DELETE", url, headers=self._client.headers)
         if resp.status_code >= 400:
             raise RuntimeError(f"Delete user failed: {resp.text[:200]}")
         return True
 
 
+class SupabaseUnitOfWork:
+    """Collects inserts, upserts, updates and deletes and writes them in as few requests as possible.
+
+    Inserts/upserts go out as one array POST per table (and column set), updates with the same
+    fields as one PATCH filtered by `in.(...)`, deletes as one `in.(...)` DELETE per table.
+    commit() runs inserts, upserts, updates, then deletes, each in the order tables were first
+    touched (add parent rows before children). Used as a context manager it commits on a clean exit.
+    """
+
+    MAX_ROWS_PER_REQUEST = 500
+    MAX_IDS_PER_FILTER = 100
+
+    def __init__(self, client: "SupabaseClient"):
+        self._client = client
+        # (table, column set) -> rows
+        self._inserts: dict[tuple[str, tuple], list[dict]] = {}
+        self._upserts: dict[tuple[str, tuple], list[dict]] = {}
+        # (table, filter column, serialised fields) -> (fields, ids)
+        self._updates: dict[tuple[str, str, str], tuple[dict, list]] = {}
+        # (table, filter column) -> ids
+        self._deletes: dict[tuple[str, str], list] = {}
+        self.requests = 0
+
+    def insert(self, table: str, rows: dict | list[dict]) -> "SupabaseUnitOfWork":
+        for row in [rows] if isinstance(rows, dict) else rows:
+            self._inserts.setdefault((table, tuple(sorted(row))), []).append(row)
+        return self
+
+    def upsert(self, table: str, rows: dict | list[dict]) -> "SupabaseUnitOfWork":
+        for row in [rows] if isinstance(rows, dict) else rows:
+            self._upserts.setdefault((table, tuple(sorted(row))), []).append(row)
+        return self
+
+    def update(self, table: str, fields: dict, ids: Any | Iterable, column: str = "id") -> "SupabaseUnitOfWork":
+        """PATCH `fields` on the rows whose `column` is in `ids` (a single value or an iterable)."""
+        ids = [ids] if isinstance(ids, (str, int)) else list(ids)
+        key = (table, column, json.dumps(fields, sort_keys=True, default=str))
+        self._updates.setdefault(key, (fields, []))[1].extend(ids)
+        return self
+
+    def delete(self, table: str, ids: Any | Iterable, column: str = "id") -> "SupabaseUnitOfWork":
+        """DELETE the rows whose `column` is in `ids` (a single value or an iterable)."""
+        ids = [ids] if isinstance(ids, (str, int)) else list(ids)
+        self._deletes.setdefault((table, column), []).extend(ids)
+        return self
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._inserts or self._upserts or self._updates or self._deletes)
+
+    def commit(self) -> int:
+        """Write everything collected so far. Returns the number of requests made.
+        On error the failed group and everything after it stay pending."""
+        made = 0
+        for key in list(self._inserts):
+            rows = self._inserts[key]
+            for i in range(0, len(rows), self.MAX_ROWS_PER_REQUEST):
+                self._client.table(key[0]).insert(rows[i:i + self.MAX_ROWS_PER_REQUEST]).execute()
+                made += 1
+            del self._inserts[key]
+        for key in list(self._upserts):
+            rows = self._upserts[key]
+            for i in range(0, len(rows), self.MAX_ROWS_PER_REQUEST):
+                self._client.table(key[0]).upsert(rows[i:i + self.MAX_ROWS_PER_REQUEST]).execute()
+                made += 1
+            del self._upserts[key]
+        for key in list(self._updates):
+            table, column, _ = key
+            fields, ids = self._updates[key]
+            for chunk in _chunks(list(dict.fromkeys(ids)), self.MAX_IDS_PER_FILTER):
+                self._client.table(table).update(fields).in_(column, chunk).execute()
+                made += 1
+            del self._updates[key]
+        for key in list(self._deletes):
+            table, column = key
+            for chunk in _chunks(list(dict.fromkeys(self._deletes[key])), self.MAX_IDS_PER_FILTER):
+                self._client.table(table).delete().in_(column, chunk).execute()
+                made += 1
+            del self._deletes[key]
+        self.requests += made
+        return made
+
+    def __enter__(self) -> "SupabaseUnitOfWork":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class SupabaseClient:
     """Lightweight Supabase client using httpx with persistent connection pool."""
 
@@ -287,11 +565,9 @@ class SupabaseClient:
             "Authorization": f"Bearer {key}",
             "Content-Type": "application/json",
         }
-        # Persistent connection pools (thread-safe)
-        self.http = httpx.Client(
-            timeout=30,
-            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
-        )
+        settings = get_settings()
+        # Persistent connection pool (thread-safe), HTTP/2 multiplexed if enabled
+        self.http = httpx.Client(**_client_options(settings.supabase_http2, settings.supabase_max_connections))
         # Separate pool for long operations (upload/download)
         self.http_long = httpx.Client(
             timeout=600,
@@ -299,16 +575,47 @@ class SupabaseClient:
         )
         self.storage = SupabaseStorage(self)
         self.auth = SupabaseAuth(self)
+        self.breaker = get_circuit_breaker()
+
+    def send(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """Request through the circuit breaker, retrying transient failures (see _retry_policy).
+        Raises SupabaseUnavailable while the circuit is open."""
+        def attempt() -> httpx.Response:
+            probe = self.breaker.before_request()
+            try:
+                resp = self.http.request(method, url, **kwargs)
+                return _check_response(self.breaker, resp, idempotent)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                raise
+            finally:
+                if probe:
+                    self.breaker.end_probe()
+
+        try:
+            return Retrying(**_retry_policy(idempotent))(attempt)
+        except _RetryableResponse as e:
+            return e.resp
 
     def table(self, name: str) -> SupabaseTable:
         return SupabaseTable(self, name)
 
+    def unit_of_work(self) -> SupabaseUnitOfWork:
+        """Batch multi-row writes (see SupabaseUnitOfWork)."""
+        return SupabaseUnitOfWork(self)
+
     def rpc(self, function_name: str, params: dict | None = None) -> SupabaseResponse:
         url = f"{self.rest_url}/rpc/{function_name}"
-        resp = self.http.post(url, headers=self.headers, json=params or {})
-        if resp.status_code >= 400:
-            raise RuntimeError(f"RPC error: {resp.text[:300]}")
-        return SupabaseResponse(data=resp.json() if resp.text else None)
+        started = time.perf_counter()
+        resp = result = None
+        try:
+            resp = self.send("POST", url, idempotent=False, headers=self.headers, json=params or {})
+            if resp.status_code >= 400:
+                raise RuntimeError(f"RPC error: {resp.text[:300]}")
+            result = SupabaseResponse(data=resp.json() if resp.text else None)
+            return result
+        finally:
+            query_metrics.record(f"rpc:{function_name}", "POST", started, resp, result)
 
 
 _admin_client: Optional[SupabaseClient] = None
@@ -321,3 +628,99 @@ def get_supabase_admin() -> SupabaseClient:
         settings = get_settings()
         _admin_client = SupabaseClient(settings.supabase_url, settings.supabase_service_role_key)
     return _admin_client
+
+
+class AsyncSupabaseAuthAdmin:
+    def __init__(self, client: "AsyncSupabaseClient"):
+        self._client = client
+
+    async def get_user(self, token: str) -> Optional[_AuthUserResp]:
+        """Verify a JWT and get user info."""
+        url = f"{self._client.auth_url}/user"
+        headers = {**self._client.headers, "Authorization": f"Bearer {token}"}
+        resp = await self._client.send("GET", url, headers=headers)
+        return _auth_user_or_none(resp)
+
+
+class AsyncSupabaseAuth:
+    def __init__(self, client: "AsyncSupabaseClient"):
+        self._client = client
+        self.admin = AsyncSupabaseAuthAdmin(client)
+
+
+class AsyncSupabaseClient:
+    """Async variant of SupabaseClient (httpx.AsyncClient) for `async def` routes.
+    Only PostgREST tables/RPC and token lookup; storage and admin auth stay on the sync client."""
+
+    def __init__(self, url: str, key: str):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.rest_url = f"{self.url}/rest/v1"
+        self.auth_url = f"{self.url}/auth/v1"
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        settings = get_settings()
+        self.http = httpx.AsyncClient(**_client_options(settings.supabase_http2, settings.supabase_async_max_connections))
+        self.auth = AsyncSupabaseAuth(self)
+        self.breaker = get_circuit_breaker()
+
+    async def send(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """Async counterpart of SupabaseClient.send."""
+        async def attempt() -> httpx.Response:
+            probe = self.breaker.before_request()
+            try:
+                resp = await self.http.request(method, url, **kwargs)
+                return _check_response(self.breaker, resp, idempotent)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                raise
+            finally:
+                # Also on cancellation (client disconnect), or the circuit never closes again
+                if probe:
+                    self.breaker.end_probe()
+
+        try:
+            return await AsyncRetrying(**_retry_policy(idempotent))(attempt)
+        except _RetryableResponse as e:
+            return e.resp
+
+    def table(self, name: str) -> AsyncSupabaseTable:
+        return AsyncSupabaseTable(self, name)
+
+    async def rpc(self, function_name: str, params: dict | None = None) -> SupabaseResponse:
+        url = f"{self.rest_url}/rpc/{function_name}"
+        started = time.perf_counter()
+        resp = result = None
+        try:
+            resp = await self.send("POST", url, idempotent=False, headers=self.headers, json=params or {})
+            if resp.status_code >= 400:
+                raise RuntimeError(f"RPC error: {resp.text[:300]}")
+            result = SupabaseResponse(data=resp.json() if resp.text else None)
+            return result
+        finally:
+            query_metrics.record(f"rpc:{function_name}", "POST", started, resp, result)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_async_client: Optional[AsyncSupabaseClient] = None
+
+
+def get_supabase_async() -> AsyncSupabaseClient:
+    """Async service role client. Bound to the server's event loop — use only from `async def` code."""
+    global _async_client
+    if _async_client is None:
+        settings = get_settings()
+        _async_client = AsyncSupabaseClient(settings.supabase_url, settings.supabase_service_role_key)
+    return _async_client
+
+
+async def close_supabase_async():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
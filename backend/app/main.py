@@ -1,15 +1,29 @@
 import logging
+import stat as _stat
 from contextlib import asynccontextmanager
 from pathlib import Path
+from urllib.parse import quote
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
 import structlog
 
 from app.core.config import get_settings
+from app.core.compression import CompressionMiddleware
+from app.core.query_metrics import QuerySourceMiddleware
 from app.core.security import get_current_user
+from app.core.supabase import close_supabase_async, SupabaseUnavailable
 from app.api.routes import health, projects, translate, export, admin, glossary, storage_config
-from app.services.storage import STORAGE_DIR
+from app.services.storage import STORAGE_DIR, INGEST_DIR, get_r2_storage
+from app.services.blob_store import is_blob_key
+from app.utils.http_cache import (
+    FILE_REVALIDATE,
+    IMMUTABLE,
+    PRIVATE_IMMUTABLE,
+    REVALIDATE,
+    file_not_modified,
+    file_validators,
+)
 
 # --- Logging setup ---
 _settings = get_settings()
@@ -47,10 +61,15 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning("ffmpeg_not_found", error=str(e))
 
-    # Verify local storage
-    logger.info("storage_dir", path=str(STORAGE_DIR), exists=STORAGE_DIR.exists())
+    # Verify storage
+    storage = get_r2_storage()
+    if storage.name == "local":
+        logger.info("storage_dir", path=str(STORAGE_DIR), exists=STORAGE_DIR.exists())
+    else:
+        logger.info("storage_backend", backend=storage.name, ok=storage.check())
 
     yield
+    await close_supabase_async()
     logger.info("server_shutdown")
 
 
@@ -79,8 +98,28 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag"],
+    )
+
+    # Compression (added after CORS so it wraps the CORS-decorated response)
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_min_size,
+        brotli_quality=settings.compression_brotli_quality,
     )
 
+    # Attribute PostgREST queries to the route that made them (see /api/admin/queries)
+    app.add_middleware(QuerySourceMiddleware)
+
+    @app.exception_handler(SupabaseUnavailable)
+    async def supabase_unavailable_handler(request: Request, exc: SupabaseUnavailable):
+        """Circuit breaker open: answer 503 immediately instead of queueing behind timeouts."""
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Service temporarily unavailable. Please try again shortly."},
+            headers={"Retry-After": str(int(exc.retry_after))},
+        )
+
     # Routes
     app.include_router(health.router)
     app.include_router(projects.router, prefix="/api")
@@ -100,70 +139,80 @@ def create_app() -> FastAPI:
         ".srt": "text/plain", ".ass": "text/plain", ".ssa": "text/plain",
     }
 
-    @app.get("/files/{file_path:path}")
+    def _file_cache_control(file_path: str) -> str:
+        """Content-keyed files never change under their key: deduplicated blobs and
+        users/<uid>/<project>/{source,export}/ (source video, preview.mp4, export outputs).
+        Subtitle files are rewritten in place and must be revalidated. Users' files are
+        private (browser cache only) unless FILES_CDN_CACHE puts a CDN in front of /files."""
+        parts = file_path.split("/")
+        immutable = is_blob_key(file_path) or (len(parts) == 5 and parts[0] == "users" and parts[3] in ("source", "export"))
+        if settings.files_cdn_cache:
+            return IMMUTABLE if immutable else FILE_REVALIDATE
+        return PRIVATE_IMMUTABLE if immutable else REVALIDATE
+
+    def _cdn_headers(cache_control: str) -> dict:
+        # Honoured by Cloudflare and other CDNs in front of the API
+        return {"CDN-Cache-Control": cache_control} if settings.files_cdn_cache else {}
+
+    @app.api_route("/files/{file_path:path}", methods=["GET", "HEAD"])
     def serve_file(file_path: str, request: Request):
-        """Serve files from local storage directory with HTTP Range support.
+        """Serve files from local storage directory with HTTP Range support
+        (single and multi-range, If-Range; handled by FileResponse, which hands the
+        path to the server when it supports http.response.pathsend).
+        With FILES_ACCEL_MODE the proxy (nginx X-Accel-Redirect, Caddy/Apache X-Sendfile)
+        sends the bytes instead. On object storage, redirects to a presigned URL.
+        Responses carry ETag / Last-Modified (size + mtime), answer 304 to conditional
+        requests and are cached for a year when the key is content-addressed.
         Auth check is skipped for preview files to allow video player access."""
+        cache_control = _file_cache_control(file_path)
+        try:
+            presigned = get_r2_storage().presigned_url(file_path, cache_control=cache_control)
+        except ValueError:
+            raise HTTPException(status_code=403, detail="Access denied")
+        if presigned:
+            # Reusing the redirect keeps the presigned URL (the browser's cache key) stable
+            max_age = max(settings.storage_presign_seconds // 2, 0)
+            return RedirectResponse(presigned, status_code=307, headers={"Cache-Control": f"private, max-age={max_age}"})
+
         full_path = (STORAGE_DIR / file_path).resolve()
         # Security: ensure path is within STORAGE_DIR
         try:
-            full_path.relative_to(STORAGE_DIR.resolve())
+            relative = full_path.relative_to(STORAGE_DIR.resolve())
         except ValueError:
             raise HTTPException(status_code=403, detail="Access denied")
-        if not full_path.exists() or not full_path.is_file():
+        # Uploads still being processed; checked on the resolved path so `x/../.ingest` can't reach them
+        if relative.parts[:1] == (INGEST_DIR,):
+            raise HTTPException(status_code=404, detail="File not found")
+        try:
+            stat_result = full_path.stat()
+        except OSError:
+            stat_result = None
+        if stat_result is None or not _stat.S_ISREG(stat_result.st_mode):
             raise HTTPException(status_code=404, detail="File not found")
 
-        file_size = full_path.stat().st_size
         content_type, _ = _mimetypes.guess_type(str(full_path))
         if not content_type:
             content_type = _CONTENT_TYPE_MAP.get(full_path.suffix.lower(), "application/octet-stream")
-
-        range_header = request.headers.get("range")
-        if range_header:
-            try:
-                range_spec = range_header.replace("bytes=", "").strip()
-                parts = range_spec.split("-")
-                start = int(parts[0]) if parts[0] else 0
-                end = int(parts[1]) if parts[1] else file_size - 1
-                end = min(end, file_size - 1)
-                if start < 0 or start >= file_size or start > end:
-                    raise HTTPException(status_code=416, detail="Range not satisfiable")
-                length = end - start + 1
-            except (ValueError, IndexError):
-                raise HTTPException(status_code=416, detail="Invalid range header")
-
-            def iter_range():
-                with open(full_path, "rb") as f:
-                    f.seek(start)
-                    remaining = length
-                    while remaining > 0:
-                        chunk_size = min(262144, remaining)  # 256KB chunks
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        remaining -= len(chunk)
-                        yield chunk
-
-            return StreamingResponse(
-                iter_range(),
-                status_code=206,
-                headers={
-                    "Content-Range": f"bytes {start}-{end}/{file_size}",
-                    "Accept-Ranges": "bytes",
-                    "Content-Length": str(length),
-                    "Content-Type": content_type,
-                    "Access-Control-Allow-Origin": "*",
-                },
-            )
-
-        return FileResponse(
-            full_path,
-            media_type=content_type,
-            headers={
-                "Accept-Ranges": "bytes",
-                "Access-Control-Allow-Origin": "*",
-            },
-        )
+        etag, last_modified = file_validators(stat_result.st_size, stat_result.st_mtime)
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Cache-Control": cache_control,
+            **_cdn_headers(cache_control),
+        }
+        if file_not_modified(request, etag, stat_result.st_mtime):
+            return Response(status_code=304, headers=headers)
+
+        accel_mode = settings.files_accel_mode.lower()
+        if accel_mode == "x-accel":
+            # nginx: `location <prefix> { internal; alias <STORAGE_DIR>/; }` serves ranges itself
+            uri = settings.files_accel_prefix.rstrip("/") + "/" + quote(relative.as_posix())
+            return Response(headers={**headers, "X-Accel-Redirect": uri}, media_type=content_type)
+        if accel_mode == "x-sendfile":
+            return Response(headers={**headers, "X-Sendfile": str(full_path)}, media_type=content_type)
+
+        return FileResponse(full_path, media_type=content_type, headers=headers, stat_result=stat_result)
 
     return app
 
@@ -0,0 +1,125 @@
+"""Pre-aggregated admin dashboard statistics.
+
+Counting rows and summing stored_files on every dashboard load made the admin
+routes O(data) and multiplied DB load by the number of open dashboards. A Celery
+beat task (refresh_admin_stats_task) computes one snapshot every
+ADMIN_STATS_REFRESH_SECONDS — aggregated inside Postgres by the admin_stats_snapshot
+RPC (migration_admin_stats.sql) — and stores it in Redis; the admin routes only
+read it. If the snapshot is missing it is computed on demand.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+import structlog
+
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+
+logger = structlog.get_logger()
+
+SNAPSHOT_KEY = "admin:stats_snapshot"
+TOP_USERS = 20
+
+_redis_client = None
+# Fallback when Redis is unreachable (per process)
+_local_snapshot: Optional[dict] = None
+# time.monotonic() when _local_snapshot was computed
+_local_snapshot_at = float("-inf")
+_refresh_lock = threading.Lock()
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.from_url(get_settings().redis_broker_url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis_client
+
+
+def _aggregate_in_python(sb) -> dict:
+    """Same numbers without the RPC (migration not applied): counts + a scan of stored_files."""
+    def count(table: str, **filters) -> int:
+        query = sb.table(table).select("id", count="exact").limit(1)
+        if "status_in" in filters:
+            query = query.in_("status", filters["status_in"])
+        if "status" in filters:
+            query = query.eq("status", filters["status"])
+        return query.execute().count or 0
+
+    files = sb.table("stored_files").select("file_type, file_size_bytes").eq("uploaded_to_user_storage", False).execute()
+    breakdown: dict[str, dict] = {}
+    for f in (files.data or []):
+        entry = breakdown.setdefault(f["file_type"], {"count": 0, "bytes": 0})
+        entry["count"] += 1
+        entry["bytes"] += f.get("file_size_bytes") or 0
+    top_users = (
+        sb.table("profiles")
+        .select("id, full_name, plan_id, storage_used_bytes, daily_jobs_used")
+        .order("storage_used_bytes", desc=True)
+        .limit(TOP_USERS)
+        .execute()
+    )
+    return {
+        "total_users": count("profiles"),
+        "total_projects": count("projects"),
+        "total_translation_jobs": count("translation_jobs"),
+        "total_export_jobs": count("export_jobs"),
+        "active_jobs": count("translation_jobs", status_in=["queued", "processing"]),
+        "failed_jobs": count("translation_jobs", status="failed"),
+        "file_type_breakdown": breakdown,
+        "top_users": top_users.data or [],
+    }
+
+
+def compute_snapshot() -> dict:
+    sb = get_supabase_admin()
+    try:
+        stats = sb.rpc("admin_stats_snapshot").data
+    except Exception as e:
+        logger.warning("admin_stats_rpc_failed", error=str(e))
+        stats = None
+    if not isinstance(stats, dict):
+        stats = _aggregate_in_python(sb)
+
+    breakdown = stats.get("file_type_breakdown") or {}
+    stats["total_stored_files"] = sum(v.get("count", 0) for v in breakdown.values())
+    stats["total_storage_bytes"] = sum(v.get("bytes", 0) for v in breakdown.values())
+    stats["computed_at"] = datetime.now(timezone.utc).isoformat()
+    return stats
+
+
+def refresh_snapshot() -> dict:
+    """Compute and store a new snapshot (concurrent refreshes in one process share one computation)."""
+    global _local_snapshot, _local_snapshot_at
+    requested_at = time.monotonic()
+    with _refresh_lock:
+        # Computed by another caller while we waited for the lock: that one is fresh enough
+        if _local_snapshot is not None and _local_snapshot_at >= requested_at:
+            return _local_snapshot
+        snapshot = compute_snapshot()
+        _local_snapshot, _local_snapshot_at = snapshot, time.monotonic()
+        try:
+            # Kept for a few refresh intervals so a stopped beat doesn't serve stale numbers forever
+            ttl = max(get_settings().admin_stats_refresh_seconds * 5, 300)
+            _redis().set(SNAPSHOT_KEY, json.dumps(snapshot), ex=ttl)
+        except Exception as e:
+            logger.warning("admin_stats_store_failed", error=str(e))
+    logger.info("admin_stats_refreshed", computed_at=snapshot["computed_at"])
+    return snapshot
+
+
+def get_snapshot(refresh: bool = False) -> dict:
+    """Latest snapshot; computed now if `refresh` or none is stored."""
+    if not refresh:
+        try:
+            raw = _redis().get(SNAPSHOT_KEY)
+            if raw:
+                return json.loads(raw)
+        except Exception as e:
+            logger.warning("admin_stats_read_failed", error=str(e))
+            if _local_snapshot is not None:
+                return _local_snapshot
+    return refresh_snapshot()
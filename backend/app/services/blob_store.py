@@ -0,0 +1,161 @@
+"""Content-addressed (deduplicated) storage for uploaded and extracted files.
+
+With STORAGE_DEDUP enabled, source videos, their web previews and subtitle tracks
+are stored once under their SHA-256 (`blobs/ab/<hash><ext>`) and stored_files rows
+become references to the blob (stored_files.content_hash). Reference counts live in
+storage_blobs and are changed atomically by the acquire_blob / reuse_blob /
+release_blob RPCs (migration_content_dedup.sql); the object is deleted when the
+last reference is released. A hash hit skips storing the file (and, for previews,
+the transcode). Quotas still count the size of every reference.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+import structlog
+
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+from app.services.storage import CHUNK_SIZE, get_r2_storage
+
+logger = structlog.get_logger()
+
+BLOB_PREFIX = "blobs"
+
+
+def enabled() -> bool:
+    return get_settings().storage_dedup
+
+
+def hash_fields(content_hash: Optional[str]) -> dict:
+    """stored_files columns recording a blob reference. Empty with dedup off, so deployments
+    without migration_content_dedup.sql never read or write content_hash."""
+    return {"content_hash": content_hash} if enabled() else {}
+
+
+def file_columns(columns: str) -> str:
+    """stored_files select list, plus content_hash when dedup is on."""
+    return f"{columns}, content_hash" if enabled() else columns
+
+
+def blob_key(content_hash: str, ext: str = "") -> str:
+    return f"{BLOB_PREFIX}/{content_hash[:2]}/{content_hash}{ext}"
+
+
+def is_blob_key(key: Optional[str]) -> bool:
+    return bool(key) and key.startswith(f"{BLOB_PREFIX}/")
+
+
+def preview_hash(content_hash: str) -> str:
+    """Hash under which the web preview derived from a source video is stored."""
+    return f"{content_hash}-preview"
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file(
+    sb,
+    storage,
+    file_path: str,
+    key: str,
+    content_type: str = "application/octet-stream",
+    content_hash: Optional[str] = None,
+) -> dict:
+    """Move a local file into storage, deduplicated when STORAGE_DEDUP is on.
+
+    Returns {"key", "size", "content_hash", "hit"}: the blob key and its hash, or `key`
+    and None when dedup is off or the refcount RPC failed. On a hit the local file is
+    removed instead of stored. The caller records content_hash on the stored_files row.
+    """
+    size = os.path.getsize(file_path)
+    if enabled():
+        content_hash = content_hash or hash_file(file_path)
+        try:
+            row = _first(sb.rpc("acquire_blob", {
+                "hash_param": content_hash,
+                "storage_path_param": blob_key(content_hash, Path(key).suffix.lower()),
+                "size_param": size,
+            }).data)
+        except Exception as e:
+            logger.warning("blob_acquire_failed", hash=content_hash, error=str(e))
+            row = None
+        if row:
+            blob = row["storage_path"]
+            # First reference, or the object went missing: store it
+            if row["ref_count"] <= 1 or not storage.exists(blob):
+                storage.move_file(blob, file_path, content_type=content_type)
+                logger.info("blob_stored", hash=content_hash, key=blob, size=size)
+                return {"key": blob, "size": size, "content_hash": content_hash, "hit": False}
+            os.unlink(file_path)
+            logger.info("blob_hit", hash=content_hash, key=blob, size=size, refs=row["ref_count"])
+            return {"key": blob, "size": size, "content_hash": content_hash, "hit": True}
+
+    storage.move_file(key, file_path, content_type=content_type)
+    return {"key": key, "size": size, "content_hash": None, "hit": False}
+
+
+def reuse(sb, storage, content_hash: Optional[str]) -> Optional[dict]:
+    """Take a reference to an already stored blob: {"key", "size", "content_hash"},
+    or None if there is none (dedup off, unknown hash, or the object is missing)."""
+    if not content_hash or not enabled():
+        return None
+    try:
+        row = _first(sb.rpc("reuse_blob", {"hash_param": content_hash}).data)
+    except Exception as e:
+        logger.warning("blob_reuse_failed", hash=content_hash, error=str(e))
+        return None
+    if not row:
+        return None
+    if not storage.exists(row["storage_path"]):
+        release(sb, storage, content_hash, row["storage_path"])
+        return None
+    logger.info("blob_hit", hash=content_hash, key=row["storage_path"], size=row["size_bytes"])
+    return {"key": row["storage_path"], "size": row["size_bytes"], "content_hash": content_hash}
+
+
+def release(sb, storage, content_hash: str, key: str):
+    """Drop one reference; the object is deleted with the last one."""
+    remaining = sb.rpc("release_blob", {"hash_param": content_hash}).data
+    if remaining == 0:
+        storage.delete(key)
+        logger.info("blob_deleted", hash=content_hash, key=key)
+
+
+def delete_stored_file(sb, storage, file: dict):
+    """Delete the object behind a stored_files row (call alongside deleting the row).
+    Blob references are released instead; rows already moved to the user's own
+    storage have no object left. Errors propagate like storage.delete."""
+    key = file.get("storage_path")
+    if not key or file.get("uploaded_to_user_storage"):
+        return
+    if file.get("content_hash"):
+        release(sb, storage, file["content_hash"], key)
+    elif not is_blob_key(key):
+        storage.delete(key)
+
+
+def reconcile_blobs() -> int:
+    """Recount blob references from stored_files and delete blobs nobody references
+    (e.g. left by a failed upload). Returns the number of blobs deleted."""
+    storage = get_r2_storage()
+    orphans = get_supabase_admin().rpc("reconcile_blob_refs").data or []
+    for row in orphans:
+        try:
+            storage.delete(row["storage_path"])
+        except Exception as e:
+            logger.warning("blob_delete_failed", key=row["storage_path"], error=str(e))
+    logger.info("blobs_reconciled", deleted=len(orphans))
+    return len(orphans)
+
+
+def _first(data) -> Optional[dict]:
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data or None
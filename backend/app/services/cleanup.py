@@ -4,22 +4,32 @@ import structlog
 from datetime import datetime, timezone
 
 from app.core.supabase import get_supabase_admin
+from app.core.security import invalidate_profile
 from app.services.storage import get_r2_storage
+from app.services.reference_cache import get_plan
+from app.services.blob_store import delete_stored_file, hash_fields
 
 logger = structlog.get_logger()
 ACTIVE_PROJECT_STATUSES = {"processing", "translating", "exporting"}
 
 
-def _project_is_active(sb, project_id: str | None) -> bool:
-    """Return True if a project is currently in an active processing state."""
-    if not project_id:
-        return False
+def _active_project_ids(sb, files: list[dict]) -> set[str]:
+    """Ids of the projects (referenced by `files`) currently in an active processing state.
+    One query for all files instead of a status lookup per file."""
+    project_ids = list({f["project_id"] for f in files if f.get("project_id")})
+    if not project_ids:
+        return set()
     try:
-        project = sb.table("projects").select("status").eq("id", project_id).maybeSingle().execute()
+        projects = (
+            sb.table("projects")
+            .select("id")
+            .in_("id", project_ids)
+            .in_("status", sorted(ACTIVE_PROJECT_STATUSES))
+            .execute()
+        )
     except Exception:
-        return False
-    status = (project.data or {}).get("status")
-    return status in ACTIVE_PROJECT_STATUSES
+        return set()
+    return {p["id"] for p in (projects.data or [])}
 
 
 def cleanup_expired_files():
@@ -34,25 +44,25 @@ def cleanup_expired_files():
         logger.info("cleanup_no_expired_files")
         return 0
 
-    deleted_count = 0
-    freed_bytes = 0
+    deleted = []
+    active = _active_project_ids(sb, expired.data)
+    uow = sb.unit_of_work()
 
     for file in expired.data:
-        if _project_is_active(sb, file.get("project_id")):
+        if file.get("project_id") in active:
             continue
         try:
-            storage.delete(file["storage_path"])
-            sb.table("stored_files").delete().eq("id", file["id"]).execute()
-
-            freed_bytes += file.get("file_size_bytes", 0)
-            deleted_count += 1
+            delete_stored_file(sb, storage, file)
+            uow.delete("stored_files", file["id"])
+            deleted.append(file)
         except Exception as e:
             logger.warning("cleanup_file_failed", file_id=file["id"], error=str(e))
+    uow.commit()
 
     # Update storage_used_bytes for affected users
-    user_ids = set(f["user_id"] for f in expired.data)
-    for uid in user_ids:
-        _recalculate_storage(sb, uid)
+    release_files_storage(sb, deleted)
+    deleted_count = len(deleted)
+    freed_bytes = sum(f.get("file_size_bytes") or 0 for f in deleted)
 
     logger.info("cleanup_completed", deleted=deleted_count, freed_bytes=freed_bytes)
     return deleted_count
@@ -67,18 +77,21 @@ def mark_uploaded_to_user_storage(project_id: str):
     if not files.data:
         return 0
 
-    deleted_count = 0
+    moved = []
+    uow = sb.unit_of_work()
     for file in files.data:
         try:
-            storage.delete(file["storage_path"])
-            sb.table("stored_files").update({"uploaded_to_user_storage": True}).eq("id", file["id"]).execute()
-            deleted_count += 1
+            delete_stored_file(sb, storage, file)
+            # No longer references the blob either
+            uow.update("stored_files", {"uploaded_to_user_storage": True, **hash_fields(None)}, file["id"])
+            moved.append(file)
         except Exception as e:
             logger.warning("mark_user_storage_failed", file_id=file["id"], error=str(e))
+    uow.commit()
 
-    # Recalculate storage for the user
-    if files.data:
-        _recalculate_storage(sb, files.data[0]["user_id"])
+    # Files in the user's own storage no longer count against the quota
+    release_files_storage(sb, moved)
+    deleted_count = len(moved)
 
     logger.info("marked_user_storage", project_id=project_id, deleted=deleted_count)
     return deleted_count
@@ -94,11 +107,11 @@ def check_storage_limit(user_id: str) -> dict:
     if not profile.data:
         return {"ok": False, "error": "Profile not found"}
 
-    plan = sb.table("subscription_plans").select("storage_gb").eq("id", profile.data["plan_id"]).single().execute()
-    if not plan.data:
+    plan = get_plan(profile.data["plan_id"])
+    if not plan:
         return {"ok": False, "error": "Plan not found"}
 
-    max_bytes = int(float(plan.data["storage_gb"]) * 1024 * 1024 * 1024)
+    max_bytes = int(float(plan["storage_gb"]) * 1024 * 1024 * 1024)
     used_bytes = profile.data.get("storage_used_bytes", 0)
 
     if used_bytes < max_bytes:
@@ -121,14 +134,16 @@ def check_storage_limit(user_id: str) -> dict:
 
     deleted_files = []
     freed = 0
+    active = _active_project_ids(sb, files.data or [])
+    uow = sb.unit_of_work()
     for file in (files.data or []):
         if used_bytes - freed < max_bytes:
             break
-        if _project_is_active(sb, file.get("project_id")):
+        if file.get("project_id") in active:
             continue
         try:
-            storage.delete(file["storage_path"])
-            sb.table("stored_files").delete().eq("id", file["id"]).execute()
+            delete_stored_file(sb, storage, file)
+            uow.delete("stored_files", file["id"])
             freed += file.get("file_size_bytes", 0)
             deleted_files.append({
                 "id": file["id"],
@@ -138,8 +153,9 @@ def check_storage_limit(user_id: str) -> dict:
             })
         except Exception as e:
             logger.warning("storage_cleanup_failed", file_id=file["id"], error=str(e))
+    uow.commit()
 
-    _recalculate_storage(sb, user_id)
+    adjust_user_storage(sb, user_id, -freed)
 
     new_used = used_bytes - freed
     return {
@@ -162,11 +178,11 @@ def ensure_storage_for_upload(user_id: str, needed_bytes: int) -> dict:
     if not profile.data:
         return {"ok": False, "error": "Profile not found"}
 
-    plan = sb.table("subscription_plans").select("storage_gb").eq("id", profile.data["plan_id"]).single().execute()
-    if not plan.data:
+    plan = get_plan(profile.data["plan_id"])
+    if not plan:
         return {"ok": False, "error": "Plan not found"}
 
-    max_bytes = int(float(plan.data["storage_gb"]) * 1024 * 1024 * 1024)
+    max_bytes = int(float(plan["storage_gb"]) * 1024 * 1024 * 1024)
     used_bytes = profile.data.get("storage_used_bytes", 0)
     available = max_bytes - used_bytes
 
@@ -187,14 +203,16 @@ def ensure_storage_for_upload(user_id: str, needed_bytes: int) -> dict:
 
     freed = 0
     deleted_files = []
+    active = _active_project_ids(sb, files.data or [])
+    uow = sb.unit_of_work()
     for file in (files.data or []):
         if freed >= need_to_free:
             break
-        if _project_is_active(sb, file.get("project_id")):
+        if file.get("project_id") in active:
             continue
         try:
-            storage.delete(file["storage_path"])
-            sb.table("stored_files").delete().eq("id", file["id"]).execute()
+            delete_stored_file(sb, storage, file)
+            uow.delete("stored_files", file["id"])
             freed += file.get("file_size_bytes", 0)
             deleted_files.append({
                 "id": file["id"],
@@ -204,8 +222,9 @@ def ensure_storage_for_upload(user_id: str, needed_bytes: int) -> dict:
             })
         except Exception as e:
             logger.warning("ensure_storage_failed", file_id=file["id"], error=str(e))
+    uow.commit()
 
-    _recalculate_storage(sb, user_id)
+    adjust_user_storage(sb, user_id, -freed)
 
     new_used = used_bytes - freed
     new_available = max_bytes - new_used
@@ -221,16 +240,56 @@ def ensure_storage_for_upload(user_id: str, needed_bytes: int) -> dict:
     }
 
 
+def adjust_user_storage(sb, user_id: str, delta_bytes: int):
+    """Atomically add `delta_bytes` (negative to release) to profiles.storage_used_bytes.
+    Call after every stored_files insert/delete. Public helper — used by projects, export,
+    admin and cleanup modules."""
+    if not delta_bytes:
+        return
+    try:
+        sb.rpc("adjust_storage_used", {"user_id_param": user_id, "delta_param": int(delta_bytes)})
+    except Exception as e:
+        # RPC missing (migration_storage_accounting.sql not applied) or failed: full recount
+        logger.warning("storage_adjust_failed", user_id=user_id, delta=delta_bytes, error=str(e))
+        try:
+            recalculate_user_storage(sb, user_id)
+        except Exception as recount_error:
+            logger.warning("storage_recalculate_failed", user_id=user_id, error=str(recount_error))
+        return
+    invalidate_profile(user_id)
+
+
+def release_files_storage(sb, files: list[dict]):
+    """Subtract the sizes of deleted stored_files rows (or rows moved to the user's own
+    storage) from their owners' usage. Rows already in user storage were never counted."""
+    per_user: dict[str, int] = {}
+    for f in files:
+        if f.get("uploaded_to_user_storage") or not f.get("user_id"):
+            continue
+        per_user[f["user_id"]] = per_user.get(f["user_id"], 0) + (f.get("file_size_bytes") or 0)
+    for user_id, total in per_user.items():
+        adjust_user_storage(sb, user_id, -total)
+
+
 def recalculate_user_storage(sb, user_id: str):
-    """Recalculate total storage used by a user from stored_files.
-    Public helper — used by projects, export, and cleanup modules."""
+    """Recalculate total storage used by a user from stored_files (O(files); the
+    incremental adjust_user_storage is used on the request path)."""
     result = sb.table("stored_files").select("file_size_bytes").eq("user_id", user_id).eq("uploaded_to_user_storage", False).execute()
     total = sum(f.get("file_size_bytes", 0) for f in (result.data or []))
     sb.table("profiles").update({"storage_used_bytes": total}).eq("id", user_id).execute()
+    invalidate_profile(user_id)
 
 
-# Keep old name as alias for internal callers
-_recalculate_storage = recalculate_user_storage
+def reconcile_storage_usage() -> int:
+    """Repair drift between profiles.storage_used_bytes and stored_files for all users
+    in one set-based statement (reconcile_storage_used RPC). Returns the number fixed."""
+    sb = get_supabase_admin()
+    drifted = sb.rpc("reconcile_storage_used").data or []
+    for row in drifted:
+        invalidate_profile(row["user_id"])
+        logger.info("storage_usage_drift", user_id=row["user_id"], recorded=row["old_bytes"], actual=row["new_bytes"])
+    logger.info("storage_reconciled", drifted=len(drifted))
+    return len(drifted)
 
 
 def _format_bytes(b: int) -> str:
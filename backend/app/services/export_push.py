@@ -0,0 +1,298 @@
+"""Server-side push of export outputs to the user's own R2/B2 bucket.
+
+Instead of the user downloading an export and uploading it to their bucket, push_export
+streams it from storage into the bucket with a multipart upload: parts of
+USER_PUSH_PART_SIZE_MB read with ranged open_read, USER_PUSH_CONCURRENCY uploaded at
+once. Progress and the multipart UploadId are kept in Redis (push:<job_id>), so a retry
+resumes from the parts the bucket already has (ListParts) instead of starting over. On
+success the project's files are released with mark_uploaded_to_user_storage; a push that
+is given up (fail) aborts its multipart upload so the parts don't stay in the bucket.
+A push is claimed with SET NX (push:<job_id>:claim) so only one runs per export.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from typing import Optional
+import structlog
+
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+from app.services.cleanup import mark_uploaded_to_user_storage
+from app.services.storage import get_r2_storage
+from app.services.user_storage import get_active_config, get_bucket_name, get_s3_client, invalidate_listing
+
+logger = structlog.get_logger()
+
+STATE_TTL_SECONDS = 7 * 24 * 3600
+# A claim not refreshed by progress for this long belongs to a dead worker
+CLAIM_TTL_SECONDS = 600
+# S3 allows at most this many parts per upload
+_MAX_PARTS = 10000
+
+_redis_client = None
+# Fallback when Redis is unreachable (per process)
+_local_state: dict[str, dict] = {}
+_local_claims: dict[str, float] = {}
+_claims_lock = threading.Lock()
+
+
+class PushError(Exception):
+    """A push that retrying won't fix (no config, export missing, ...)."""
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.from_url(get_settings().redis_broker_url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis_client
+
+
+def _state_key(job_id: str) -> str:
+    return f"push:{job_id}"
+
+
+def _claim_key(job_id: str) -> str:
+    return f"push:{job_id}:claim"
+
+
+def get_state(job_id: str) -> Optional[dict]:
+    """Latest push state of an export job, or None if it was never pushed."""
+    try:
+        raw = _redis().get(_state_key(job_id))
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning("export_push_state_read_failed", job_id=job_id, error=str(e))
+        return _local_state.get(job_id)
+
+
+def _save_state(job_id: str, state: dict):
+    state["updated_at"] = time.time()
+    _local_state[job_id] = state
+    with _claims_lock:
+        if job_id in _local_claims:
+            _local_claims[job_id] = time.monotonic() + CLAIM_TTL_SECONDS
+    try:
+        pipe = _redis().pipeline()
+        pipe.set(_state_key(job_id), json.dumps(state), ex=STATE_TTL_SECONDS)
+        # Progress keeps the push's claim alive (no-op once released)
+        pipe.expire(_claim_key(job_id), CLAIM_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("export_push_state_store_failed", job_id=job_id, error=str(e))
+
+
+def claim(job_id: str) -> bool:
+    """Atomically claim the push of an export job (SET NX). False if a push of it is
+    already queued or running. The claim is released when the push completes or is failed,
+    and expires after CLAIM_TTL_SECONDS without progress."""
+    try:
+        return bool(_redis().set(_claim_key(job_id), 1, nx=True, ex=CLAIM_TTL_SECONDS))
+    except Exception as e:
+        logger.warning("export_push_claim_failed", job_id=job_id, error=str(e))
+    with _claims_lock:
+        if _local_claims.get(job_id, 0) > time.monotonic():
+            return False
+        _local_claims[job_id] = time.monotonic() + CLAIM_TTL_SECONDS
+        return True
+
+
+def _release(job_id: str):
+    with _claims_lock:
+        _local_claims.pop(job_id, None)
+    try:
+        _redis().delete(_claim_key(job_id))
+    except Exception as e:
+        logger.warning("export_push_release_failed", job_id=job_id, error=str(e))
+
+
+def default_key(job: dict) -> str:
+    return f"subtranslate/{job['project_id']}/{PurePosixPath(job['output_file_url']).name}"
+
+
+def queue_state(job_id: str, dest_key: str):
+    """Record a queued push (shown by the status route until the task starts)."""
+    state = get_state(job_id) or {}
+    state.update({"status": "queued", "key": dest_key, "error": None})
+    _save_state(job_id, state)
+
+
+def _part_size(size: int) -> int:
+    part_size = max(5, get_settings().user_push_part_size_mb) * 1024 * 1024  # S3 minimum part size is 5 MB
+    while size > part_size * _MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+def _completed_parts(client, bucket: str, key: str, upload_id: str) -> dict[int, str]:
+    """PartNumber -> ETag of the parts the bucket already has for this upload."""
+    parts: dict[int, str] = {}
+    params = {"Bucket": bucket, "Key": key, "UploadId": upload_id}
+    while True:
+        page = client.list_parts(**params)
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = part["ETag"]
+        if not page.get("IsTruncated"):
+            return parts
+        params["PartNumberMarker"] = page["NextPartNumberMarker"]
+
+
+def _abort_upload(client, state: dict):
+    """Abort a recorded multipart upload (its parts are billed until then)."""
+    try:
+        client.abort_multipart_upload(Bucket=state["bucket"], Key=state["key"], UploadId=state["upload_id"])
+        logger.info("export_push_aborted", key=state["key"], upload_id=state["upload_id"])
+    except Exception as e:
+        logger.warning("export_push_abort_failed", key=state.get("key"), error=str(e))
+
+
+def _release_files(job_id: str, project_id: str, state: dict) -> dict:
+    """Now in the user's bucket: free our copy (as POST /{project_id}/uploaded-to-own-storage)."""
+    state["deleted_files"] = mark_uploaded_to_user_storage(project_id)
+    _save_state(job_id, state)
+    _release(job_id)
+    return state
+
+
+def push_export(job_id: str, user_id: str, dest_key: Optional[str] = None, on_progress=None) -> dict:
+    """Upload an export job's output to the user's active bucket, resuming a previous
+    attempt's multipart upload when possible. Returns the final state.
+    Raises PushError for permanent failures; other errors leave the state resumable.
+    A retry after the upload completed only releases the project's files again."""
+    sb = get_supabase_admin()
+    storage = get_r2_storage()
+
+    job = (
+        sb.table("export_jobs")
+        .select("id, project_id, status, output_file_url")
+        .eq("id", job_id)
+        .eq("user_id", user_id)
+        .maybeSingle()
+        .execute()
+    )
+    if not job.data or job.data.get("status") != "completed" or not job.data.get("output_file_url"):
+        raise PushError("Export not completed")
+    config = get_active_config(user_id)
+    if not config:
+        raise PushError("No active storage config")
+    bucket = get_bucket_name(config)
+    if not bucket:
+        raise PushError("Bucket adı belirtilmemiş")
+    dest_key = dest_key or default_key(job.data)
+
+    previous = get_state(job_id) or {}
+    if previous.get("status") == "completed" and (previous.get("key"), previous.get("bucket")) == (dest_key, bucket):
+        # Uploaded by an earlier attempt that failed while releasing the files
+        logger.info("export_push_already_uploaded", job_id=job_id, key=dest_key)
+        return _release_files(job_id, job.data["project_id"], previous)
+
+    src_key = job.data["output_file_url"]
+    size = storage.get_size(src_key)
+    if size is None:
+        raise PushError("Export file not found")
+    part_size = _part_size(size)
+    client = get_s3_client(config)
+
+    state = {
+        "status": "uploading",
+        "key": dest_key,
+        "bucket": bucket,
+        "size": size,
+        "part_size": part_size,
+        "uploaded_bytes": 0,
+        "progress": 0,
+        "error": None,
+        "upload_id": None,
+    }
+    parts: dict[int, str] = {}
+    if previous.get("upload_id") and (
+        (previous.get("key"), previous.get("bucket"), previous.get("size"), previous.get("part_size"))
+        != (dest_key, bucket, size, part_size)
+    ):
+        # Different destination or source: the old upload can't be resumed
+        _abort_upload(client, previous)
+    elif previous.get("upload_id"):
+        try:
+            parts = _completed_parts(client, bucket, dest_key, previous["upload_id"])
+            state["upload_id"] = previous["upload_id"]
+            logger.info("export_push_resumed", job_id=job_id, parts_done=len(parts))
+        except Exception as e:
+            # Upload expired or was aborted: start over
+            logger.warning("export_push_resume_failed", job_id=job_id, error=str(e))
+            parts = {}
+    if not state["upload_id"]:
+        state["upload_id"] = client.create_multipart_upload(
+            Bucket=bucket, Key=dest_key, ContentType=f"video/{PurePosixPath(src_key).suffix.lstrip('.') or 'mp4'}",
+        )["UploadId"]
+
+    total_parts = max(1, -(-size // part_size))
+    done_bytes = sum(min(part_size, size - (n - 1) * part_size) for n in parts)
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def report():
+        state["uploaded_bytes"] = done_bytes
+        state["progress"] = int(done_bytes * 100 / size) if size else 100
+        _save_state(job_id, state)
+        if on_progress:
+            on_progress(state)
+
+    def upload_part(number: int):
+        nonlocal done_bytes
+        start = (number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        with storage.open_read(src_key, start, end) as f:
+            body = f.read()
+        etag = client.upload_part(
+            Bucket=bucket, Key=dest_key, UploadId=state["upload_id"], PartNumber=number, Body=body,
+        )["ETag"]
+        with lock:
+            parts[number] = etag
+            done_bytes += len(body)
+            report()
+
+    report()
+    pending = [n for n in range(1, total_parts + 1) if n not in parts]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, get_settings().user_push_concurrency)) as pool:
+            for future in [pool.submit(upload_part, n) for n in pending]:
+                future.result()
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=dest_key, UploadId=state["upload_id"],
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]},
+        )
+    except Exception as e:
+        # Keep upload_id: the next attempt resumes from the completed parts
+        state.update({"status": "failed", "error": str(e)[:500]})
+        _save_state(job_id, state)
+        raise
+
+    invalidate_listing(config)
+    state.update({"status": "completed", "upload_id": None, "uploaded_bytes": size, "progress": 100})
+    _save_state(job_id, state)
+    logger.info(
+        "export_pushed",
+        job_id=job_id, bucket=bucket, key=dest_key, size=size,
+        parts=total_parts, resumed_parts=total_parts - len(pending),
+        duration_s=round(time.monotonic() - started, 2),
+    )
+
+    return _release_files(job_id, job.data["project_id"], state)
+
+
+def fail(job_id: str, user_id: str, error: str):
+    """Record a push as failed for good (permanent error or retries exhausted),
+    aborting its multipart upload."""
+    state = get_state(job_id) or {}
+    if state.get("upload_id") and state.get("bucket"):
+        config = get_active_config(user_id)
+        if config:
+            _abort_upload(get_s3_client(config), state)
+        else:
+            logger.warning("export_push_abort_failed", job_id=job_id, error="No active storage config")
+    state.update({"status": "failed", "error": error[:500], "upload_id": None})
+    _save_state(job_id, state)
+    _release(job_id)
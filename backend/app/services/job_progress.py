@@ -0,0 +1,125 @@
+"""Write-behind buffer for translation/export job progress.
+
+Workers used to PATCH the job row after every chunk or progress step and read
+its status before each chunk to detect cancellation. JobProgressWriter merges
+successive updates to the row and writes them on a time / update-count threshold
+(immediately for terminal states). Each flush PATCH returns the row, so the
+cancellation check reuses its status instead of issuing a separate select.
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+import structlog
+
+from app.core.config import get_settings
+
+logger = structlog.get_logger()
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobProgressWriter:
+    """Coalescing writer for one row of translation_jobs / export_jobs."""
+
+    def __init__(
+        self,
+        sb,
+        table: str,
+        job_id: str,
+        on_flush: Optional[Callable[[dict], None]] = None,
+    ):
+        settings = get_settings()
+        self.sb = sb
+        self.table = table
+        self.job_id = job_id
+        self.on_flush = on_flush
+        self.flush_seconds = settings.job_progress_flush_seconds
+        self.max_pending = settings.job_progress_max_pending
+        self.status_check_seconds = settings.job_status_check_seconds
+
+        self._pending: dict = {}
+        self._pending_count = 0
+        self._last_flush = time.monotonic()
+        self._status: Optional[str] = None
+        self._status_at = float("-inf")
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.flushes = 0
+        self.status_reads = 0
+
+    def update(self, fields: dict, flush: bool = False):
+        """Merge `fields` into the pending row update; write it when a threshold is hit.
+        Terminal statuses are always written immediately (and errors propagate)."""
+        with self._lock:
+            self._pending.update(fields)
+            self._pending_count += 1
+            self.updates += 1
+            due = (
+                flush
+                or fields.get("status") in TERMINAL_STATUSES
+                or self._pending_count >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all pending fields in one PATCH."""
+        with self._lock:
+            if not self._pending:
+                return
+            fields, self._pending = self._pending, {}
+            self._pending_count = 0
+            self._last_flush = time.monotonic()
+        try:
+            result = self.sb.table(self.table).update(fields).eq("id", self.job_id).execute()
+        except Exception as e:
+            with self._lock:
+                # Keep the unwritten fields (newer pending values win)
+                self._pending = {**fields, **self._pending}
+                self._pending_count += 1
+            if fields.get("status") in TERMINAL_STATUSES:
+                raise
+            logger.warning("job_progress_flush_failed", table=self.table, job_id=self.job_id, error=str(e))
+            return
+
+        self.flushes += 1
+        rows = result.data or []
+        if rows:
+            self._status = rows[0].get("status")
+            self._status_at = time.monotonic()
+        if self.on_flush:
+            try:
+                self.on_flush(fields)
+            except Exception:
+                pass
+
+    def is_cancelled(self, fresh: bool = False) -> bool:
+        """Whether the job was cancelled. Uses the status returned by the last flush if it is
+        newer than job_status_check_seconds (unless `fresh`), otherwise flushes or reads it."""
+        if fresh or time.monotonic() - self._status_at >= self.status_check_seconds:
+            checked_at = time.monotonic()
+            self.flush()
+            if self._status_at < checked_at:
+                # Nothing pending to flush: read the status directly
+                job = self.sb.table(self.table).select("status").eq("id", self.job_id).maybeSingle().execute()
+                self.status_reads += 1
+                self._status = job.data.get("status") if job.data else None
+                self._status_at = time.monotonic()
+        return self._status == "cancelled"
+
+    def close(self):
+        """Flush what's left (best effort) and log how many writes were saved."""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("job_progress_flush_failed", table=self.table, job_id=self.job_id, error=str(e))
+        logger.info(
+            "job_progress_writes",
+            table=self.table, job_id=self.job_id,
+            updates=self.updates, flushes=self.flushes, status_reads=self.status_reads,
+        )
+
+    def stats(self) -> dict:
+        return {"updates": self.updates, "flushes": self.flushes, "status_reads": self.status_reads}
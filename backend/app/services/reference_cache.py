@@ -0,0 +1,160 @@
+"""Read-through TTL cache for near-static reference rows.
+
+subscription_plans and translation_engines rows, and each user's API keys per engine,
+are read on nearly every job and upload route but change rarely. Rows are cached per
+process for REFERENCE_CACHE_SECONDS (user keys for API_KEY_CACHE_SECONDS, since they
+are edited directly from the frontend). invalidate() drops entries locally and
+publishes on a Redis channel so the API and worker processes drop them too; if Redis
+is unreachable, staleness is bounded by the TTL. Other per-process caches (auth
+profiles) ride the same channel through on_invalidate().
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+import structlog
+
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+
+logger = structlog.get_logger()
+
+INVALIDATION_CHANNEL = "reference_cache:invalidate"
+_RECONNECT_SECONDS = 5
+
+# (kind, key) -> (expires_at, value)
+_cache: dict[tuple[str, str], tuple[float, Any]] = {}
+_cache_lock = threading.Lock()
+# Bumped on every invalidation, so a load that raced with one isn't stored
+_generation = 0
+
+# kind -> handler(key) for caches kept outside this module (see on_invalidate)
+_handlers: dict[str, Callable[[Optional[str]], None]] = {}
+
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+_publisher = None
+
+
+def _read_through(kind: str, key: str, ttl: float, load: Callable[[], Any]) -> Any:
+    _ensure_listener()
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get((kind, key))
+        generation = _generation
+    if cached and cached[0] > now:
+        return cached[1]
+    value = load()
+    with _cache_lock:
+        if generation == _generation:
+            _cache[(kind, key)] = (now + ttl, value)
+    return value
+
+
+def get_plan(plan_id: str) -> Optional[dict]:
+    """subscription_plans row (all columns), or None if the plan doesn't exist."""
+    def load():
+        result = get_supabase_admin().table("subscription_plans").select("*").eq("id", plan_id).maybeSingle().execute()
+        return result.data
+    return _read_through("plan", plan_id, get_settings().reference_cache_seconds, load)
+
+
+def get_engine_config(engine_id: str) -> Optional[dict]:
+    """translation_engines row (all columns), or None if the engine doesn't exist."""
+    def load():
+        result = get_supabase_admin().table("translation_engines").select("*").eq("id", engine_id).maybeSingle().execute()
+        return result.data
+    return _read_through("engine", engine_id, get_settings().reference_cache_seconds, load)
+
+
+def get_user_api_keys(user_id: str, engine: str) -> list[dict]:
+    """A user's user_api_keys rows for one engine."""
+    def load():
+        result = (
+            get_supabase_admin().table("user_api_keys")
+            .select("api_key_encrypted, model_id, is_default")
+            .eq("user_id", user_id)
+            .eq("engine", engine)
+            .execute()
+        )
+        return result.data or []
+    return _read_through("api_keys", f"{user_id}:{engine}", get_settings().api_key_cache_seconds, load)
+
+
+def _drop_local(kind: Optional[str], key: Optional[str]):
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        if kind is None:
+            _cache.clear()
+        else:
+            for k in [k for k in _cache if k[0] == kind and (key is None or k[1] == key or k[1].startswith(f"{key}:"))]:
+                del _cache[k]
+    for handler_kind, handler in list(_handlers.items()):
+        if kind is None:
+            handler(None)
+        elif handler_kind == kind:
+            handler(key)
+
+
+def on_invalidate(kind: str, handler: Callable[[Optional[str]], None]):
+    """Run handler(key) whenever invalidate(kind, key) is called in any process
+    (handler(None): drop everything, e.g. after the listener reconnected).
+    Call it where the cache is filled: it also starts this process's listener."""
+    _handlers[kind] = handler
+    _ensure_listener()
+
+
+def invalidate(kind: Optional[str] = None, key: Optional[str] = None):
+    """Drop cached rows in this and every other process.
+    kind: "plan", "engine", "api_keys", a kind registered with on_invalidate (e.g.
+    "profile") or None for everything; key: row id (or user id for api_keys and
+    profiles), None for all rows of the kind."""
+    _drop_local(kind, key)
+    global _publisher
+    try:
+        if _publisher is None:
+            import redis
+            _publisher = redis.from_url(get_settings().redis_broker_url, socket_timeout=2, socket_connect_timeout=2)
+        _publisher.publish(INVALIDATION_CHANNEL, json.dumps({"kind": kind, "key": key}))
+    except Exception as e:
+        logger.warning("reference_cache_publish_failed", kind=kind, key=key, error=str(e))
+
+
+def _listen():
+    import redis
+    warned = False
+    while True:
+        try:
+            client = redis.from_url(get_settings().redis_broker_url, socket_connect_timeout=2, health_check_interval=30)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages may have been missed while disconnected
+            _drop_local(None, None)
+            warned = False
+            for message in pubsub.listen():
+                try:
+                    data = json.loads(message["data"])
+                    _drop_local(data.get("kind"), data.get("key"))
+                except Exception:
+                    _drop_local(None, None)
+        except Exception as e:
+            if not warned:
+                logger.warning("reference_cache_listener_failed", error=str(e))
+                warned = True
+        time.sleep(_RECONNECT_SECONDS)
+
+
+def _ensure_listener():
+    """Start the invalidation subscriber (one daemon thread per process, after any fork)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        threading.Thread(target=_listen, name="reference-cache-invalidation", daemon=True).start()
+        _listener_pid = pid
@@ -0,0 +1,290 @@
+"""S3-compatible primary storage (Cloudflare R2, MinIO, AWS S3) for SubTranslate.
+
+Selected with STORAGE_BACKEND=s3 and configured by the R2_* settings, so the API and
+workers no longer need a shared volume. Large files move with parallel multipart
+transfers (STORAGE_PART_SIZE_MB parts, STORAGE_MAX_CONCURRENCY at a time); reads are
+streamed with ranged GETs and /files redirects to presigned URLs.
+"""
+
+import io
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import structlog
+
+from app.core.config import get_settings
+from app.services.storage import CHUNK_SIZE, StorageBackend
+
+logger = structlog.get_logger()
+
+# DeleteObjects accepts at most this many keys per request
+_DELETE_BATCH = 1000
+# Optimistic-concurrency attempts for append()
+_APPEND_ATTEMPTS = 5
+
+
+def _error_code(e: ClientError) -> str:
+    return str(e.response.get("Error", {}).get("Code", ""))
+
+
+def _is_missing(e: ClientError) -> bool:
+    return _error_code(e) in ("404", "NoSuchKey", "NotFound")
+
+
+class S3Storage(StorageBackend):
+    """Primary storage in an S3-compatible bucket."""
+
+    name = "s3"
+    # rename() is a copy + delete
+    atomic_rename = False
+
+    def __init__(self):
+        settings = get_settings()
+        if not settings.r2_endpoint or not settings.r2_bucket_name:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires R2_ENDPOINT and R2_BUCKET_NAME")
+        self.bucket = settings.r2_bucket_name
+        self.endpoint = settings.r2_endpoint
+        self.presign_seconds = settings.storage_presign_seconds
+        concurrency = max(1, settings.storage_max_concurrency)
+        part_size = max(5, settings.storage_part_size_mb) * 1024 * 1024  # S3 minimum part size is 5 MB
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.r2_endpoint,
+            aws_access_key_id=settings.r2_access_key_id,
+            aws_secret_access_key=settings.r2_secret_access_key,
+            region_name=settings.r2_region,
+            config=Config(
+                signature_version="s3v4",
+                s3={"addressing_style": "path"},
+                retries={"max_attempts": 3, "mode": "standard"},
+                connect_timeout=10,
+                read_timeout=60,
+                # Every parallel part needs its own connection
+                max_pool_connections=max(10, concurrency * 2),
+            ),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=concurrency,
+            use_threads=True,
+        )
+        logger.info("s3_storage_init", endpoint=self.endpoint, bucket=self.bucket)
+
+    def _key(self, key: str) -> str:
+        """Validate a storage key (same traversal rules as the local backend)."""
+        parts = key.split("/")
+        if not key or key.startswith("/") or ".." in parts:
+            raise ValueError(f"Path traversal detected: {key}")
+        return key
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def upload(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> dict:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+        logger.info("s3_stored", key=key, size=len(data))
+        return {"key": key, "cdn_url": self.get_cdn_url(key), "size": len(data)}
+
+    def upload_file(self, key: str, file_path: str, content_type: str = "application/octet-stream") -> dict:
+        """Upload a local file (parallel multipart above the part size)."""
+        size = os.path.getsize(file_path)
+        started = time.monotonic()
+        self.client.upload_file(
+            str(file_path), self.bucket, self._key(key),
+            ExtraArgs={"ContentType": content_type}, Config=self.transfer,
+        )
+        logger.info("s3_stored_file", key=key, size=size, duration_s=round(time.monotonic() - started, 2))
+        return {"key": key, "cdn_url": self.get_cdn_url(key), "size": size}
+
+    def move_file(self, key: str, file_path: str, content_type: str = "application/octet-stream") -> dict:
+        """Upload a local file and remove it."""
+        result = self.upload_file(key, file_path, content_type)
+        os.unlink(file_path)
+        return result
+
+    def open_read(self, key: str, start: int = 0, end: Optional[int] = None) -> BinaryIO:
+        """Stream a stored file (or the byte range start..end, inclusive) with one ranged GET."""
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            body = self.client.get_object(**params)["Body"]
+        except ClientError as e:
+            if _is_missing(e):
+                raise RuntimeError(f"File not found: {key}")
+            if _error_code(e) == "InvalidRange":
+                return io.BytesIO(b"")
+            raise
+        return io.BufferedReader(_BodyReader(body), CHUNK_SIZE)
+
+    @contextmanager
+    def open_write(self, key: str, content_type: str = "application/octet-stream") -> Iterator[BinaryIO]:
+        """Spool writes to a temp file and upload it (multipart) when the block exits
+        without an exception; the object is replaced only then."""
+        with tempfile.TemporaryFile(dir=get_settings().temp_path) as f:
+            yield f
+            size = f.tell()
+            f.seek(0)
+            self.client.upload_fileobj(
+                f, self.bucket, self._key(key),
+                ExtraArgs={"ContentType": content_type}, Config=self.transfer,
+            )
+        logger.info("s3_stored", key=key, size=size)
+
+    def append(self, key: str, data: bytes) -> int:
+        """Append to an object (created if missing). S3 has no append: the object is
+        rewritten with a conditional PUT, retried if another writer got there first."""
+        key = self._key(key)
+        for _ in range(_APPEND_ATTEMPTS):
+            try:
+                obj = self.client.get_object(Bucket=self.bucket, Key=key)
+                current, condition = obj["Body"].read(), {"IfMatch": obj["ETag"]}
+            except ClientError as e:
+                if not _is_missing(e):
+                    raise
+                current, condition = b"", {"IfNoneMatch": "*"}
+            body = current + data
+            try:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=body, **condition)
+                return len(body)
+            except ClientError as e:
+                if _error_code(e) not in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409"):
+                    raise
+        raise RuntimeError(f"Concurrent appends kept conflicting: {key}")
+
+    def rename(self, key: str, new_key: str) -> bool:
+        """Copy to new_key (managed multipart copy) and delete key. Not atomic.
+        Returns False if the source doesn't exist."""
+        try:
+            self.client.copy(
+                {"Bucket": self.bucket, "Key": self._key(key)}, self.bucket, self._key(new_key),
+                Config=self.transfer,
+            )
+        except ClientError as e:
+            if _is_missing(e):
+                return False
+            raise
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    def list_keys(self, prefix: str) -> list[str]:
+        """Keys of the objects starting with `prefix`, sorted (all ListObjectsV2 pages)."""
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return sorted(keys)
+
+    def exists(self, key: str) -> bool:
+        try:
+            return self._head(key) is not None
+        except ValueError:
+            return False
+
+    def get_size(self, key: str) -> Optional[int]:
+        try:
+            head = self._head(key)
+        except ValueError:
+            return None
+        return head["ContentLength"] if head else None
+
+    def get_version(self, key: str) -> Optional[str]:
+        """Object ETag + size, or None if it doesn't exist."""
+        try:
+            head = self._head(key)
+        except ValueError:
+            return None
+        if not head:
+            return None
+        etag = head["ETag"].strip('"')
+        return f"{etag}-{head['ContentLength']:x}"
+
+    def copy_to(self, key: str, dest_path: str) -> str:
+        """Download a stored file to dest_path (parallel ranged GETs for large files)."""
+        started = time.monotonic()
+        try:
+            self.client.download_file(self.bucket, self._key(key), str(dest_path), Config=self.transfer)
+        except ClientError as e:
+            if _is_missing(e):
+                raise RuntimeError(f"File not found: {key}")
+            raise
+        logger.info("s3_downloaded_file", key=key, duration_s=round(time.monotonic() - started, 2))
+        return dest_path
+
+    def local_input(self, key: str, dest_path: str) -> str:
+        """Jobs need a local copy of remote objects: downloaded to dest_path."""
+        return self.copy_to(key, dest_path)
+
+    def media_input(self, key: str) -> str:
+        """Presigned URL ffprobe/ffmpeg read directly (ranged HTTP reads, no download)."""
+        if not self.exists(key):
+            raise RuntimeError(f"File not found: {key}")
+        return self.presigned_url(key)
+
+    def presigned_url(self, key: str, expires_in: Optional[int] = None, cache_control: Optional[str] = None) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if cache_control:
+            params["ResponseCacheControl"] = cache_control
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in or self.presign_seconds)
+
+    def delete(self, key: str) -> bool:
+        """Delete an object (S3 deletes are idempotent, so this is True for missing keys too)."""
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        logger.info("s3_deleted", key=key)
+        return True
+
+    def delete_many(self, keys: list[str]) -> int:
+        """Delete objects in batches of 1000 (one request per batch)."""
+        deleted = 0
+        keys = [self._key(k) for k in keys]
+        for i in range(0, len(keys), _DELETE_BATCH):
+            batch = keys[i:i + _DELETE_BATCH]
+            result = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": k} for k in batch], "Quiet": False},
+            )
+            deleted += len(result.get("Deleted", []))
+            for err in result.get("Errors", []):
+                logger.warning("s3_delete_failed", key=err.get("Key"), error=err.get("Message"))
+        return deleted
+
+    def check(self) -> bool:
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+            return True
+        except Exception:
+            return False
+
+
+class _BodyReader(io.RawIOBase):
+    """Raw reader over a botocore StreamingBody (wrapped in a BufferedReader by open_read)."""
+
+    def __init__(self, body):
+        self._body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._body.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+    def close(self):
+        try:
+            self._body.close()
+        finally:
+            super().close()
@@ -1,22 +1,95 @@
 """Local file storage service for SubTranslate."""
 
+import errno
+import io
+import os
 import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 import structlog
 
 from app.core.config import get_settings
 
 logger = structlog.get_logger()
 
+# Staging area inside the storage root for uploads when TEMP_DIR is on another filesystem
+INGEST_DIR = ".ingest"
+
+# Read size for streaming reads
+CHUNK_SIZE = 1024 * 1024
+
+# Linux FICLONE ioctl (reflink on btrfs/XFS/bcachefs)
+_FICLONE = 0x40049409
+
 # Local storage root directory — configurable via STORAGE_DIR env var, defaults to backend/storage/
 _settings = get_settings()
 STORAGE_DIR = Path(_settings.storage_dir) if _settings.storage_dir else (Path(__file__).resolve().parent.parent.parent / "storage")
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-class LocalStorage:
-    """Local file system storage — same API as R2Storage for drop-in replacement."""
+class StorageBackend:
+    """Primary file storage interface, implemented by LocalStorage (STORAGE_DIR) and
+    S3Storage (app/services/s3_storage.py, STORAGE_BACKEND=s3).
+
+    Keys are "/"-separated paths (see get_storage_key). Backend-specific methods:
+    upload/upload_file/move_file, open_read/open_write, download, append, rename,
+    exists, get_size, get_version, list_keys, copy_to, local_input, media_input, delete, check.
+    """
+
+    name = "base"
+    # Whether rename() is atomic (a concurrent append can't be lost between copy and delete)
+    atomic_rename = True
+
+    def ingest_dir(self, name: str) -> Path:
+        """Create a work directory for files that will be moved into storage."""
+        path = get_settings().temp_path / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def presigned_url(self, key: str, expires_in: Optional[int] = None, cache_control: Optional[str] = None) -> Optional[str]:
+        """Time-limited direct URL for a stored file, or None if /files serves it itself.
+        `cache_control` is returned as the object's Cache-Control header."""
+        return None
+
+    def download(self, key: str) -> bytes:
+        """Read a whole stored file into memory (small files only; see open_read)."""
+        with self.open_read(key) as f:
+            return f.read()
+
+    def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield a stored file (or the byte range start..end, inclusive) in chunks."""
+        with self.open_read(key, start, end) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete_many(self, keys: list[str]) -> int:
+        """Delete multiple files."""
+        deleted = 0
+        for key in keys:
+            if self.delete(key):
+                deleted += 1
+        return deleted
+
+    def get_cdn_url(self, key: str) -> str:
+        """Get the file URL (served, or redirected to the bucket, by the /files/ endpoint)."""
+        return f"/files/{key}"
+
+
+    def get_storage_key(self, user_id: str, project_id: str, file_type: str, filename: str) -> str:
+        """Generate a structured storage key."""
+        return f"users/{user_id}/{project_id}/{file_type}/{filename}"
+
+
+
+class LocalStorage(StorageBackend):
+    """Local file system storage under STORAGE_DIR."""
+
+    name = "local"
 
     def __init__(self):
         self.root = STORAGE_DIR
@@ -38,13 +111,54 @@ class LocalStorage:
         return path
 
     def upload(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> dict:
-        """Save data to local file."""
+        """Save data to local file (atomically replaces an existing file)."""
         path = self._resolve(key)
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_bytes(data)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
         logger.info("local_stored", key=key, size=len(data))
         return {"key": key, "cdn_url": f"/files/{key}", "size": len(data)}
 
+    def append(self, key: str, data: bytes) -> int:
+        """Append data to a stored file (created if missing). Returns the new file size."""
+        path = self._resolve(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    def rename(self, key: str, new_key: str) -> bool:
+        """Atomically rename a stored file. Returns False if the source doesn't exist."""
+        src = self._resolve(key)
+        dest = self._resolve(new_key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(src, dest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def list_keys(self, prefix: str) -> list[str]:
+        """Keys of the stored files starting with `prefix`, sorted."""
+        base = self._resolve(prefix.rsplit("/", 1)[0]) if "/" in prefix else self._root_resolved
+        if not base.is_dir():
+            return []
+        keys = (p.relative_to(self._root_resolved).as_posix() for p in base.rglob("*") if p.is_file())
+        return sorted(k for k in keys if k.startswith(prefix))
+
+    def exists(self, key: str) -> bool:
+        try:
+            return self._resolve(key).is_file()
+        except ValueError:
+            return False
+
     def upload_file(self, key: str, file_path: str, content_type: str = "application/octet-stream") -> dict:
         """Copy a file to local storage."""
         path = self._resolve(key)
@@ -54,6 +168,49 @@ class LocalStorage:
         logger.info("local_stored_file", key=key, size=size)
         return {"key": key, "cdn_url": f"/files/{key}", "size": size}
 
+    def move_file(self, key: str, file_path: str, content_type: str = "application/octet-stream") -> dict:
+        """Move a local file into storage (the source path is gone afterwards).
+
+        A rename, so atomic and free, when file_path is on the storage filesystem (see
+        ingest_dir). Otherwise the file is copied to a temp name next to the destination,
+        renamed into place and the source removed.
+        """
+        path = self._resolve(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(file_path, path)
+            moved = True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            moved = False
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                shutil.copyfile(file_path, tmp)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+            os.unlink(file_path)
+        size = path.stat().st_size
+        logger.info("local_moved_file", key=key, size=size, renamed=moved)
+        return {"key": key, "cdn_url": f"/files/{key}", "size": size}
+
+    def ingest_dir(self, name: str) -> Path:
+        """Create a work directory for files that will be moved into storage.
+
+        Under TEMP_DIR when it shares a filesystem with the storage root (move_file is a
+        rename); otherwise under the storage root's staging area, so uploads are written
+        once, straight onto the filesystem they end up on.
+        """
+        temp_root = get_settings().temp_path
+        temp_root.mkdir(parents=True, exist_ok=True)
+        if temp_root.stat().st_dev == self.root.stat().st_dev:
+            path = temp_root / name
+        else:
+            path = self.root / INGEST_DIR / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
     def download(self, key: str) -> bytes:
         """Read a file from local storage."""
         path = self._resolve(key)
@@ -61,6 +218,36 @@ class LocalStorage:
             raise RuntimeError(f"File not found: {key}")
         return path.read_bytes()
 
+    def open_read(self, key: str, start: int = 0, end: Optional[int] = None) -> BinaryIO:
+        """Open a stored file for streaming reads from byte `start` up to `end` (inclusive,
+        None = end of file). The caller closes it (use as a context manager)."""
+        path = self._resolve(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise RuntimeError(f"File not found: {key}")
+        if start:
+            f.seek(start)
+        if end is None:
+            return f
+        return io.BufferedReader(_RangeReader(f, end - start + 1), CHUNK_SIZE)
+
+    @contextmanager
+    def open_write(self, key: str, content_type: str = "application/octet-stream") -> Iterator[BinaryIO]:
+        """Open a stored file for streaming writes. The file appears (atomically replacing an
+        existing one) only when the block exits without an exception."""
+        path = self._resolve(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                yield f
+                size = f.tell()
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        logger.info("local_stored", key=key, size=size)
+
     def get_local_path(self, key: str) -> Path:
         """Get the local filesystem path for a storage key (avoids RAM load for large files)."""
         path = self._resolve(key)
@@ -68,6 +255,28 @@ class LocalStorage:
             raise RuntimeError(f"File not found: {key}")
         return path
 
+    def get_size(self, key: str) -> Optional[int]:
+        """Size in bytes of a stored file, or None if it doesn't exist."""
+        try:
+            return self._resolve(key).stat().st_size
+        except (OSError, ValueError):
+            return None
+
+    def media_input(self, key: str) -> str:
+        """Path ffmpeg/ffprobe can read a stored file from."""
+        return str(self.get_local_path(key))
+
+    def check(self) -> bool:
+        return self.root.exists() and self.root.is_dir()
+
+    def get_version(self, key: str) -> Optional[str]:
+        """Cheap change token for a stored file (mtime + size), or None if it doesn't exist."""
+        try:
+            st = self._resolve(key).stat()
+        except (OSError, ValueError):
+            return None
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
     def copy_to(self, key: str, dest_path: str) -> str:
         """Copy a stored file to a destination path (no RAM load)."""
         src = self._resolve(key)
@@ -76,6 +285,30 @@ class LocalStorage:
         shutil.copy2(str(src), dest_path)
         return dest_path
 
+    def local_input(self, key: str, dest_path: str) -> str:
+        """Path a job can read a stored file from, without copying its data.
+
+        Hardlinks the file to dest_path (the data stays readable if the stored file is
+        deleted mid-job), else clones it (reflink) where the filesystem supports it. When
+        dest_path is on another filesystem the stored file is read in place. Callers must
+        treat the returned path as read-only.
+        """
+        src = self._resolve(key)
+        if not src.exists():
+            raise RuntimeError(f"File not found: {key}")
+        try:
+            os.link(src, dest_path)
+            logger.debug("local_input_linked", key=key)
+            return dest_path
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                logger.debug("local_input_in_place", key=key)
+                return str(src)
+        if _reflink(src, dest_path):
+            logger.debug("local_input_cloned", key=key)
+            return dest_path
+        return str(src)
+
     def delete(self, key: str) -> bool:
         """Delete a file from local storage."""
         path = self._resolve(key)
@@ -93,29 +326,60 @@ class LocalStorage:
             return True
         return False
 
-    def delete_many(self, keys: list[str]) -> int:
-        """Delete multiple files."""
-        deleted = 0
-        for key in keys:
-            if self.delete(key):
-                deleted += 1
-        return deleted
 
-    def get_cdn_url(self, key: str) -> str:
-        """Get local file URL (served via /files/ endpoint)."""
-        return f"/files/{key}"
+class _RangeReader(io.RawIOBase):
+    """Raw reader returning at most `remaining` bytes from an open file."""
 
-    def get_storage_key(self, user_id: str, project_id: str, file_type: str, filename: str) -> str:
-        """Generate a structured storage key."""
-        return f"users/{user_id}/{project_id}/{file_type}/{filename}"
+    def __init__(self, f: BinaryIO, remaining: int):
+        self._f = f
+        self._remaining = max(remaining, 0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self._remaining]
+        n = self._f.readinto(view)
+        self._remaining -= n or 0
+        return n or 0
+
+    def close(self):
+        try:
+            self._f.close()
+        finally:
+            super().close()
+
+
+def _reflink(src: Path, dest_path: str) -> bool:
+    """Copy-on-write clone of src to dest_path; False if unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as s, open(dest_path, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return True
+    except OSError:
+        try:
+            os.unlink(dest_path)
+        except OSError:
+            pass
+        return False
 
 
-_storage_client: Optional[LocalStorage] = None
+_storage_client: Optional[StorageBackend] = None
 
 
-def get_r2_storage() -> LocalStorage:
-    """Get singleton storage client (kept as get_r2_storage for API compatibility)."""
+def get_r2_storage() -> StorageBackend:
+    """Get singleton storage client for STORAGE_BACKEND (kept as get_r2_storage for API compatibility)."""
     global _storage_client
     if _storage_client is None:
-        _storage_client = LocalStorage()
+        if get_settings().storage_backend == "s3":
+            from app.services.s3_storage import S3Storage
+            _storage_client = S3Storage()
+        else:
+            _storage_client = LocalStorage()
     return _storage_client
@@ -0,0 +1,188 @@
+"""In-process cache of parsed subtitle tracks for the editor endpoints.
+
+Parsing a track means reading the original (and translated) file from storage
+and running both through pysubs2, which dominates the cost of every subtitle
+read. Parsed base files are cached per subtitle_files row and keyed by the
+storage versions of their files, so a rewritten file is re-parsed on the next
+read. Pending editor edits (see subtitle_edits) are overlaid on the cached base.
+"""
+
+import base64
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+import structlog
+
+from app.services.subtitle_parser import parse_stored_subtitle, srt_time_to_ms
+from app.services.subtitle_edits import read_pending_edits, apply_edits, log_versions
+from app.services.storage import get_r2_storage
+from app.utils.intervals import IntervalIndex
+
+logger = structlog.get_logger()
+
+MAX_CACHED_TRACKS = 64
+
+
+class ParsedTrack:
+    """Merged original + translated lines of one subtitle file, with lookup indexes."""
+
+    def __init__(self, sub_file: dict, lines: list[dict]):
+        self.subtitle_file_id = sub_file["id"]
+        self.language = sub_file.get("language")
+        self.format = sub_file.get("format")
+        self.track_index = sub_file.get("track_index")
+        self.lines = lines
+        # line_number -> position in self.lines
+        self._pos_by_line = {l["line_number"]: i for i, l in enumerate(lines)}
+        # Time-interval index over [start_ms, end_ms) -> position in self.lines
+        self._intervals = IntervalIndex([(l["start_ms"], l["end_ms"], i) for i, l in enumerate(lines)])
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def position_of(self, line_number: int) -> Optional[int]:
+        return self._pos_by_line.get(line_number)
+
+    def line_range(self, line_from: Optional[int] = None, line_to: Optional[int] = None) -> list[dict]:
+        """Lines with line_from <= line_number <= line_to (both bounds optional)."""
+        lo = 0
+        hi = len(self.lines)
+        if line_from is not None:
+            lo = bisect.bisect_left(self.lines, line_from, key=lambda l: l["line_number"])
+        if line_to is not None:
+            hi = bisect.bisect_right(self.lines, line_to, key=lambda l: l["line_number"])
+        return self.lines[lo:hi]
+
+    def overlapping(self, start_ms: int, end_ms: int) -> list[dict]:
+        """Lines on screen at any point in [start_ms, end_ms), in line order."""
+        return [self.lines[i] for i in self._intervals.overlapping(start_ms, end_ms)]
+
+    def active_at(self, t_ms: int) -> list[dict]:
+        """Lines on screen at t_ms, in line order."""
+        return [self.lines[i] for i in self._intervals.at(t_ms)]
+
+    def summary(self) -> dict:
+        translated = sum(1 for l in self.lines if l["is_translated"])
+        return {
+            "id": self.subtitle_file_id,
+            "language": self.language,
+            "format": self.format,
+            "track_index": self.track_index,
+            "total_lines": len(self.lines),
+            "translated_lines": translated,
+            "first_start_ms": min((l["start_ms"] for l in self.lines), default=0),
+            "last_end_ms": max((l["end_ms"] for l in self.lines), default=0),
+        }
+
+
+# sf_id -> (base file versions, merged base lines)
+_base_cache: "OrderedDict[str, tuple[tuple, list[dict]]]" = OrderedDict()
+# sf_id -> (base versions + edit log versions, track with edits applied)
+_cache: "OrderedDict[str, tuple[tuple, ParsedTrack]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(cache: OrderedDict, key: str, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_CACHED_TRACKS:
+        cache.popitem(last=False)
+
+
+def _version_key(storage, sub_file: dict) -> tuple:
+    file_url = sub_file.get("file_url")
+    translated_url = sub_file.get("translated_file_url")
+    return (
+        file_url,
+        storage.get_version(file_url) if file_url else None,
+        translated_url,
+        storage.get_version(translated_url) if translated_url else None,
+    )
+
+
+def _build_base_lines(storage, sub_file: dict) -> list[dict]:
+    fmt = sub_file.get("format", "srt")
+    lines = parse_stored_subtitle(storage, sub_file["file_url"], fmt)
+
+    translated_lines: dict[int, str] = {}
+    translated_url = sub_file.get("translated_file_url")
+    if translated_url:
+        try:
+            tr_parsed = parse_stored_subtitle(storage, translated_url, fmt)
+            translated_lines = {l["line_number"]: l["original_text"] for l in tr_parsed}
+        except Exception as e:
+            logger.warning("subtitle_translated_parse_failed", file_id=sub_file["id"], error=str(e))
+
+    merged = []
+    for line in lines:
+        tr_text = translated_lines.get(line["line_number"])
+        merged.append({
+            "id": f"{sub_file['id']}_{line['line_number']}",
+            "subtitle_file_id": sub_file["id"],
+            "project_id": sub_file.get("project_id"),
+            "line_number": line["line_number"],
+            "start_time": line["start_time"],
+            "end_time": line["end_time"],
+            "start_ms": srt_time_to_ms(line["start_time"]),
+            "end_ms": srt_time_to_ms(line["end_time"]),
+            "original_text": line["original_text"],
+            "translated_text": tr_text,
+            "style": line.get("style"),
+            "is_translated": bool(tr_text),
+        })
+    return merged
+
+
+def track_version(sub_file: dict) -> tuple:
+    """Change token of a track (stored file versions + pending edit log), without parsing it."""
+    return (sub_file["id"], _version_key(get_r2_storage(), sub_file), log_versions(sub_file["id"]))
+
+
+def get_parsed_track(sub_file: dict) -> ParsedTrack:
+    """Return the parsed track for a subtitle_files row with pending edits applied.
+    Files are only re-parsed when their storage version changed."""
+    storage = get_r2_storage()
+    sf_id = sub_file["id"]
+    base_version = _version_key(storage, sub_file)
+    version = (base_version, log_versions(sf_id))
+
+    with _cache_lock:
+        cached = _cache.get(sf_id)
+        if cached and cached[0] == version:
+            _cache.move_to_end(sf_id)
+            return cached[1]
+        base = _base_cache.get(sf_id)
+        base_lines = base[1] if base and base[0] == base_version else None
+
+    if base_lines is None:
+        base_lines = _build_base_lines(storage, sub_file)
+    track = ParsedTrack(sub_file, apply_edits(base_lines, read_pending_edits(sf_id)))
+
+    with _cache_lock:
+        _remember(_base_cache, sf_id, (base_version, base_lines))
+        _remember(_cache, sf_id, (version, track))
+    return track
+
+
+def invalidate_track(subtitle_file_id: str):
+    """Drop a cached track (e.g. after its files were rewritten or deleted)."""
+    with _cache_lock:
+        _cache.pop(subtitle_file_id, None)
+        _base_cache.pop(subtitle_file_id, None)
+
+
+def encode_cursor(subtitle_file_id: str, line_number: int) -> str:
+    raw = json.dumps({"sf": subtitle_file_id, "ln": line_number}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Decode a cursor into (subtitle_file_id, line_number). Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(data["sf"]), int(data["ln"])
+    except Exception:
+        raise ValueError("Invalid cursor")
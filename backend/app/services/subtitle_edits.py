@@ -0,0 +1,404 @@
+"""Append-only edit log for subtitle files changed in the editor.
+
+Editor saves append a small JSON delta per batch to a per-file log in storage
+(`subtitle_edits/<subtitle_file_id>.jsonl`) instead of rewriting the whole
+subtitle file. Reads merge the log over the cached parsed track;
+compaction folds the log into new versions of the translated (and, for timing
+edits, the original) file. Every edit is an absolute value, so replaying a
+batch that was already folded in is harmless.
+
+On backends without an atomic rename (S3) each batch is its own object instead
+(`subtitle_edits/<subtitle_file_id>/<time_ns>-<uuid>.json`): compaction folds the
+objects it listed and deletes exactly those, so a batch saved meanwhile stays pending.
+"""
+
+import json
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+import structlog
+
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+from app.services.blob_store import is_blob_key
+from app.services.storage import get_r2_storage
+from app.services.subtitle_parser import parse_stored_subtitle, srt_time_to_ms, format_time_srt, write_srt, write_ass
+
+logger = structlog.get_logger()
+
+EDITABLE_FIELDS = ("translated_text", "start_time", "end_time")
+
+# Striped process-local locks (keyed by hash of the subtitle file id)
+_local_locks = [threading.Lock() for _ in range(32)]
+_redis_client = None
+# Batches appended since the last compaction, when Redis is unreachable (per process)
+_local_batches: dict[str, int] = {}
+
+# Redis lock expiry; callers that need the folded files wait up to this long
+_LOCK_TIMEOUT_SECONDS = 300
+
+
+def edit_log_key(subtitle_file_id: str) -> str:
+    return f"subtitle_edits/{subtitle_file_id}.jsonl"
+
+
+def _compacting_key(subtitle_file_id: str) -> str:
+    return f"subtitle_edits/{subtitle_file_id}.jsonl.compacting"
+
+
+def _batch_prefix(subtitle_file_id: str) -> str:
+    return f"subtitle_edits/{subtitle_file_id}/"
+
+
+def _batch_keys(storage, subtitle_file_id: str) -> list[str]:
+    """Pending per-batch objects in append order (backends without atomic rename)."""
+    return storage.list_keys(_batch_prefix(subtitle_file_id))
+
+
+def normalize_edit(value) -> dict | None:
+    """Normalize one editor edit (legacy string or dict). Raises ValueError on bad timings."""
+    if isinstance(value, str):
+        return {"translated_text": value}
+    if not isinstance(value, dict):
+        return None
+    edit = {k: value[k] for k in EDITABLE_FIELDS if k in value}
+    if "translated_text" in edit and not isinstance(edit["translated_text"], str):
+        raise ValueError(f"Invalid translated_text: {edit['translated_text']!r}")
+    for field in ("start_time", "end_time"):
+        if field in edit:
+            try:
+                edit[field] = format_time_srt(srt_time_to_ms(str(edit[field])))
+            except (ValueError, IndexError):
+                raise ValueError(f"Invalid {field}: {edit[field]!r}")
+    return edit or None
+
+
+def log_versions(subtitle_file_id: str) -> tuple:
+    """Change token of the pending log files (used in read cache keys)."""
+    storage = get_r2_storage()
+    if not storage.atomic_rename:
+        # Batch keys are unique, so the listing itself is the version
+        return tuple(_batch_keys(storage, subtitle_file_id))
+    return (
+        storage.get_version(_compacting_key(subtitle_file_id)),
+        storage.get_version(edit_log_key(subtitle_file_id)),
+    )
+
+
+def has_pending_edits(subtitle_file_id: str) -> bool:
+    storage = get_r2_storage()
+    if not storage.atomic_rename:
+        return bool(_batch_keys(storage, subtitle_file_id))
+    return storage.exists(edit_log_key(subtitle_file_id)) or storage.exists(_compacting_key(subtitle_file_id))
+
+
+def _read_log(storage, key: str, into: dict[int, dict]) -> int:
+    """Merge a log file into `into` in append order. Returns number of batches read."""
+    try:
+        f = storage.open_read(key)
+    except Exception:
+        return 0
+    batches = 0
+    with f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn trailing write — ignore, the next append starts a fresh line
+                continue
+            batches += 1
+            for ln, edit in entry.get("edits", {}).items():
+                into.setdefault(int(ln), {}).update(edit)
+    return batches
+
+
+def read_pending_edits(subtitle_file_id: str) -> dict[int, dict]:
+    """All logged edits not yet folded into the stored files, keyed by line number."""
+    storage = get_r2_storage()
+    edits: dict[int, dict] = {}
+    if not storage.atomic_rename:
+        for key in _batch_keys(storage, subtitle_file_id):
+            _read_log(storage, key, edits)
+        return edits
+    _read_log(storage, _compacting_key(subtitle_file_id), edits)
+    _read_log(storage, edit_log_key(subtitle_file_id), edits)
+    return edits
+
+
+def _batch_counter_key(subtitle_file_id: str) -> str:
+    return f"subtitle_edits:batches:{subtitle_file_id}"
+
+
+def _count_batch(subtitle_file_id: str) -> int:
+    """Count one appended batch; returns the batches since the last compaction."""
+    try:
+        pipe = _redis().pipeline()
+        pipe.incr(_batch_counter_key(subtitle_file_id))
+        pipe.expire(_batch_counter_key(subtitle_file_id), 7 * 24 * 3600)
+        return pipe.execute()[0]
+    except Exception as e:
+        logger.warning("edit_batch_count_failed", subtitle_file_id=subtitle_file_id, error=str(e))
+        _local_batches[subtitle_file_id] = _local_batches.get(subtitle_file_id, 0) + 1
+        return _local_batches[subtitle_file_id]
+
+
+def _reset_batch_count(subtitle_file_id: str):
+    _local_batches.pop(subtitle_file_id, None)
+    try:
+        _redis().delete(_batch_counter_key(subtitle_file_id))
+    except Exception as e:
+        logger.warning("edit_batch_count_failed", subtitle_file_id=subtitle_file_id, error=str(e))
+
+
+def append_edits(subtitle_file_id: str, line_edits: dict[int, dict]) -> int:
+    """Append one batch of normalized edits. Returns the number of batches since the last compaction."""
+    storage = get_r2_storage()
+    entry = {"ts": time.time(), "edits": {str(ln): edit for ln, edit in line_edits.items()}}
+    data = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    if storage.atomic_rename:
+        storage.append(edit_log_key(subtitle_file_id), data)
+    else:
+        # Zero-padded ns timestamp first, so listing order is append order
+        storage.upload(f"{_batch_prefix(subtitle_file_id)}{time.time_ns():020d}-{uuid.uuid4().hex}.json", data)
+    return _count_batch(subtitle_file_id)
+
+
+def apply_edits(lines: list[dict], edits: dict[int, dict]) -> list[dict]:
+    """Overlay logged edits on merged editor lines (see subtitle_cache). Unedited lines are shared."""
+    if not edits:
+        return lines
+    out = []
+    for line in lines:
+        edit = edits.get(line["line_number"])
+        if not edit:
+            out.append(line)
+            continue
+        line = dict(line)
+        if "translated_text" in edit:
+            line["translated_text"] = edit["translated_text"]
+            line["is_translated"] = bool(edit["translated_text"])
+        if "start_time" in edit:
+            line["start_time"] = edit["start_time"]
+            line["start_ms"] = srt_time_to_ms(edit["start_time"])
+        if "end_time" in edit:
+            line["end_time"] = edit["end_time"]
+            line["end_ms"] = srt_time_to_ms(edit["end_time"])
+        out.append(line)
+    return out
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.from_url(get_settings().redis_broker_url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis_client
+
+
+@contextmanager
+def _lock(name: str, blocking_timeout: float):
+    """Serialize work on `name` across threads (local lock) and processes (Redis lock).
+    Yields whether the Redis lock was acquired within `blocking_timeout`."""
+    with _local_locks[hash(name) % len(_local_locks)]:
+        lock = None
+        try:
+            lock = _redis().lock(name, timeout=_LOCK_TIMEOUT_SECONDS, blocking_timeout=blocking_timeout)
+            acquired = lock.acquire()
+        except Exception as e:
+            logger.warning("subtitle_edits_lock_unavailable", lock=name, error=str(e))
+            lock = None
+            acquired = True  # Redis down: API and workers can't coordinate, fall back to process-local lock
+        try:
+            yield acquired
+        finally:
+            if lock is not None and acquired:
+                try:
+                    lock.release()
+                except Exception:
+                    pass
+
+
+def _compaction_lock(subtitle_file_id: str, blocking_timeout: float = 30):
+    return _lock(f"subtitle_edits:compact:{subtitle_file_id}", blocking_timeout)
+
+
+def edit_lock(project_id: str):
+    """Held by editor saves from the If-Match check until the batch is appended, so two
+    clients with the same ETag can't both pass the check. Yields whether it was acquired."""
+    return _lock(f"subtitle_edits:write:{project_id}", 10)
+
+
+def _store_rendered(storage, key: str, lines: list[dict], fmt: str, out_ext: str):
+    """Write `lines` as a subtitle file and move it into storage at `key`."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=out_ext) as tf:
+        tmp = Path(tf.name)
+    try:
+        if fmt in ("ass", "ssa"):
+            write_ass(lines, str(tmp))
+        else:
+            write_srt(lines, str(tmp), use_translated=False)
+        storage.move_file(key, str(tmp), content_type="text/plain")
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _fold(sb, storage, sub_file: dict, edits: dict[int, dict]):
+    """Write new translated/original files with `edits` applied."""
+    sf_id = sub_file["id"]
+    fmt = (sub_file.get("format") or "srt").lower()
+    file_url = sub_file["file_url"]
+    original_lines = parse_stored_subtitle(storage, file_url, fmt)
+
+    translated_url = sub_file.get("translated_file_url")
+    existing_translations: dict[int, str] = {}
+    if translated_url:
+        try:
+            tr_parsed = parse_stored_subtitle(storage, translated_url, fmt)
+            existing_translations = {l["line_number"]: l["original_text"] for l in tr_parsed}
+        except Exception as e:
+            logger.warning("edit_compaction_read_translated_failed", sf_id=sf_id, error=str(e))
+
+    for ln, edit in edits.items():
+        if "translated_text" in edit:
+            existing_translations[ln] = edit["translated_text"]
+
+    out_lines = []
+    orig_out_lines = []
+    has_timing_edits = False
+    for line in original_lines:
+        ln = line["line_number"]
+        edit = edits.get(ln, {})
+        start = edit.get("start_time", line["start_time"])
+        end = edit.get("end_time", line["end_time"])
+        if start != line["start_time"] or end != line["end_time"]:
+            has_timing_edits = True
+        out_lines.append({
+            "line_number": ln,
+            "start_time": start,
+            "end_time": end,
+            "original_text": existing_translations.get(ln, line["original_text"]),
+        })
+        orig_out_lines.append({
+            "line_number": ln,
+            "start_time": start,
+            "end_time": end,
+            "original_text": line["original_text"],
+        })
+
+    out_ext = f".{fmt}" if fmt in ("ass", "ssa") else ".srt"
+    project = sb.table("projects").select("user_id").eq("id", sub_file["project_id"]).single().execute()
+    translated_key = storage.get_storage_key(
+        project.data["user_id"], sub_file["project_id"], "subtitle", f"translated_{sf_id}{out_ext}"
+    )
+    _store_rendered(storage, translated_key, out_lines, fmt, out_ext)
+    if translated_key != translated_url:
+        sb.table("subtitle_files").update({"translated_file_url": translated_key}).eq("id", sf_id).execute()
+
+    # Timing edits also apply to the original source track
+    if has_timing_edits:
+        if is_blob_key(file_url):
+            # Deduplicated track shared with other projects: write this project's own copy
+            own_key = storage.get_storage_key(
+                project.data["user_id"], sub_file["project_id"], "subtitle", f"original_{sf_id}{out_ext}"
+            )
+            _store_rendered(storage, own_key, orig_out_lines, fmt, out_ext)
+            sb.table("subtitle_files").update({"file_url": own_key}).eq("id", sf_id).execute()
+        else:
+            _store_rendered(storage, file_url, orig_out_lines, fmt, out_ext)
+
+
+def compact_edits(subtitle_file_id: str, wait: bool = True) -> int:
+    """Fold the edit log of one subtitle file into new file versions.
+    Returns the number of edited lines folded in (0 if there was nothing to do).
+
+    With `wait` (exports, translation, downloads: callers about to read the files) a
+    compaction already running elsewhere is waited for, so its edits are in the files on
+    return; if the lock still can't be taken, RuntimeError is raised rather than letting
+    the caller read stale files. Background compactions (wait=False) reschedule instead."""
+    if not has_pending_edits(subtitle_file_id):
+        return 0
+
+    sb = get_supabase_admin()
+    storage = get_r2_storage()
+    log_key = edit_log_key(subtitle_file_id)
+    compacting_key = _compacting_key(subtitle_file_id)
+
+    blocking_timeout = _LOCK_TIMEOUT_SECONDS + 10 if wait else 30
+    with _compaction_lock(subtitle_file_id, blocking_timeout) as acquired:
+        if not acquired:
+            logger.info("edit_compaction_busy", subtitle_file_id=subtitle_file_id, wait=wait)
+            if wait:
+                raise RuntimeError(f"Edit compaction of {subtitle_file_id} is still running")
+            # The running compaction may miss batches appended after it started
+            schedule_compaction(subtitle_file_id, countdown=get_settings().subtitle_edit_compact_seconds)
+            return 0
+
+        sub_file = sb.table("subtitle_files").select("*").eq("id", subtitle_file_id).maybeSingle().execute()
+        if not sub_file.data or not sub_file.data.get("file_url"):
+            # Subtitle file (or its project) was deleted — the log is orphaned
+            storage.delete(log_key)
+            storage.delete(compacting_key)
+            storage.delete_many(_batch_keys(storage, subtitle_file_id))
+            _reset_batch_count(subtitle_file_id)
+            return 0
+
+        # Appends from here on count towards the next compaction
+        _reset_batch_count(subtitle_file_id)
+
+        if not storage.atomic_rename:
+            # Only the listed batches are folded and deleted; later saves stay pending
+            batch_keys = _batch_keys(storage, subtitle_file_id)
+            edits: dict[int, dict] = {}
+            for key in batch_keys:
+                _read_log(storage, key, edits)
+            if edits:
+                _fold(sb, storage, sub_file.data, edits)
+            storage.delete_many(batch_keys)
+            logger.info("edit_log_compacted", subtitle_file_id=subtitle_file_id, batches=len(batch_keys), lines=len(edits))
+            return len(edits)
+
+        # A leftover .compacting log (from a crashed run) is folded first, then the live
+        # log is renamed and folded too, so callers get every pending edit.
+        folded: set[int] = set()
+        batches = 0
+        for _ in range(2):
+            leftover = storage.exists(compacting_key)
+            if not leftover and not storage.rename(log_key, compacting_key):
+                break
+            edits = {}
+            batches += _read_log(storage, compacting_key, edits)
+            if edits:
+                _fold(sb, storage, sub_file.data, edits)
+                folded.update(edits)
+                # The next fold starts from the files just written
+                sub_file = sb.table("subtitle_files").select("*").eq("id", subtitle_file_id).maybeSingle().execute()
+            storage.delete(compacting_key)
+            if not leftover:
+                break
+
+    logger.info("edit_log_compacted", subtitle_file_id=subtitle_file_id, batches=batches, lines=len(folded))
+    return len(folded)
+
+
+def _compact_quietly(subtitle_file_id: str):
+    try:
+        compact_edits(subtitle_file_id, wait=False)
+    except Exception as e:
+        logger.error("edit_compaction_failed", subtitle_file_id=subtitle_file_id, error=str(e))
+
+
+def schedule_compaction(subtitle_file_id: str, countdown: int = 0):
+    """Compact in the background (Celery, or a timer thread when Celery/Redis is unavailable)."""
+    try:
+        from app.workers.tasks import compact_subtitle_edits_task
+        compact_subtitle_edits_task.apply_async(args=[subtitle_file_id], countdown=countdown)
+    except Exception as e:
+        logger.warning("celery_unavailable_compaction_fallback_thread", subtitle_file_id=subtitle_file_id, error=str(e))
+        timer = threading.Timer(countdown, _compact_quietly, args=[subtitle_file_id])
+        timer.daemon = True
+        timer.start()
@@ -1,5 +1,7 @@
 import pysubs2
 import chardet
+import shutil
+import tempfile
 from pathlib import Path
 import structlog
 
@@ -47,6 +49,17 @@ def parse_subtitle_file(file_path: str) -> list[dict]:
     return lines
 
 
+def parse_stored_subtitle(storage, key: str, fmt: str) -> list[dict]:
+    """Stream a subtitle file from the storage backend into a temp file and parse it."""
+    with storage.open_read(key) as src, tempfile.NamedTemporaryFile(delete=False, suffix=f".{fmt}") as tf:
+        tmp = Path(tf.name)
+        shutil.copyfileobj(src, tf)
+    try:
+        return parse_subtitle_file(str(tmp))
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
 def format_time_srt(ms: int) -> str:
     """Convert milliseconds to SRT time format (HH:MM:SS,mmm)."""
     hours = ms // 3_600_000
@@ -1,16 +1,57 @@
-"""User external storage service — S3-compatible client for Cloudflare R2 and Backblaze B2."""
+"""User external storage service — S3-compatible client for Cloudflare R2 and Backblaze B2.
+
+Clients are cached per credential set (get_s3_client): building one costs a boto3
+session, endpoint resolution and a new connection pool, and the storage browser makes
+several calls per view. A changed config has a different fingerprint, so it gets a new
+client; old ones expire after USER_STORAGE_CLIENT_TTL_SECONDS.
+
+Bucket listings are cached per process for USER_STORAGE_LIST_CACHE_SECONDS. Our own
+writes bump a per-credentials generation in Redis (invalidate_listing), so a delete in
+the API or an export push in a worker invalidates every process's cached pages.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Iterator, Optional
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError, EndpointConnectionError
 import structlog
 
+from app.core.config import get_settings
+from app.core.supabase import get_supabase_admin
+
 logger = structlog.get_logger()
 
 # Backblaze B2 S3-compatible endpoint pattern
 B2_S3_ENDPOINT = "https://s3.{region}.backblazeb2.com"
 B2_DEFAULT_REGION = "us-west-004"
 
+# Config fields that identify a client (credentials + endpoint)
+_CLIENT_FIELDS = (
+    "provider", "r2_endpoint", "r2_account_id", "r2_access_key", "r2_secret_key_encrypted",
+    "b2_endpoint", "b2_key_id", "b2_app_key_encrypted",
+)
+_MAX_CLIENTS = 256
+
+# fingerprint -> (expires_at, client)
+_clients: dict[str, tuple[float, Any]] = {}
+_clients_lock = threading.Lock()
+
+# (fingerprint, bucket, prefix, delimiter, max_keys, cursor) -> (expires_at, generation, page)
+_listings: dict[tuple, tuple[float, tuple, dict]] = {}
+_listings_lock = threading.Lock()
+# Bumped on every invalidation in this process (covers Redis being unreachable)
+_local_generation = 0
+_MAX_LISTINGS = 1024
+_GENERATION_TTL_SECONDS = 24 * 3600
+
+_redis_client = None
+
 
 def _build_r2_client(config: dict):
     """Build an S3 client for Cloudflare R2."""
@@ -22,7 +63,7 @@ def _build_r2_client(config: dict):
         else:
             raise ValueError("R2 endpoint veya Account ID gerekli")
 
-    return boto3.client(
+    return boto3.session.Session().client(
         "s3",
         endpoint_url=endpoint,
         aws_access_key_id=config.get("r2_access_key") or "",
@@ -34,6 +75,7 @@ def _build_r2_client(config: dict):
             retries={"max_attempts": 2, "mode": "standard"},
             connect_timeout=10,
             read_timeout=15,
+            max_pool_connections=_pool_size(),
         ),
     )
 
@@ -62,7 +104,7 @@ def _build_b2_client(config: dict):
     except Exception:
         pass
 
-    return boto3.client(
+    return boto3.session.Session().client(
         "s3",
         endpoint_url=endpoint,
         aws_access_key_id=config.get("b2_key_id") or "",
@@ -74,11 +116,12 @@ def _build_b2_client(config: dict):
             retries={"max_attempts": 2, "mode": "standard"},
             connect_timeout=10,
             read_timeout=15,
+            max_pool_connections=_pool_size(),
         ),
     )
 
 
-def _get_bucket_name(config: dict) -> str:
+def get_bucket_name(config: dict) -> str:
     """Get bucket name from config based on provider."""
     provider = config.get("provider", "r2")
     if provider == "r2":
@@ -87,8 +130,39 @@ def _get_bucket_name(config: dict) -> str:
         return config.get("b2_bucket_name") or ""
 
 
+def _pool_size() -> int:
+    # Every parallel multipart part needs its own connection
+    return max(10, get_settings().storage_max_concurrency * 2)
+
+
+def transfer_config() -> TransferConfig:
+    """Managed transfers (upload_file / download_file / copy) for users' buckets: parallel
+    multipart parts of STORAGE_PART_SIZE_MB, STORAGE_MAX_CONCURRENCY at a time."""
+    settings = get_settings()
+    part_size = max(5, settings.storage_part_size_mb) * 1024 * 1024  # S3 minimum part size is 5 MB
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max(1, settings.storage_max_concurrency),
+        use_threads=True,
+    )
+
+
+def get_active_config(user_id: str) -> Optional[dict]:
+    """The user's active user_storage_configs row, or None."""
+    result = (
+        get_supabase_admin().table("user_storage_configs")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("is_active", True)
+        .maybeSingle()
+        .execute()
+    )
+    return result.data
+
+
 def build_s3_client(config: dict):
-    """Build an S3-compatible client based on provider type."""
+    """Build an S3-compatible client based on provider type (uncached; see get_s3_client)."""
     provider = config.get("provider", "r2")
     if provider == "r2":
         return _build_r2_client(config)
@@ -98,14 +172,47 @@ def build_s3_client(config: dict):
         raise ValueError(f"Desteklenmeyen depolama sağlayıcısı: {provider}")
 
 
+def _fingerprint(config: dict) -> str:
+    fields = {f: config.get(f) or "" for f in _CLIENT_FIELDS}
+    fields["provider"] = fields["provider"] or "r2"
+    raw = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_s3_client(config: dict):
+    """Cached client for this config's credentials and endpoint (boto3 clients are thread-safe)."""
+    key = _fingerprint(config)
+    now = time.monotonic()
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        # Built under the lock: boto3 session/client creation isn't thread-safe
+        client = build_s3_client(config)
+        if len(_clients) >= _MAX_CLIENTS:
+            for k in [k for k, (expires, _) in _clients.items() if expires <= now] or [next(iter(_clients))]:
+                del _clients[k]
+        _clients[key] = (now + get_settings().user_storage_client_ttl_seconds, client)
+        return client
+
+
+def invalidate_s3_client(config: Optional[dict] = None):
+    """Drop the cached client for `config` (all clients if None)."""
+    with _clients_lock:
+        if config is None:
+            _clients.clear()
+        else:
+            _clients.pop(_fingerprint(config), None)
+
+
 def test_connection(config: dict) -> dict:
     """
     Test the storage connection by performing a HeadBucket + PutObject + DeleteObject.
     Returns {"ok": True/False, "message": str, "details": ...}
     """
     try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
+        client = get_s3_client(config)
+        bucket = get_bucket_name(config)
         if not bucket:
             return {"ok": False, "message": "Bucket adı belirtilmemiş"}
 
@@ -156,37 +263,116 @@ def test_connection(config: dict) -> dict:
         return {"ok": False, "message": f"Bağlantı hatası: {str(e)[:200]}"}
 
 
-def list_bucket_files(config: dict, prefix: str = "", max_keys: int = 200) -> dict:
-    """
-    List files in the user's bucket.
-    Returns {"ok": True, "files": [...], "truncated": bool}
-    """
-    try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
-        if not bucket:
-            return {"ok": False, "files": [], "message": "Bucket adı belirtilmemiş"}
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.from_url(get_settings().redis_broker_url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis_client
+
 
-        params = {"Bucket": bucket, "MaxKeys": max_keys}
-        if prefix:
-            params["Prefix"] = prefix
+def _generation_key(fingerprint: str) -> str:
+    return f"storage-list-gen:{fingerprint}"
 
-        response = client.list_objects_v2(**params)
 
-        files = []
-        for obj in response.get("Contents", []):
-            files.append({
+def _listing_generation(fingerprint: str) -> tuple:
+    """Cached pages are valid while this is unchanged: the shared (Redis) counter bumped
+    by invalidate_listing in any process, plus this process's own counter."""
+    try:
+        shared = _redis().get(_generation_key(fingerprint))
+    except Exception as e:
+        logger.warning("user_storage_list_generation_failed", error=str(e))
+        shared = None
+    return (shared, _local_generation)
+
+
+def _list_page(config: dict, bucket: str, prefix: str, delimiter: str, max_keys: int, cursor: Optional[str]) -> dict:
+    """One ListObjectsV2 page ({"files", "folders", "next_cursor"}), cached for
+    USER_STORAGE_LIST_CACHE_SECONDS per (credentials, bucket, prefix, delimiter, page)."""
+    ttl = get_settings().user_storage_list_cache_seconds
+    fingerprint = _fingerprint(config)
+    cache_key = (fingerprint, bucket, prefix, delimiter, max_keys, cursor or "")
+    now = time.monotonic()
+    # Read before listing: a write racing with the listing makes the stored page stale at once
+    generation = _listing_generation(fingerprint) if ttl > 0 else ()
+    with _listings_lock:
+        cached = _listings.get(cache_key)
+    if cached and cached[0] > now and cached[1] == generation:
+        return cached[2]
+
+    params = {"Bucket": bucket, "MaxKeys": max_keys}
+    if prefix:
+        params["Prefix"] = prefix
+    if delimiter:
+        params["Delimiter"] = delimiter
+    if cursor:
+        params["ContinuationToken"] = cursor
+    response = get_s3_client(config).list_objects_v2(**params)
+
+    page = {
+        "files": [
+            {
                 "key": obj["Key"],
                 "size": obj["Size"],
                 "last_modified": obj["LastModified"].isoformat(),
                 "etag": obj.get("ETag", "").strip('"'),
-            })
+            }
+            for obj in response.get("Contents", [])
+        ],
+        "folders": [p["Prefix"] for p in response.get("CommonPrefixes", [])],
+        "next_cursor": response.get("NextContinuationToken") if response.get("IsTruncated") else None,
+    }
+    if ttl > 0:
+        with _listings_lock:
+            if len(_listings) >= _MAX_LISTINGS:
+                _listings.clear()
+            _listings[cache_key] = (now + ttl, generation, page)
+    return page
+
+
+def invalidate_listing(config: dict):
+    """Invalidate cached listings of this config's bucket(s) in every process. Called after
+    our own writes (delete, rename, export push); other changes show up after the TTL."""
+    global _local_generation
+    fingerprint = _fingerprint(config)
+    try:
+        pipe = _redis().pipeline()
+        pipe.incr(_generation_key(fingerprint))
+        pipe.expire(_generation_key(fingerprint), _GENERATION_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("user_storage_list_invalidate_failed", error=str(e))
+    with _listings_lock:
+        _local_generation += 1
+        for k in [k for k in _listings if k[0] == fingerprint]:
+            del _listings[k]
+
+
+def list_bucket_files(
+    config: dict,
+    prefix: str = "",
+    max_keys: int = 200,
+    cursor: Optional[str] = None,
+    delimiter: str = "",
+) -> dict:
+    """
+    List one page of files in the user's bucket. Pass `next_cursor` back as `cursor` for
+    the next page; with `delimiter="/"` sub-folders are returned in "folders".
+    Returns {"ok": True, "files": [...], "folders": [...], "truncated": bool, "next_cursor": str | None}
+    """
+    try:
+        bucket = get_bucket_name(config)
+        if not bucket:
+            return {"ok": False, "files": [], "message": "Bucket adı belirtilmemiş"}
 
+        page = _list_page(config, bucket, prefix, delimiter, max_keys, cursor)
         return {
             "ok": True,
-            "files": files,
-            "truncated": response.get("IsTruncated", False),
-            "count": len(files),
+            "files": page["files"],
+            "folders": page["folders"],
+            "truncated": page["next_cursor"] is not None,
+            "next_cursor": page["next_cursor"],
+            "count": len(page["files"]),
         }
 
     except ClientError as e:
@@ -196,15 +382,44 @@ def list_bucket_files(config: dict, prefix: str = "", max_keys: int = 200) -> di
         return {"ok": False, "files": [], "message": f"Hata: {str(e)[:200]}"}
 
 
+def iter_bucket_files(config: dict, prefix: str = "", delimiter: str = "", page_size: int = 1000) -> Iterator[dict]:
+    """Yield every file (and, with a delimiter, folder) under `prefix`, page by page, as
+    {"type": "file", ...} / {"type": "folder", "prefix": ...}. Errors end the stream
+    with a {"type": "error", "message": ...} item."""
+    bucket = get_bucket_name(config)
+    if not bucket:
+        yield {"type": "error", "message": "Bucket adı belirtilmemiş"}
+        return
+    cursor = None
+    while True:
+        try:
+            page = _list_page(config, bucket, prefix, delimiter, page_size, cursor)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            yield {"type": "error", "message": f"Listeleme hatası ({code}): {e.response['Error'].get('Message', '')}"}
+            return
+        except Exception as e:
+            yield {"type": "error", "message": f"Hata: {str(e)[:200]}"}
+            return
+        for folder in page["folders"]:
+            yield {"type": "folder", "prefix": folder}
+        for f in page["files"]:
+            yield {"type": "file", **f}
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+
 def delete_bucket_file(config: dict, key: str) -> dict:
     """Delete a file from the user's bucket."""
     try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
+        client = get_s3_client(config)
+        bucket = get_bucket_name(config)
         if not bucket:
             return {"ok": False, "message": "Bucket adı belirtilmemiş"}
 
         client.delete_object(Bucket=bucket, Key=key)
+        invalidate_listing(config)
         return {"ok": True, "message": f"Dosya silindi: {key}"}
 
     except ClientError as e:
@@ -216,20 +431,18 @@ def delete_bucket_file(config: dict, key: str) -> dict:
 def rename_bucket_file(config: dict, old_key: str, new_key: str) -> dict:
     """Rename (copy + delete) a file in the user's bucket."""
     try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
+        client = get_s3_client(config)
+        bucket = get_bucket_name(config)
         if not bucket:
             return {"ok": False, "message": "Bucket adı belirtilmemiş"}
 
-        # Copy to new key
-        client.copy_object(
-            Bucket=bucket,
-            CopySource={"Bucket": bucket, "Key": old_key},
-            Key=new_key,
-        )
+        # Copy to new key (managed copy: parallel multipart UploadPartCopy for large
+        # objects, which CopyObject can't do above 5 GB)
+        client.copy({"Bucket": bucket, "Key": old_key}, bucket, new_key, Config=transfer_config())
 
         # Delete old key
         client.delete_object(Bucket=bucket, Key=old_key)
+        invalidate_listing(config)
 
         return {"ok": True, "message": f"Dosya yeniden adlandırıldı: {old_key} → {new_key}"}
 
@@ -242,8 +455,8 @@ def rename_bucket_file(config: dict, old_key: str, new_key: str) -> dict:
 def get_presigned_url(config: dict, key: str, expires_in: int = 3600) -> dict:
     """Generate a presigned download URL for a file in the user's bucket."""
     try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
+        client = get_s3_client(config)
+        bucket = get_bucket_name(config)
         if not bucket:
             return {"ok": False, "message": "Bucket adı belirtilmemiş"}
 
@@ -272,8 +485,8 @@ def get_presigned_url(config: dict, key: str, expires_in: int = 3600) -> dict:
 def get_file_info(config: dict, key: str) -> dict:
     """Get metadata for a specific file in the user's bucket."""
     try:
-        client = build_s3_client(config)
-        bucket = _get_bucket_name(config)
+        client = get_s3_client(config)
+        bucket = get_bucket_name(config)
         if not bucket:
             return {"ok": False, "message": "Bucket adı belirtilmemiş"}
 
@@ -155,8 +155,9 @@ def create_web_preview(input_path: str, output_path: str) -> str:
 
 def needs_web_transcode(input_path: str) -> bool:
     """Check if a video file needs transcoding for browser playback.
-    Returns True if the container is not MP4/WebM or audio codec is not AAC/Opus."""
-    ext = Path(input_path).suffix.lower()
+    Returns True if the container is not MP4/WebM or audio codec is not AAC/Opus.
+    `input_path` may also be a (presigned) URL."""
+    ext = Path(input_path.split("?", 1)[0]).suffix.lower()
     if ext in (".mp4", ".webm"):
         # Even MP4 might have non-AAC audio, check codec
         try:
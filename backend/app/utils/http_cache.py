@@ -0,0 +1,78 @@
+"""ETag helpers for conditional GET (If-None-Match) and optimistic concurrency (If-Match)."""
+
+import hashlib
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+
+# Browsers keep the body but revalidate with If-None-Match on every use
+REVALIDATE = "private, no-cache"
+# Stored files whose key never gets new content (served by /files): browser only by default,
+# shared caches too with FILES_CDN_CACHE
+PRIVATE_IMMUTABLE = "private, max-age=31536000, immutable"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Stored files rewritten in place (FILES_CDN_CACHE): cacheable by CDNs, revalidated on every use
+FILE_REVALIDATE = "public, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from any JSON-serializable version parts (row timestamps, storage versions, ...)."""
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _tags(header: str) -> list[str]:
+    return [t.strip() for t in header.split(",") if t.strip()]
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """Whether an If-None-Match (weak comparison) / If-Match (strong) header matches etag."""
+    if not header:
+        return False
+    for tag in _tags(header):
+        if tag == "*":
+            return True
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set validator headers on `response`; return a 304 response if the client copy is current."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+    return None
+
+
+def file_validators(size: int, mtime: float) -> tuple[str, str]:
+    """(ETag, Last-Modified) of a stored file from its size and modification time."""
+    return make_etag(size, mtime), formatdate(mtime, usegmt=True)
+
+
+def file_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Conditional GET on a file: If-None-Match takes precedence over If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def require_match(request: Request, *etags: str, detail: str = "Resource changed since it was loaded"):
+    """Enforce If-Match (if sent) against the current ETag(s). Raises 412 on a stale client copy."""
+    header = request.headers.get("if-match")
+    if header is None:
+        return
+    if not any(etag_matches(header, etag, weak=False) for etag in etags):
+        raise HTTPException(status_code=412, detail=detail)
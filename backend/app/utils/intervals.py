@@ -0,0 +1,88 @@
+"""Static interval index for "which cues are active at time t" lookups.
+
+A centered interval tree over half-open [start, end) intervals. Built once per
+parsed subtitle track; point and range queries cost O(log n + k) where k is the
+number of matches, so playback sync stays cheap on 10k-cue tracks.
+"""
+
+import bisect
+
+
+class _Node:
+    __slots__ = ("center", "left", "right", "by_start", "starts", "by_end", "ends")
+
+    def __init__(self, center: int, members: list[tuple[int, int, int]]):
+        self.center = center
+        self.left: "_Node | None" = None
+        self.right: "_Node | None" = None
+        # Members sorted by start ascending / end descending, with parallel key arrays for bisect
+        self.by_start = sorted(members, key=lambda m: m[0])
+        self.starts = [m[0] for m in self.by_start]
+        self.by_end = sorted(members, key=lambda m: -m[1])
+        self.ends = [-m[1] for m in self.by_end]
+
+
+class IntervalIndex:
+    """Index of (start, end, item) intervals supporting stabbing and overlap queries.
+
+    Intervals are half-open: an interval is active at t when start <= t < end.
+    Zero-length intervals are widened to one unit so they are still found at their start.
+    Query results are item ids in ascending order.
+    """
+
+    def __init__(self, intervals: list[tuple[int, int, int]]):
+        normalized = [(s, max(e, s + 1), item) for s, e, item in intervals]
+        self._size = len(normalized)
+        self._root = self._build(normalized)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _build(self, members: list[tuple[int, int, int]]) -> "_Node | None":
+        if not members:
+            return None
+        points = sorted(p for s, e, _ in members for p in (s, e - 1))
+        center = points[len(points) // 2]
+        here, left, right = [], [], []
+        for m in members:
+            if m[1] <= center:
+                left.append(m)
+            elif m[0] > center:
+                right.append(m)
+            else:
+                here.append(m)
+        node = _Node(center, here)
+        node.left = self._build(left)
+        node.right = self._build(right)
+        return node
+
+    def at(self, t: int) -> list[int]:
+        """Items active at t."""
+        return self.overlapping(t, t + 1)
+
+    def overlapping(self, start: int, end: int) -> list[int]:
+        """Items whose interval intersects [start, end)."""
+        if end <= start:
+            return []
+        found: list[int] = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if end <= node.center:
+                # Every member contains center >= end > start, so only start < end matters
+                hi = bisect.bisect_left(node.starts, end)
+                found.extend(m[2] for m in node.by_start[:hi])
+                stack.append(node.left)
+            elif start > node.center:
+                # Every member starts at or before center < start, so only end > start matters
+                hi = bisect.bisect_left(node.ends, -start)
+                found.extend(m[2] for m in node.by_end[:hi])
+                stack.append(node.right)
+            else:
+                found.extend(m[2] for m in node.by_start)
+                stack.append(node.left)
+                stack.append(node.right)
+        found.sort()
+        return found
@@ -1,6 +1,8 @@
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import task_prerun, task_postrun
 from app.core.config import get_settings
+from app.core import query_metrics
 
 settings = get_settings()
 
@@ -43,6 +45,14 @@ celery_app.conf.update(
             "task": "app.workers.tasks.cleanup_expired_files_task",
             "schedule": crontab(minute="*/30"),  # Every 30 minutes
         },
+        "reconcile-storage-usage": {
+            "task": "app.workers.tasks.reconcile_storage_usage_task",
+            "schedule": crontab(minute=15, hour="*/6"),  # Every 6 hours
+        },
+        "refresh-admin-stats": {
+            "task": "app.workers.tasks.refresh_admin_stats_task",
+            "schedule": float(settings.admin_stats_refresh_seconds),
+        },
         "reset-monthly-usage": {
             "task": "app.workers.tasks.reset_monthly_usage",
             "schedule": crontab(hour=0, minute=0, day_of_month=1),  # 1st of each month
@@ -51,3 +61,14 @@ celery_app.conf.update(
 )
 
 celery_app.autodiscover_tasks(["app.workers"])
+
+
+@task_prerun.connect
+def _tag_task_queries(task=None, **_):
+    """Attribute PostgREST queries (slow_query log) to the running task."""
+    query_metrics.set_source(f"task:{task.name}" if task else None)
+
+
+@task_postrun.connect
+def _untag_task_queries(**_):
+    query_metrics.set_source(None)
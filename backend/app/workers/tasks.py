@@ -4,21 +4,34 @@ import asyncio
 import tempfile
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
+from typing import Optional
 import structlog
 
 from app.workers.celery_app import celery_app
 from app.core.supabase import get_supabase_admin
-from app.core.config import get_settings
+from app.core.security import invalidate_profile
 from app.services.translation import get_engine
-from app.services.subtitle_parser import parse_subtitle_file, write_srt, write_ass
+from app.services.subtitle_parser import parse_stored_subtitle, write_srt, write_ass
 from app.utils.ffmpeg import burn_subtitles, mux_subtitles, CODEC_MAP
 from app.services.storage import get_r2_storage
-from app.services.cleanup import cleanup_expired_files
+from app.services.cleanup import cleanup_expired_files, adjust_user_storage, reconcile_storage_usage
+from app.services.admin_stats import refresh_snapshot
+from app.services.subtitle_edits import compact_edits
+from app.services.job_progress import JobProgressWriter
+from app.services import blob_store, export_push, reference_cache
 from app.utils.chunking import build_chunks, apply_glossary_pre, apply_glossary_post, OVERLAP_LINES
 
 logger = structlog.get_logger()
 
 
+def _report_progress(task):
+    """JobProgressWriter on_flush hook: mirror flushed progress into the Celery task state."""
+    def report(fields: dict):
+        if "progress" in fields:
+            task.update_state(state="PROGRESS", meta={"progress": fields["progress"]})
+    return report
+
+
 @celery_app.task(bind=True, max_retries=2, default_retry_delay=30)
 def run_translation_task(
     self,
@@ -38,29 +51,29 @@ def run_translation_task(
     sb = get_supabase_admin()
     storage = get_r2_storage()
     loop = asyncio.new_event_loop()
+    job = JobProgressWriter(
+        sb, "translation_jobs", job_id,
+        on_flush=_report_progress(self),
+    )
 
     try:
-        sb.table("translation_jobs").update({
+        job.update({
             "status": "processing",
             "started_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        }, flush=True)
+
+        # Fold pending editor edits (timing changes) into the source track first
+        compact_edits(subtitle_file_id)
 
         # Read subtitle file from local storage
         sub_file = sb.table("subtitle_files").select("*").eq("id", subtitle_file_id).single().execute()
         if not sub_file.data or not sub_file.data.get("file_url"):
             raise RuntimeError("Subtitle file not found")
 
-        file_data = storage.download(sub_file.data["file_url"])
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{sub_file.data['format']}") as tf:
-            tmp_src = Path(tf.name)
-            tf.write(file_data)
-        try:
-            all_lines = parse_subtitle_file(str(tmp_src))
-        finally:
-            tmp_src.unlink(missing_ok=True)
+        all_lines = parse_stored_subtitle(storage, sub_file.data["file_url"], sub_file.data["format"])
 
         if not all_lines:
-            sb.table("translation_jobs").update({"status": "completed", "progress": 100}).eq("id", job_id).execute()
+            job.update({"status": "completed", "progress": 100})
             return {"status": "completed", "lines": 0}
 
         total_lines = len(all_lines)
@@ -77,8 +90,7 @@ def run_translation_task(
         start_time = time.time()
 
         for chunk_idx, chunk in enumerate(chunks):
-            job_check = sb.table("translation_jobs").select("status").eq("id", job_id).single().execute()
-            if job_check.data and job_check.data["status"] == "cancelled":
+            if job.is_cancelled():
                 sb.table("projects").update({"status": "ready"}).eq("id", project_id).execute()
                 return {"status": "cancelled"}
 
@@ -111,8 +123,7 @@ def run_translation_task(
                     context_lines.append(translated[j])
 
             progress = min(int((len(translated_map) / total_lines) * 100), 99)
-            sb.table("translation_jobs").update({"progress": progress, "translated_lines": len(translated_map)}).eq("id", job_id).execute()
-            self.update_state(state="PROGRESS", meta={"progress": progress})
+            job.update({"progress": progress, "translated_lines": len(translated_map)})
 
         # Build and save translated file (preserve original format: .ass or .srt)
         original_format = sub_file.data.get("format", "srt").lower()
@@ -131,35 +142,34 @@ def run_translation_task(
             write_srt(translated_lines_out, str(tmp_out), use_translated=False)
 
         translated_key = storage.get_storage_key(user_id, project_id, "subtitle", f"translated_{subtitle_file_id}{out_ext}")
-        with open(tmp_out, "rb") as f:
-            storage.upload(translated_key, f.read(), content_type="text/plain")
-        tmp_out.unlink(missing_ok=True)
+        storage.move_file(translated_key, str(tmp_out), content_type="text/plain")
 
         sb.table("subtitle_files").update({"translated_file_url": translated_key}).eq("id", subtitle_file_id).execute()
 
         elapsed_ms = int((time.time() - start_time) * 1000)
         try:
-            engine_config = sb.table("translation_engines").select("cost_per_line").eq("id", engine_id).single().execute()
-            cost_per_line = float(engine_config.data.get("cost_per_line", 0)) if engine_config.data else 0
+            engine_config = reference_cache.get_engine_config(engine_id)
+            cost_per_line = float(engine_config.get("cost_per_line") or 0) if engine_config else 0
         except Exception:
             cost_per_line = 0
 
-        sb.table("translation_jobs").update({
+        job.update({
             "status": "completed", "progress": 100, "translated_lines": total_lines,
             "duration_ms": elapsed_ms, "cost_usd": cost_per_line * total_lines, "completed_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        })
 
         sb.table("projects").update({"status": "translated", "translated_lines": total_lines}).eq("id", project_id).execute()
         sb.rpc("increment_lines_used", {"user_id_param": user_id, "lines_count": total_lines})
+        invalidate_profile(user_id)
 
         logger.info("translation_completed", job_id=job_id, lines=total_lines, chunks=len(chunks), elapsed_ms=elapsed_ms)
-        return {"status": "completed", "lines": total_lines, "elapsed_ms": elapsed_ms}
+        return {"status": "completed", "lines": total_lines, "elapsed_ms": elapsed_ms, "db_writes": job.stats()}
 
     except ValueError as e:
         # Non-retryable errors (model not found, invalid API key, etc.)
         error_msg = str(e)[:500]
         logger.error("translation_failed_permanent", job_id=job_id, error=error_msg)
-        sb.table("translation_jobs").update({"status": "failed", "error_message": error_msg}).eq("id", job_id).execute()
+        job.update({"status": "failed", "error_message": error_msg})
         sb.table("projects").update({"status": "ready"}).eq("id", project_id).execute()
         return {"status": "failed", "error": error_msg}
     except Exception as e:
@@ -177,10 +187,11 @@ def run_translation_task(
             elif "401" in error_msg or "auth" in error_msg.lower():
                 error_msg = "API anahtarı geçersiz. Lütfen ayarlardan kontrol edin."
         logger.error("translation_failed", job_id=job_id, error=error_msg)
-        sb.table("translation_jobs").update({"status": "failed", "error_message": error_msg}).eq("id", job_id).execute()
+        job.update({"status": "failed", "error_message": error_msg})
         sb.table("projects").update({"status": "ready"}).eq("id", project_id).execute()
         raise self.retry(exc=e)
     finally:
+        job.close()
         loop.close()
 
 
@@ -201,9 +212,11 @@ def run_export_task(
     """Celery task: export video with burned/muxed subtitles."""
     sb = get_supabase_admin()
     r2 = get_r2_storage()
-    settings = get_settings()
-    work_dir = settings.temp_path / f"export_{job_id}"
-    work_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = r2.ingest_dir(f"export_{job_id}")
+    job = JobProgressWriter(
+        sb, "export_jobs", job_id,
+        on_flush=_report_progress(self),
+    )
 
     _last_progress = [0]
 
@@ -211,34 +224,31 @@ def run_export_task(
         overall = 30 + int(pct * 0.6)
         if overall <= _last_progress[0]:
             return
-        if overall - _last_progress[0] < 2 and overall < 90:
-            return
         _last_progress[0] = overall
-        try:
-            sb.table("export_jobs").update({"progress": overall}).eq("id", job_id).execute()
-            self.update_state(state="PROGRESS", meta={"progress": overall})
-        except Exception as e:
-            logger.warning("export_progress_update_failed", job_id=job_id, progress=overall, error=str(e))
+        job.update({"progress": overall})
 
     try:
-        sb.table("export_jobs").update({
+        job.update({
             "status": "processing",
             "progress": 5,
-        }).eq("id", job_id).execute()
+        }, flush=True)
 
         project = sb.table("projects").select("*").eq("id", project_id).single().execute()
         if not project.data or not project.data.get("file_url"):
             raise RuntimeError("Project source file not found")
 
-        sb.table("export_jobs").update({"progress": 10}).eq("id", job_id).execute()
+        job.update({"progress": 10})
 
+        # Source video: hardlinked / reflinked into the work dir, or read in place (no copy)
         source_ext = Path(project.data["file_name"]).suffix or ".mkv"
-        source_path = work_dir / f"source{source_ext}"
-        r2.copy_to(project.data["file_url"], str(source_path))
+        source_path = Path(r2.local_input(project.data["file_url"], str(work_dir / f"source{source_ext}")))
 
-        sb.table("export_jobs").update({"progress": 20}).eq("id", job_id).execute()
+        job.update({"progress": 20})
 
-        # Get translated subtitle file from storage
+        # Get translated subtitle file from storage (with pending editor edits folded in)
+        sub_files = sb.table("subtitle_files").select("id").eq("project_id", project_id).execute()
+        for sf in (sub_files.data or []):
+            compact_edits(sf["id"])
         sub_files = sb.table("subtitle_files").select("*").eq("project_id", project_id).execute()
         translated_url = None
         for sf in (sub_files.data or []):
@@ -248,17 +258,15 @@ def run_export_task(
         if not translated_url:
             raise RuntimeError("No translated subtitle file found")
 
-        sub_data = r2.download(translated_url)
         # Preserve original subtitle format extension (could be .ass, .ssa, .srt, .vtt)
         sub_ext = Path(translated_url).suffix or ".srt"
         sub_path = work_dir / f"translated{sub_ext}"
-        sub_path.write_bytes(sub_data)
+        r2.copy_to(translated_url, str(sub_path))
 
-        sb.table("export_jobs").update({"progress": 30}).eq("id", job_id).execute()
+        job.update({"progress": 30})
 
         # Check if cancelled before starting expensive FFmpeg encode
-        job_check = sb.table("export_jobs").select("status").eq("id", job_id).single().execute()
-        if job_check.data and job_check.data["status"] == "cancelled":
+        if job.is_cancelled(fresh=True):
             logger.info("export_cancelled_before_encode", job_id=job_id)
             sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
             return {"status": "cancelled"}
@@ -291,28 +299,27 @@ def run_export_task(
         elapsed_ms = int((time.time() - start_time) * 1000)
         output_size = output_path.stat().st_size
 
-        job_check = sb.table("export_jobs").select("status").eq("id", job_id).single().execute()
-        if job_check.data and job_check.data["status"] == "cancelled":
+        if job.is_cancelled(fresh=True):
             logger.info("export_cancelled_after_encode", job_id=job_id)
             sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
             return {"status": "cancelled"}
 
-        sb.table("export_jobs").update({"progress": 90}).eq("id", job_id).execute()
+        job.update({"progress": 90})
 
         # Get retention days
         try:
             profile = sb.table("profiles").select("plan_id").eq("id", user_id).single().execute()
             plan_id = profile.data.get("plan_id", "free") if profile.data else "free"
-            plan = sb.table("subscription_plans").select("retention_days").eq("id", plan_id).single().execute()
-            retention_days = plan.data.get("retention_days", 1) if plan.data else 1
+            plan = reference_cache.get_plan(plan_id)
+            retention_days = plan.get("retention_days", 1) if plan else 1
         except Exception:
             retention_days = 1
         expires_at = (datetime.now(timezone.utc) + timedelta(days=retention_days)).isoformat()
 
         storage_key = r2.get_storage_key(user_id, project_id, "export", f"{job_id}{output_ext}")
-        r2.upload_file(storage_key, str(output_path), content_type=f"video/{output_ext.lstrip('.')}")
+        r2.move_file(storage_key, str(output_path), content_type=f"video/{output_ext.lstrip('.')}")
 
-        sb.table("export_jobs").update({"progress": 95}).eq("id", job_id).execute()
+        job.update({"progress": 95})
 
         sb.table("stored_files").insert({
             "user_id": user_id,
@@ -323,30 +330,32 @@ def run_export_task(
             "cdn_url": r2.get_cdn_url(storage_key),
             "expires_at": expires_at,
         }).execute()
+        adjust_user_storage(sb, user_id, output_size)
 
-        sb.table("export_jobs").update({
+        job.update({
             "status": "completed",
             "progress": 100,
             "output_file_url": storage_key,
             "output_file_size_bytes": output_size,
             "duration_ms": elapsed_ms,
             "completed_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        })
 
         sb.table("projects").update({"status": "exported"}).eq("id", project_id).execute()
 
         logger.info("export_completed", job_id=job_id, size=output_size, elapsed_ms=elapsed_ms)
-        return {"status": "completed", "size": output_size, "elapsed_ms": elapsed_ms}
+        return {"status": "completed", "size": output_size, "elapsed_ms": elapsed_ms, "db_writes": job.stats()}
 
     except Exception as e:
         logger.error("export_failed", job_id=job_id, error=str(e))
-        sb.table("export_jobs").update({
+        job.update({
             "status": "failed",
             "error_message": str(e)[:500],
-        }).eq("id", job_id).execute()
+        })
         sb.table("projects").update({"status": "translated"}).eq("id", project_id).execute()
         raise self.retry(exc=e)
     finally:
+        job.close()
         shutil.rmtree(work_dir, ignore_errors=True)
 
 
@@ -358,6 +367,7 @@ def run_project_processing_task(
     work_dir: str,
     ext: str,
     plan_data: dict,
+    content_hash: Optional[str] = None,
 ):
     """Celery task: process uploaded source video and extract subtitle tracks."""
     from app.api.routes.projects import _process_video_project
@@ -368,10 +378,40 @@ def run_project_processing_task(
         work_dir=work_dir,
         ext=ext,
         plan_data=plan_data,
+        content_hash=content_hash,
     )
     return {"status": "processed", "project_id": project_id}
 
 
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def push_export_task(self, job_id: str, user_id: str, dest_key: str | None = None):
+    """Celery task: upload an export to the user's own bucket. Retries resume the
+    multipart upload from the parts already in the bucket."""
+    def report(state: dict):
+        self.update_state(state="PROGRESS", meta={"progress": state["progress"]})
+
+    try:
+        state = export_push.push_export(job_id, user_id, dest_key, on_progress=report)
+        return {"status": "completed", "key": state["key"], "size": state["size"]}
+    except export_push.PushError as e:
+        logger.warning("export_push_rejected", job_id=job_id, error=str(e))
+        export_push.fail(job_id, user_id, str(e))
+        return {"status": "failed", "error": str(e)}
+    except Exception as e:
+        logger.error("export_push_failed", job_id=job_id, error=str(e), attempt=self.request.retries + 1)
+        if self.request.retries >= self.max_retries:
+            export_push.fail(job_id, user_id, str(e))
+            return {"status": "failed", "error": str(e)[:500]}
+        raise self.retry(exc=e)
+
+
+@celery_app.task
+def compact_subtitle_edits_task(subtitle_file_id: str):
+    """Fold a subtitle file's editor edit log into new file versions."""
+    lines = compact_edits(subtitle_file_id, wait=False)
+    return {"subtitle_file_id": subtitle_file_id, "lines": lines}
+
+
 @celery_app.task
 def reset_monthly_usage():
     """Scheduled task: reset all users' monthly line usage (run via cron)."""
@@ -388,3 +428,20 @@ def cleanup_expired_files_task():
     return {"deleted": deleted}
 
 
+@celery_app.task
+def reconcile_storage_usage_task():
+    """Scheduled task: repair drift in the incrementally maintained profiles.storage_used_bytes
+    (and in blob reference counts when STORAGE_DEDUP is on)."""
+    drifted = reconcile_storage_usage()
+    if blob_store.enabled():
+        return {"drifted": drifted, "orphan_blobs": blob_store.reconcile_blobs()}
+    return {"drifted": drifted}
+
+
+@celery_app.task
+def refresh_admin_stats_task():
+    """Scheduled task: recompute the admin dashboard statistics snapshot."""
+    snapshot = refresh_snapshot()
+    return {"computed_at": snapshot["computed_at"]}
+
+
@@ -0,0 +1,40 @@
+-- Admin dashboard statistics aggregated inside Postgres (one round trip, no row transfer)
+-- Called by the refresh_admin_stats_task beat task; see app/services/admin_stats.py
+
+CREATE OR REPLACE FUNCTION admin_stats_snapshot()
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT jsonb_build_object(
+    'total_users', (SELECT count(*) FROM profiles),
+    'total_projects', (SELECT count(*) FROM projects),
+    'total_translation_jobs', (SELECT count(*) FROM translation_jobs),
+    'total_export_jobs', (SELECT count(*) FROM export_jobs),
+    'active_jobs', (SELECT count(*) FROM translation_jobs WHERE status IN ('queued', 'processing')),
+    'failed_jobs', (SELECT count(*) FROM translation_jobs WHERE status = 'failed'),
+    'file_type_breakdown', COALESCE((
+      SELECT jsonb_object_agg(file_type, jsonb_build_object('count', n, 'bytes', total))
+        FROM (
+          SELECT file_type, count(*) AS n, COALESCE(sum(file_size_bytes), 0) AS total
+            FROM stored_files
+           WHERE NOT uploaded_to_user_storage
+           GROUP BY file_type
+        ) t
+    ), '{}'::jsonb),
+    'top_users', COALESCE((
+      SELECT jsonb_agg(to_jsonb(u) ORDER BY u.storage_used_bytes DESC NULLS LAST)
+        FROM (
+          SELECT id, full_name, plan_id, storage_used_bytes, daily_jobs_used
+            FROM profiles
+           ORDER BY storage_used_bytes DESC NULLS LAST
+           LIMIT 20
+        ) u
+    ), '[]'::jsonb)
+  );
+$$;
+
+-- Backend (service role) only
+REVOKE EXECUTE ON FUNCTION admin_stats_snapshot() FROM PUBLIC, anon, authenticated;
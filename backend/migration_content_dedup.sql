@@ -0,0 +1,104 @@
+-- Content-addressed storage (STORAGE_DEDUP=true, app/services/blob_store.py)
+-- storage_blobs: one row per stored blob with its reference count
+-- stored_files.content_hash: the blob a row references (NULL for per-project files)
+
+ALTER TABLE stored_files ADD COLUMN IF NOT EXISTS content_hash text;
+CREATE INDEX IF NOT EXISTS idx_stored_files_content_hash ON stored_files (content_hash) WHERE content_hash IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS storage_blobs (
+  hash text PRIMARY KEY,
+  storage_path text NOT NULL,
+  size_bytes bigint NOT NULL DEFAULT 0,
+  ref_count integer NOT NULL DEFAULT 0,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Backend (service role) only: no policies
+ALTER TABLE storage_blobs ENABLE ROW LEVEL SECURITY;
+
+-- Take a reference, creating the blob row if needed.
+-- ref_count = 1 means the caller must store the object at storage_path.
+CREATE OR REPLACE FUNCTION acquire_blob(hash_param text, storage_path_param text, size_param bigint)
+RETURNS TABLE (storage_path text, ref_count integer)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  INSERT INTO storage_blobs AS b (hash, storage_path, size_bytes, ref_count)
+  VALUES (hash_param, storage_path_param, size_param, 1)
+  ON CONFLICT (hash) DO UPDATE
+     SET ref_count = b.ref_count + 1,
+         updated_at = now()
+  RETURNING b.storage_path, b.ref_count;
+$$;
+
+-- Take a reference to an existing blob only (no row = not stored yet)
+CREATE OR REPLACE FUNCTION reuse_blob(hash_param text)
+RETURNS TABLE (storage_path text, size_bytes bigint)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE storage_blobs b
+     SET ref_count = b.ref_count + 1,
+         updated_at = now()
+   WHERE b.hash = hash_param
+  RETURNING b.storage_path, b.size_bytes;
+$$;
+
+-- Drop a reference. Returns the remaining count (NULL if the blob is unknown);
+-- at 0 the row is deleted and the caller deletes the object.
+CREATE OR REPLACE FUNCTION release_blob(hash_param text)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  remaining integer;
+BEGIN
+  UPDATE storage_blobs
+     SET ref_count = GREATEST(ref_count - 1, 0),
+         updated_at = now()
+   WHERE hash = hash_param
+  RETURNING ref_count INTO remaining;
+
+  IF remaining = 0 THEN
+    DELETE FROM storage_blobs WHERE hash = hash_param AND ref_count = 0;
+  END IF;
+  RETURN remaining;
+END;
+$$;
+
+-- Repair reference counts from stored_files and remove unreferenced blobs.
+-- Blobs touched in the last day are skipped: their stored_files rows may not be
+-- written yet (references are taken before a project's rows are inserted).
+CREATE OR REPLACE FUNCTION reconcile_blob_refs()
+RETURNS TABLE (hash text, storage_path text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  UPDATE storage_blobs b
+     SET ref_count = (
+           SELECT count(*)
+             FROM stored_files f
+            WHERE f.content_hash = b.hash
+              AND NOT f.uploaded_to_user_storage
+         )
+   WHERE b.updated_at < now() - interval '1 day';
+
+  RETURN QUERY
+  DELETE FROM storage_blobs b
+   WHERE b.ref_count = 0
+     AND b.updated_at < now() - interval '1 day'
+  RETURNING b.hash, b.storage_path;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION acquire_blob(text, text, bigint) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reuse_blob(text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION release_blob(text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reconcile_blob_refs() FROM PUBLIC, anon, authenticated;
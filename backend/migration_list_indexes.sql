@@ -0,0 +1,13 @@
+-- Indexes backing keyset pagination on list endpoints (app/core/pagination.py)
+-- Lists are ordered by (created_at DESC, id DESC) within the filtered owner/project
+
+CREATE INDEX IF NOT EXISTS idx_projects_user_created ON projects (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stored_files_user_created ON stored_files (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_glossary_terms_user_created ON glossary_terms (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_translation_jobs_project_created ON translation_jobs (project_id, created_at DESC, id DESC);
+
+-- Admin lists (all rows, optionally filtered by status / file type)
+CREATE INDEX IF NOT EXISTS idx_profiles_created ON profiles (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_translation_jobs_created ON translation_jobs (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_export_jobs_created ON export_jobs (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stored_files_created ON stored_files (created_at DESC, id DESC);
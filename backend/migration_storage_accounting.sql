@@ -0,0 +1,47 @@
+-- Incremental storage accounting for profiles.storage_used_bytes
+-- adjust_storage_used: atomic delta applied after every stored_files insert/delete
+-- reconcile_storage_used: set-based repair of drift (run periodically by Celery beat)
+
+CREATE OR REPLACE FUNCTION adjust_storage_used(user_id_param uuid, delta_param bigint)
+RETURNS bigint
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE profiles
+     SET storage_used_bytes = GREATEST(COALESCE(storage_used_bytes, 0) + delta_param, 0)
+   WHERE id = user_id_param
+  RETURNING storage_used_bytes;
+$$;
+
+CREATE OR REPLACE FUNCTION reconcile_storage_used()
+RETURNS TABLE (user_id uuid, old_bytes bigint, new_bytes bigint)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH actual AS (
+    SELECT p.id,
+           COALESCE(SUM(f.file_size_bytes) FILTER (WHERE NOT f.uploaded_to_user_storage), 0)::bigint AS total
+      FROM profiles p
+      LEFT JOIN stored_files f ON f.user_id = p.id
+     GROUP BY p.id
+  ), drift AS (
+    SELECT p.id, p.storage_used_bytes::bigint AS old_bytes, a.total
+      FROM profiles p
+      JOIN actual a ON a.id = p.id
+     WHERE p.storage_used_bytes IS DISTINCT FROM a.total
+  )
+  UPDATE profiles p
+     SET storage_used_bytes = d.total
+    FROM drift d
+   WHERE p.id = d.id
+  RETURNING p.id, d.old_bytes, d.total;
+$$;
+
+-- Backend (service role) only
+REVOKE EXECUTE ON FUNCTION adjust_storage_used(uuid, bigint) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reconcile_storage_used() FROM PUBLIC, anon, authenticated;
+
+-- Bring existing rows in line once
+SELECT count(*) FROM reconcile_storage_used();
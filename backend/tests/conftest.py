@@ -0,0 +1,25 @@
+"""Shared fixtures."""
+
+import pytest
+
+
+@pytest.fixture
+def s3_storage(monkeypatch, tmp_path):
+    """S3Storage on a moto-mocked bucket."""
+    moto = pytest.importorskip("moto")
+    from app.core.config import get_settings
+    from app.services.s3_storage import S3Storage
+
+    monkeypatch.setenv("R2_ENDPOINT", "https://s3.us-east-1.amazonaws.com")
+    monkeypatch.setenv("R2_BUCKET_NAME", "subtranslate-test")
+    monkeypatch.setenv("R2_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("R2_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("R2_REGION", "us-east-1")
+    monkeypatch.setenv("STORAGE_DIR", str(tmp_path / "storage"))
+    monkeypatch.setenv("TEMP_DIR", str(tmp_path / "temp"))
+    get_settings.cache_clear()
+    with moto.mock_aws():
+        storage = S3Storage()
+        storage.client.create_bucket(Bucket=storage.bucket)
+        yield storage
+    get_settings.cache_clear()
@@ -0,0 +1,88 @@
+"""get_current_user when the Supabase Auth API fails."""
+
+import asyncio
+import time
+
+import httpx
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app.core import security
+from app.core.config import get_settings
+from app.core.supabase import AsyncSupabaseAuthAdmin
+
+SECRET = "test-secret-that-is-long-enough-for-hs256"
+
+
+class _FakeAuthClient:
+    """Enough of AsyncSupabaseClient for AsyncSupabaseAuthAdmin.get_user."""
+
+    auth_url = "https://example.supabase.co/auth/v1"
+    headers = {}
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.auth = type("Auth", (), {})()
+        self.auth.admin = AsyncSupabaseAuthAdmin(self)
+
+    async def send(self, method, url, **kwargs):
+        body = {"id": "u1", "email": "u1@example.com"} if self.status_code == 200 else {"msg": "error"}
+        return httpx.Response(self.status_code, json=body)
+
+
+@pytest.fixture
+def auth_api(monkeypatch):
+    def use(status_code: int, jwt_secret: str = ""):
+        monkeypatch.setenv("SUPABASE_JWT_SECRET", jwt_secret)
+        get_settings.cache_clear()
+        client = _FakeAuthClient(status_code)
+        monkeypatch.setattr(security, "get_supabase_async", lambda: client)
+        monkeypatch.setattr(security, "_session_checks", {})
+
+        async def profile(user_id):
+            return {"id": user_id}
+
+        monkeypatch.setattr(security, "get_profile_async", profile)
+
+    yield use
+    get_settings.cache_clear()
+
+
+def _token() -> str:
+    claims = {"sub": "u1", "aud": "authenticated", "exp": int(time.time()) + 300, "iat": int(time.time())}
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def _authenticate(token: str) -> dict:
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return asyncio.run(security.get_current_user(credentials))
+
+
+def test_remote_verification_outage_is_503(auth_api):
+    auth_api(503)
+    with pytest.raises(HTTPException) as e:
+        _authenticate(_token())
+    assert e.value.status_code == 503
+    assert "Retry-After" in e.value.headers
+
+
+def test_remote_verification_rejected_is_401(auth_api):
+    auth_api(401)
+    with pytest.raises(HTTPException) as e:
+        _authenticate(_token())
+    assert e.value.status_code == 401
+
+
+def test_session_check_outage_keeps_serving(auth_api):
+    # Locally verified token: the periodic session re-check hits a 503
+    auth_api(503, jwt_secret=SECRET)
+    assert _authenticate(_token())["id"] == "u1"
+
+
+def test_session_check_rejected_is_401(auth_api):
+    auth_api(401, jwt_secret=SECRET)
+    with pytest.raises(HTTPException) as e:
+        _authenticate(_token())
+    assert e.value.status_code == 401
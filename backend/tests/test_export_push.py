@@ -0,0 +1,75 @@
+"""Export push to the user's bucket: retries after the upload and the push claim."""
+
+import pytest
+
+from app.services import export_push
+
+JOB_ID = "job-1"
+USER_BUCKET = "user-bucket"
+EXPORT_KEY = "users/u1/p1/export/out.mp4"
+
+
+class _FakeQuery:
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class _FakeSupabase:
+    def table(self, name):
+        return _FakeQuery({"id": JOB_ID, "project_id": "p1", "status": "completed", "output_file_url": EXPORT_KEY})
+
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    def no_redis():
+        raise ConnectionError("no redis in tests")
+
+    monkeypatch.setattr(export_push, "_redis", no_redis)
+    monkeypatch.setattr(export_push, "_local_state", {})
+    monkeypatch.setattr(export_push, "_local_claims", {})
+
+
+@pytest.fixture
+def push(monkeypatch, s3_storage):
+    s3_storage.client.create_bucket(Bucket=USER_BUCKET)
+    s3_storage.client.put_object(Bucket=s3_storage.bucket, Key=EXPORT_KEY, Body=b"video")
+    monkeypatch.setattr(export_push, "get_supabase_admin", lambda: _FakeSupabase())
+    monkeypatch.setattr(export_push, "get_r2_storage", lambda: s3_storage)
+    monkeypatch.setattr(export_push, "get_active_config", lambda user_id: {"provider": "r2"})
+    monkeypatch.setattr(export_push, "get_bucket_name", lambda config: USER_BUCKET)
+    monkeypatch.setattr(export_push, "get_s3_client", lambda config: s3_storage.client)
+    monkeypatch.setattr(export_push, "invalidate_listing", lambda config: None)
+    return s3_storage
+
+
+def test_retry_after_upload_only_releases_files(push, monkeypatch):
+    def release_fails(project_id):
+        raise RuntimeError("supabase down")
+
+    monkeypatch.setattr(export_push, "mark_uploaded_to_user_storage", release_fails)
+    with pytest.raises(RuntimeError):
+        export_push.push_export(JOB_ID, "u1")
+    assert export_push.get_state(JOB_ID)["status"] == "completed"
+
+    # The export is gone, so uploading it again would fail with PushError
+    push.client.delete_object(Bucket=push.bucket, Key=EXPORT_KEY)
+    monkeypatch.setattr(export_push, "mark_uploaded_to_user_storage", lambda project_id: 3)
+    state = export_push.push_export(JOB_ID, "u1")
+
+    assert state["deleted_files"] == 3
+    body = push.client.get_object(Bucket=USER_BUCKET, Key="subtranslate/p1/out.mp4")["Body"].read()
+    assert body == b"video"
+
+
+def test_push_is_claimed_once_until_it_ends():
+    assert export_push.claim(JOB_ID)
+    assert not export_push.claim(JOB_ID)
+
+    export_push.fail(JOB_ID, "u1", "boom")
+    assert export_push.claim(JOB_ID)
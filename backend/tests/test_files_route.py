@@ -0,0 +1,52 @@
+"""/files on the local storage backend."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "STORAGE_DIR", tmp_path)
+    (tmp_path / ".ingest" / "p1").mkdir(parents=True)
+    (tmp_path / ".ingest" / "p1" / "source.mp4").write_bytes(b"ingesting")
+    (tmp_path / "users" / "u1" / "p1" / "subtitle").mkdir(parents=True)
+    (tmp_path / "users" / "u1" / "p1" / "subtitle" / "original.srt").write_bytes(b"1\n")
+    return TestClient(main.app)
+
+
+def test_serves_stored_file(client):
+    resp = client.get("/files/users/u1/p1/subtitle/original.srt")
+    assert resp.status_code == 200
+    assert resp.content == b"1\n"
+
+
+@pytest.mark.parametrize("path", [
+    ".ingest/p1/source.mp4",
+    "users/%2E%2E/.ingest/p1/source.mp4",
+    "users/u1/%2E%2E/%2E%2E/.ingest/p1/source.mp4",
+])
+def test_ingest_dir_is_not_served(client, path):
+    assert client.get(f"/files/{path}").status_code == 404
+
+
+def test_path_outside_storage_is_rejected(client):
+    assert client.get("/files/users/%2E%2E/%2E%2E/etc/passwd").status_code == 403
+
+
+def test_user_files_are_private_by_default(client):
+    resp = client.get("/files/users/u1/p1/subtitle/original.srt")
+    assert resp.headers["cache-control"] == "private, no-cache"
+    assert "cdn-cache-control" not in resp.headers
+
+
+def test_cdn_cache_mode_marks_files_public(client, monkeypatch):
+    monkeypatch.setenv("FILES_CDN_CACHE", "true")
+    main.get_settings.cache_clear()
+    try:
+        resp = TestClient(main.create_app()).get("/files/users/u1/p1/subtitle/original.srt")
+    finally:
+        main.get_settings.cache_clear()
+    assert resp.headers["cache-control"] == "public, no-cache"
+    assert resp.headers["cdn-cache-control"] == "public, no-cache"
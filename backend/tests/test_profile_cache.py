@@ -0,0 +1,50 @@
+"""Auth profile cache invalidation across processes (reference_cache channel)."""
+
+import json
+
+import pytest
+
+from app.core import security
+from app.services import reference_cache
+
+
+class _FakePublisher:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, channel, message):
+        self.messages.append((channel, json.loads(message)))
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    fake = _FakePublisher()
+    monkeypatch.setattr(reference_cache, "_publisher", fake)
+    monkeypatch.setattr(reference_cache, "_ensure_listener", lambda: None)
+    monkeypatch.setattr(security, "_profile_cache", {})
+    return fake
+
+
+def test_invalidate_profile_publishes(publisher):
+    security._remember_profile("u1", {"id": "u1"})
+    security.invalidate_profile("u1")
+
+    assert security._cached_profile("u1") is None
+    assert publisher.messages == [(reference_cache.INVALIDATION_CHANNEL, {"kind": "profile", "key": "u1"})]
+
+
+def test_message_from_another_process_evicts(publisher):
+    security._remember_profile("u1", {"id": "u1"})
+    security._remember_profile("u2", {"id": "u2"})
+
+    # What the listener does with {"kind": "profile", "key": "u1"}
+    reference_cache._drop_local("profile", "u1")
+
+    assert security._cached_profile("u1") is None
+    assert security._cached_profile("u2") == {"id": "u2"}
+
+
+def test_listener_reconnect_drops_all_profiles(publisher):
+    security._remember_profile("u1", {"id": "u1"})
+    reference_cache._drop_local(None, None)
+    assert security._cached_profile("u1") is None
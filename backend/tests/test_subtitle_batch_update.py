@@ -0,0 +1,79 @@
+"""PATCH /subtitles/batch optimistic concurrency (If-Match)."""
+
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException, Response
+from starlette.requests import Request
+
+from app.api.routes import projects
+from app.services import subtitle_edits
+
+ROWS = {
+    "projects": {"id": "p1"},
+    "subtitle_files": [{"id": "sf1", "project_id": "p1", "file_url": "users/u1/p1/subtitle/original.srt"}],
+}
+
+
+class _FakeQuery:
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class _FakeSupabase:
+    def table(self, name):
+        return _FakeQuery(ROWS[name])
+
+
+@pytest.fixture
+def log(monkeypatch):
+    """Edit log stand-in: the ETag is the number of appended batches."""
+    appended = []
+
+    def append_edits(sf_id, line_edits):
+        time.sleep(0.2)  # Widen the window between the If-Match check and the append
+        appended.append(line_edits)
+        return 2
+
+    def no_redis():
+        raise ConnectionError("no redis in tests")
+
+    monkeypatch.setattr(projects, "get_supabase_admin", lambda: _FakeSupabase())
+    monkeypatch.setattr(projects, "_subtitles_etag", lambda files: f'"v{len(appended)}"')
+    monkeypatch.setattr(projects, "append_edits", append_edits)
+    monkeypatch.setattr(projects, "schedule_compaction", lambda *args, **kwargs: None)
+    monkeypatch.setattr(subtitle_edits, "_redis", no_redis)
+    return appended
+
+
+def _save(if_match: str, text: str):
+    request = Request({"type": "http", "method": "PATCH", "headers": [(b"if-match", if_match.encode())]})
+    return projects.batch_update_subtitles(
+        "p1", request, Response(), updates={"edits": {"sf1_1": text}}, user={"id": "u1"},
+    )
+
+
+def test_concurrent_saves_with_same_etag(log):
+    results = []
+
+    def save(text):
+        try:
+            results.append(_save('"v0"', text)["updated"])
+        except HTTPException as e:
+            results.append(e.status_code)
+
+    threads = [threading.Thread(target=save, args=(text,)) for text in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results) == [1, 412]
+    assert len(log) == 1
@@ -0,0 +1,120 @@
+"""Subtitle edit log on S3: per-batch objects and compaction."""
+
+import pytest
+
+from app.services import subtitle_edits
+
+SF_ID = "sf-1"
+
+
+class _FakeQuery:
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class _FakeSupabase:
+    def table(self, name):
+        return _FakeQuery({"id": SF_ID, "project_id": "p1", "file_url": "users/u1/p1/subtitle/original.srt"})
+
+
+@pytest.fixture
+def edits(monkeypatch, s3_storage):
+    monkeypatch.setattr(subtitle_edits, "get_r2_storage", lambda: s3_storage)
+    monkeypatch.setattr(subtitle_edits, "get_supabase_admin", lambda: _FakeSupabase())
+
+    def no_redis():
+        raise ConnectionError("no redis in tests")
+
+    monkeypatch.setattr(subtitle_edits, "_redis", no_redis)
+    return s3_storage
+
+
+def test_batches_are_separate_objects(edits):
+    subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "a"}})
+    subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "b"}, 2: {"translated_text": "c"}})
+
+    assert len(edits.list_keys(f"subtitle_edits/{SF_ID}/")) == 2
+    assert subtitle_edits.read_pending_edits(SF_ID) == {1: {"translated_text": "b"}, 2: {"translated_text": "c"}}
+
+
+def test_append_racing_compaction_is_kept(edits, monkeypatch):
+    subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "folded"}})
+    folded = []
+
+    def fold(sb, storage, sub_file, line_edits):
+        folded.append(dict(line_edits))
+        # An editor save lands while compaction is writing the new files
+        subtitle_edits.append_edits(SF_ID, {2: {"translated_text": "saved meanwhile"}})
+
+    monkeypatch.setattr(subtitle_edits, "_fold", fold)
+
+    assert subtitle_edits.compact_edits(SF_ID) == 1
+    assert folded == [{1: {"translated_text": "folded"}}]
+    assert subtitle_edits.read_pending_edits(SF_ID) == {2: {"translated_text": "saved meanwhile"}}
+    assert subtitle_edits.has_pending_edits(SF_ID)
+
+
+@pytest.fixture
+def local_edits(monkeypatch, tmp_path):
+    from app.services import storage as storage_module
+
+    monkeypatch.setattr(storage_module, "STORAGE_DIR", tmp_path)
+    local = storage_module.LocalStorage()
+    monkeypatch.setattr(subtitle_edits, "get_r2_storage", lambda: local)
+    monkeypatch.setattr(subtitle_edits, "get_supabase_admin", lambda: _FakeSupabase())
+
+    def no_redis():
+        raise ConnectionError("no redis in tests")
+
+    monkeypatch.setattr(subtitle_edits, "_redis", no_redis)
+    monkeypatch.setattr(subtitle_edits, "_local_batches", {})
+    return local
+
+
+def test_leftover_and_live_log_are_both_folded(local_edits, monkeypatch):
+    subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "crashed run"}})
+    local_edits.rename(subtitle_edits.edit_log_key(SF_ID), f"subtitle_edits/{SF_ID}.jsonl.compacting")
+    subtitle_edits.append_edits(SF_ID, {2: {"translated_text": "live"}})
+    folded = []
+    monkeypatch.setattr(subtitle_edits, "_fold", lambda sb, storage, sub_file, edits: folded.append(dict(edits)))
+
+    assert subtitle_edits.compact_edits(SF_ID) == 2
+    assert folded == [{1: {"translated_text": "crashed run"}}, {2: {"translated_text": "live"}}]
+    assert not subtitle_edits.has_pending_edits(SF_ID)
+
+
+def test_batch_count_restarts_after_compaction(local_edits, monkeypatch):
+    monkeypatch.setattr(subtitle_edits, "_fold", lambda *args: None)
+    assert subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "a"}}) == 1
+    assert subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "b"}}) == 2
+    subtitle_edits.compact_edits(SF_ID)
+    assert subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "c"}}) == 1
+
+
+@pytest.mark.parametrize("value", [None, 5, ["x"]])
+def test_translated_text_must_be_a_string(value):
+    with pytest.raises(ValueError):
+        subtitle_edits.normalize_edit({"translated_text": value})
+
+
+def test_waiting_caller_fails_instead_of_reading_stale_files(local_edits, monkeypatch):
+    subtitle_edits.append_edits(SF_ID, {1: {"translated_text": "a"}})
+
+    class _BusyLock:
+        def acquire(self):
+            return False
+
+    class _BusyRedis:
+        def lock(self, *args, **kwargs):
+            return _BusyLock()
+
+    monkeypatch.setattr(subtitle_edits, "_redis", lambda: _BusyRedis())
+    with pytest.raises(RuntimeError):
+        subtitle_edits.compact_edits(SF_ID)
+    assert subtitle_edits.has_pending_edits(SF_ID)
@@ -294,6 +294,7 @@ export default function SettingsPage() {
           }
         }
       }
+      await api.invalidateApiKeys().catch(() => {});
       toast.success("API anahtarları kaydedildi.");
     } catch {
       toast.error("Kaydetme başarısız.");
@@ -316,6 +317,7 @@ export default function SettingsPage() {
     const key = apiKeys[index];
     if (key.id && !key._isNew) {
       await supabase.from("user_api_keys").delete().eq("id", key.id);
+      await api.invalidateApiKeys().catch(() => {});
     }
     setApiKeys((prev) => {
       const next = prev.filter((_, i) => i !== index);
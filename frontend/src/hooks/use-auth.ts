@@ -3,7 +3,7 @@
 import { useEffect, useState, useCallback, useMemo, useRef } from "react";
 import { createClient } from "@/lib/supabase/client";
 import type { User, Session } from "@supabase/supabase-js";
-import type { UserProfile, SubscriptionPlan } from "@/lib/api";
+import { api, type UserProfile, type SubscriptionPlan } from "@/lib/api";
 
 interface AuthState {
   user: User | null;
@@ -167,6 +167,7 @@ export function useAuth() {
 
       // No session = not logged in
       if (!session?.user) {
+        api.clearCache();
         lastFetchedUserRef.current = null;
         fetchingRef.current = false;
         setState({
@@ -251,6 +252,7 @@ export function useAuth() {
 
   const signOut = useCallback(async () => {
     await supabase.auth.signOut();
+    api.clearCache();
     lastFetchedUserRef.current = null;
     fetchingRef.current = false;
     setState({
@@ -2,6 +2,8 @@ import { createClient } from "@/lib/supabase/client";
 
 const API_BASE = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 const API_REQUEST_TIMEOUT_MS = 15000;
+// Responses kept for If-None-Match revalidation (least recently used are dropped)
+const ETAG_CACHE_MAX_ENTRIES = 200;
 
 interface ApiOptions {
   method?: string;
@@ -12,6 +14,24 @@ interface ApiOptions {
 }
 
 class ApiClient {
+  // GET responses with an ETag, revalidated with If-None-Match (304 reuses the cached body)
+  // (Map iteration order is insertion order: re-inserting on use keeps it LRU)
+  private etagCache = new Map<string, { etag: string; data: unknown }>();
+
+  /** Drop cached responses (call on sign-out: they belong to the previous user). */
+  clearCache() {
+    this.etagCache.clear();
+  }
+
+  private rememberEtag(key: string, entry: { etag: string; data: unknown }) {
+    this.etagCache.delete(key);
+    this.etagCache.set(key, entry);
+    if (this.etagCache.size > ETAG_CACHE_MAX_ENTRIES) {
+      const oldest = this.etagCache.keys().next().value;
+      if (oldest !== undefined) this.etagCache.delete(oldest);
+    }
+  }
+
   private async getAuthHeaders(): Promise<Record<string, string>> {
     const supabase = createClient();
     const { data } = await supabase.auth.getSession();
@@ -33,6 +53,12 @@ class ApiClient {
       fetchHeaders["Content-Type"] = "application/json";
     }
 
+    const cacheKey = `${fetchHeaders.Authorization ?? ""} ${endpoint}`;
+    const cached = method === "GET" ? this.etagCache.get(cacheKey) : undefined;
+    if (cached) {
+      fetchHeaders["If-None-Match"] = cached.etag;
+    }
+
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), timeoutMs);
 
@@ -54,13 +80,23 @@ class ApiClient {
       clearTimeout(timeoutId);
     }
 
+    if (res.status === 304 && cached) {
+      this.rememberEtag(cacheKey, cached);
+      return cached.data as T;
+    }
+
     if (!res.ok) {
       const error = await res.json().catch(() => ({ detail: res.statusText }));
       throw new ApiError(res.status, error.detail || "Bir hata oluştu");
     }
 
     if (res.status === 204) return undefined as T;
-    return res.json();
+    const data = await res.json();
+    const etag = res.headers.get("ETag");
+    if (method === "GET" && etag) {
+      this.rememberEtag(cacheKey, { etag, data });
+    }
+    return data;
   }
 
   // Projects
@@ -148,6 +184,10 @@ class ApiClient {
     return this.request<TranslationJob[]>(`/api/translate/history/${projectId}`);
   }
 
+  invalidateApiKeys() {
+    return this.request("/api/translate/keys/invalidate", { method: "POST" });
+  }
+
   // Export
   createExportJob(body: ExportJobCreate) {
     return this.request<{ id: string; status: string }>("/api/export", {